@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# # Benchmark: json vs protobuf trip update feeds
+# Compares payload size and parse time of the /tripupdates/decoded (json) and /tripupdates (protobuf) feeds.
+#
+# usage:
+# python benchmark_gtfs_rt_formats.py --json recorded.json --protobuf recorded.pb
+# python benchmark_gtfs_rt_formats.py --json recorded.json      (protobuf payload is encoded from the json)
+# python benchmark_gtfs_rt_formats.py --trips 1500              (synthetic network-sized feed)
+
+import argparse
+import gzip
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/../src'))
+from gtfs_rt_feed import parseJsonFeed, parseProtobufFeed
+
+from google.protobuf import json_format
+from google.transit import gtfs_realtime_pb2
+
+
+def createSyntheticFeed(number_of_trips, stop_time_updates_per_trip):
+    random.seed(0)
+    lines = ['5', '21', '22', '23', '24', '26', '33', '34', '35', '36', '37', '38', '39', '40', '41', '42', '44', '45']
+
+    feed_message = gtfs_realtime_pb2.FeedMessage()
+    feed_message.header.gtfs_realtime_version = '2.0'
+    feed_message.header.timestamp = int(time.time())
+
+    for i in range(number_of_trips):
+        line = lines[i % len(lines)]
+        entity = feed_message.entity.add()
+        entity.id = str(i)
+        entity.trip_update.trip.trip_id = f'{line}-{i % 7}-{i}'
+        entity.trip_update.trip.route_id = f'{line}-{i % 7}'
+        entity.trip_update.trip.start_date = '20241014'
+        entity.trip_update.trip.schedule_relationship = gtfs_realtime_pb2.TripDescriptor.SCHEDULED
+        entity.trip_update.timestamp = int(time.time())
+        for stop_sequence in range(1, stop_time_updates_per_trip + 1):
+            stop_time_update = entity.trip_update.stop_time_update.add()
+            stop_time_update.stop_sequence = stop_sequence
+            stop_time_update.stop_id = str(100000 + stop_sequence)
+            stop_time_update.schedule_relationship = gtfs_realtime_pb2.TripUpdate.StopTimeUpdate.SCHEDULED
+            stop_time_update.arrival.delay = random.randint(-30, 300)
+            stop_time_update.arrival.time = int(time.time()) + stop_sequence * 120
+            stop_time_update.departure.delay = stop_time_update.arrival.delay + random.randint(0, 30)
+            stop_time_update.departure.time = stop_time_update.arrival.time + 30
+
+    return feed_message
+
+
+def measure(function, payload, repeats):
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function(payload)
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations), result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--json", action="store", help="Recorded /tripupdates/decoded response", default=None, type=str)
+    parser.add_argument("--protobuf", action="store", help="Recorded /tripupdates response", default=None, type=str)
+    parser.add_argument("--trips", action="store", help="Number of trips in the synthetic feed. Default: 1500", default=1500, type=int)
+    parser.add_argument("--stop-time-updates", action="store", help="Stop time updates per trip in the synthetic feed. Default: 25", default=25, type=int)
+    parser.add_argument("--repeats", action="store", help="Parse runs per format, the median is reported. Default: 5", default=5, type=int)
+    parser.add_argument("--lines", action="store", help="Comma separated relevant lines. Default: 22,26,5,23,21,24", default="22,26,5,23,21,24", type=str)
+    args = parser.parse_args()
+
+    relevant_trip_prefixes = [line + "-" for line in args.lines.split(",")]
+
+    if args.json is not None:
+        with open(args.json, 'rb') as json_file:
+            json_payload = json_file.read()
+        if args.protobuf is not None:
+            with open(args.protobuf, 'rb') as protobuf_file:
+                protobuf_payload = protobuf_file.read()
+        else:
+            feed_message = json_format.Parse(json_payload, gtfs_realtime_pb2.FeedMessage(), ignore_unknown_fields=True)
+            protobuf_payload = feed_message.SerializeToString()
+    else:
+        feed_message = createSyntheticFeed(args.trips, args.stop_time_updates)
+        json_payload = json_format.MessageToJson(feed_message).encode()
+        protobuf_payload = feed_message.SerializeToString()
+
+    json_duration, json_feed = measure(lambda payload: parseJsonFeed(payload, relevant_trip_prefixes), json_payload, args.repeats)
+    protobuf_duration, protobuf_feed = measure(lambda payload: parseProtobufFeed(payload, relevant_trip_prefixes), protobuf_payload, args.repeats)
+
+    print(f"{'format':<10}{'bytes':>12}{'gzip bytes':>12}{'parse ms':>12}{'trips':>8}")
+    print(f"{'json':<10}{len(json_payload):>12}{len(gzip.compress(json_payload)):>12}{json_duration * 1000:>12.1f}{len(json_feed['entity']):>8}")
+    print(f"{'protobuf':<10}{len(protobuf_payload):>12}{len(gzip.compress(protobuf_payload)):>12}{protobuf_duration * 1000:>12.1f}{len(protobuf_feed['entity']):>8}")
+    print(f"protobuf is {len(json_payload) / len(protobuf_payload):.1f}x smaller and parses {json_duration / protobuf_duration:.1f}x faster")
+
+    # both formats must produce the same trip updates
+    json_trip_updates = [entity['tripUpdate'] for entity in json_feed['entity']]
+    protobuf_trip_updates = [entity['tripUpdate'] for entity in protobuf_feed['entity']]
+    print(f"identical trip updates: {json_trip_updates == protobuf_trip_updates}")
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# # Benchmark: reading the gtfs tables with and without the schema of gtfs_schema.py
+# Writes a synthetic network-sized feed and the filtered feed the preprocessing writes from it, then reads every table
+# of feed_schema (preprocessing) and filtered_schema (extraction) three times: with read_csv and inferred types (previous loading),
+# with the columns and dtypes of the schema using the c parser of pandas, and the same with pyarrow.
+# Reports the load time and the memory of the resulting DataFrame,
+# and checks that the schema returns the same values as the inferred read for the columns it keeps.
+#
+# usage:
+# python benchmark_gtfs_schema_load.py --trips 100000
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/../src'))
+import preprocess_static
+from gtfs_schema import TableSchema, feed_schema, filtered_schema, readGtfsCsv
+from synthetic_gtfs import createSyntheticGtfs, writeSyntheticGtfs
+
+
+def measure(read):
+    start = time.perf_counter()
+    table = read()
+    duration = time.perf_counter() - start
+    return table, duration, table.memory_usage(deep=True).sum()
+
+
+# values as strings, empty values as ''
+def toStrings(table):
+    table = table.astype(object)
+    return table.where(table.notna(), '').astype(str).reset_index(drop=True)
+
+
+# same values, ignoring the dtype (e.g. int64 stop ids vs. string stop ids)
+def isSameContent(table, inferred_table):
+    return toStrings(table).equals(toStrings(inferred_table[list(table.columns)]))
+
+
+# the steps of preprocess_static.py
+def writeFilteredGtfs(gtfs_path, gtfs_filtered_path):
+    calendar, calendar_dates, routes, trips, stops, stop_times = preprocess_static.loadGtfs(gtfs_path)
+    routes = preprocess_static.filterRoutes(routes)
+    trips = preprocess_static.filterTrips(trips)
+    stop_times = preprocess_static.addServiceDaySeconds(preprocess_static.addArtificialDepartureDelay(preprocess_static.filterStopTimes(stop_times)))
+    trips = preprocess_static.addStartAndEndTimesToTrips(trips, stop_times)
+    service_day_trips = preprocess_static.getServiceDayTrips(calendar, calendar_dates, trips)
+    preprocess_static.saveFiltered(calendar, calendar_dates, routes, trips, stops, stop_times, service_day_trips, gtfs_filtered_path)
+
+
+def printLoadTimes(gtfs_path, schema):
+    print(f"{'table':<18}{'rows':>10}{'inferred ms':>13}{'MB':>8}{'schema c ms':>13}{'MB':>8}{'pyarrow ms':>12}{'MB':>8}{'same values':>13}")
+
+    for table_name, table_schema in schema.items():
+        csv_path = os.path.join(gtfs_path, f'{table_name}.txt')
+
+        inferred_table, inferred_duration, inferred_bytes = measure(lambda: pd.read_csv(csv_path))
+        c_table, c_duration, c_bytes = measure(lambda: readGtfsCsv(csv_path, TableSchema(table_schema.columns, 'c', table_schema.all_columns)))
+        arrow_table, arrow_duration, arrow_bytes = measure(lambda: readGtfsCsv(csv_path, TableSchema(table_schema.columns, 'pyarrow', table_schema.all_columns)))
+
+        same_values = isSameContent(c_table, inferred_table) and isSameContent(arrow_table, inferred_table)
+
+        print(f"{table_name:<18}{len(inferred_table):>10}{inferred_duration * 1000:>13.0f}{inferred_bytes / 1024 / 1024:>8.1f}"
+              f"{c_duration * 1000:>13.0f}{c_bytes / 1024 / 1024:>8.1f}{arrow_duration * 1000:>12.0f}{arrow_bytes / 1024 / 1024:>8.1f}{str(same_values):>13}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trips", action="store", help="Number of trips in the synthetic feed. Default: 100000", default=100000, type=int)
+    parser.add_argument("--stops-per-trip", action="store", help="Stop times per trip. Default: 25", default=25, type=int)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_path:
+        gtfs_path = os.path.join(work_path, 'gtfs_full')
+        gtfs_filtered_path = os.path.join(work_path, 'gtfs_filtered')
+        writeSyntheticGtfs(createSyntheticGtfs(args.trips, args.stops_per_trip), gtfs_path)
+        writeFilteredGtfs(gtfs_path, gtfs_filtered_path)
+
+        print("\ngtfs feed (preprocessing)")
+        printLoadTimes(gtfs_path, feed_schema)
+        print("\nfiltered feed (extraction)")
+        printLoadTimes(gtfs_filtered_path, filtered_schema)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# # Benchmark: whole-network ticks of extract_active_vehicles.py
+# Runs the preprocessing and the extraction with relevant_lines=all on a full gtfs feed, a recorded trip updates feed
+# replaces the realtime api, and checks that a tick (trip updates -> led matrix frame file) fits into the tick budget.
+# The median time of the stages of a tick (see StageTimer in extract_active_vehicles.py) shows which step to look at first.
+# Without --gtfs-zip a synthetic network-sized feed is used (see synthetic_gtfs.py), without --tripupdates every trip that is running
+# at the replayed time gets synthetic trip updates with random delays. A recorded feed only matches the gtfs zip it was recorded with.
+# The led mapping is src/statuscode_led_mapping.csv, so vehicles of unmapped lines are computed but not drawn.
+#
+# Run it on the target hardware (e.g. a raspberry pi) with the interval of the service as budget.
+#
+# usage:
+# python benchmark_network_tick.py --trips 100000 --budget 10
+# python benchmark_network_tick.py --gtfs-zip gtfs.zip --tripupdates recorded_tripupdates.json --now 2024-10-15T08:20:00
+
+import argparse
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+source_path = os.path.abspath(os.path.dirname(__file__) + '/../src')
+sys.path.append(source_path)
+# before the scripts are imported, they read it at import time
+os.environ['relevant_lines'] = 'all'
+
+
+class RecordedTripUpdatesFetcher(object):
+    def __init__(self, trip_updates):
+        self.trip_updates = trip_updates
+
+    def fetch(self, stage_timer=None):
+        return self.trip_updates, True
+
+
+def preprocess(gtfs_zip_path, gtfs_filtered_path):
+    import preprocess_static
+
+    calendar, calendar_dates, routes, trips, stops, stop_times = preprocess_static.loadGtfsFromZip(gtfs_zip_path)
+    stop_times = preprocess_static.addServiceDaySeconds(preprocess_static.addArtificialDepartureDelay(stop_times))
+    trips = preprocess_static.addStartAndEndTimesToTrips(trips, stop_times)
+    service_day_trips = preprocess_static.getServiceDayTrips(calendar, calendar_dates, trips)
+    preprocess_static.saveFiltered(calendar, calendar_dates, routes, trips, stops, stop_times, service_day_trips, gtfs_filtered_path)
+
+
+def readRecordedTripUpdates(trip_updates_path):
+    from gtfs_rt_feed import parseFeed
+
+    with open(trip_updates_path, 'rb') as trip_updates_file:
+        payload = trip_updates_file.read()
+    feed = parseFeed(payload, 'protobuf' if trip_updates_path.endswith('.pb') else 'json')
+    return [entity['tripUpdate'] for entity in feed['entity']]
+
+
+# trip updates for all trips that run at current_datetime, like the realtime api sends them
+def createRunningTripUpdates(static_data, current_datetime):
+    from benchmark_realtime_enrichment import createTripUpdates
+
+    current_seconds = current_datetime.hour * 3600 + current_datetime.minute * 60 + current_datetime.second
+    trips = static_data.trips
+    running_trip_ids = trips.loc[(trips['start_seconds'] <= current_seconds) & (current_seconds <= trips['end_seconds']), 'trip_id'].astype(str)
+    return createTripUpdates(static_data.stop_times.astype({'trip_id': str}), set(running_trip_ids))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--gtfs-zip", action="store", help="Full gtfs zip. Default: synthetic feed", default=None, type=str)
+    parser.add_argument("--tripupdates", action="store", help="Recorded trip updates feed, json or protobuf (.pb). Default: synthetic trip updates", default=None, type=str)
+    parser.add_argument("--now", action="store", nargs='+', help="Replayed times (ISO format). Default: several times on 2024-10-15, a service day of the synthetic feed",
+                        default=['2024-10-15T06:00:00', '2024-10-15T08:20:00', '2024-10-15T12:00:00', '2024-10-15T17:15:00', '2024-10-15T23:45:00'])
+    parser.add_argument("--trips", action="store", help="Number of trips in the synthetic feed. Default: 100000", default=100000, type=int)
+    parser.add_argument("--stops-per-trip", action="store", help="Stop times per trip. Default: 25", default=25, type=int)
+    parser.add_argument("--budget", action="store", help="Seconds a tick may take, the --interval of the service. Default: 10", default=10, type=float)
+    parser.add_argument("--repeats", action="store", help="Ticks per replayed time. Default: 5", default=5, type=int)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_path:
+        gtfs_zip_path = args.gtfs_zip
+        if gtfs_zip_path is None:
+            from synthetic_gtfs import createSyntheticGtfs, writeSyntheticGtfsZip
+            gtfs_zip_path = os.path.join(work_path, 'gtfs.zip')
+            writeSyntheticGtfsZip(createSyntheticGtfs(args.trips, args.stops_per_trip), gtfs_zip_path)
+
+        # the extraction reads gtfs_filtered and the led mapping from the working directory and writes the frame file there
+        gtfs_zip_path = os.path.abspath(gtfs_zip_path)
+        trip_updates_path = os.path.abspath(args.tripupdates) if args.tripupdates is not None else None
+        os.chdir(work_path)
+        shutil.copy(os.path.join(source_path, 'statuscode_led_mapping.csv'), work_path)
+
+        start = time.perf_counter()
+        preprocess(gtfs_zip_path, os.path.join(work_path, 'gtfs_filtered'))
+        preprocess_duration = time.perf_counter() - start
+
+        import extract_active_vehicles
+
+        static_data = extract_active_vehicles.StaticData()
+        start = time.perf_counter()
+        static_data.load()
+        load_duration = time.perf_counter() - start
+
+        recorded_trip_updates = readRecordedTripUpdates(trip_updates_path) if trip_updates_path is not None else None
+
+        results = []
+        for now in args.now:
+            current_datetime = datetime.datetime.fromisoformat(now)
+            trip_updates = recorded_trip_updates if recorded_trip_updates is not None else createRunningTripUpdates(static_data, current_datetime)
+            fetcher = RecordedTripUpdatesFetcher(trip_updates)
+
+            durations = []
+            stage_timers = []
+            for _ in range(args.repeats):
+                # a new output every tick, so every tick renders and writes the frame
+                led_matrix_output = extract_active_vehicles.LedMatrixOutput()
+                stage_timer = extract_active_vehicles.StageTimer()
+                start = time.perf_counter()
+                extract_active_vehicles.tick(static_data, fetcher, led_matrix_output, current_datetime, stage_timer)
+                durations.append(time.perf_counter() - start)
+                stage_timers.append(stage_timer)
+            results.append((now, len(trip_updates), durations, stage_timers))
+
+    print(f"\n{len(static_data.trips)} trips, {len(static_data.stop_times)} stop times on all lines")
+    print(f"preprocessing {preprocess_duration:.1f}s, static data load {load_duration:.2f}s")
+    tick_stages = ['filter', 'enrich', 'status', 'render', 'write']
+    print(f"{'now':<22}{'trip updates':>14}{'median ms':>12}{'max ms':>10}{'within budget':>15}" + ''.join(f"{stage + ' ms':>11}" for stage in tick_stages))
+    for now, number_of_trip_updates, durations, stage_timers in results:
+        stage_medians = [np.median([stage_timer.durations[stage] for stage_timer in stage_timers]) for stage in tick_stages]
+        print(f"{now:<22}{number_of_trip_updates:>14}{np.median(durations) * 1000:>12.0f}{max(durations) * 1000:>10.0f}{str(max(durations) <= args.budget):>15}"
+              + ''.join(f"{stage_median * 1000:>11.0f}" for stage_median in stage_medians))
+
+    worst_duration = max(max(durations) for _, _, durations, _ in results)
+    print(f"slowest tick {worst_duration:.2f}s, {worst_duration / args.budget * 100:.0f}% of the budget of {args.budget:.0f}s")
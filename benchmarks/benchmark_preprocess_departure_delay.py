@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# # Benchmark: artificial departure delay in preprocess_static.py
+# Compares the columnar integer seconds path with the previous row-wise apply (parse to datetime.time, add 15 seconds, isoformat).
+# The row-wise apply only runs on a sample of the stop_times and is extrapolated to the whole feed.
+#
+# usage:
+# python benchmark_preprocess_departure_delay.py --trips 20000 --reference-rows 20000
+
+import argparse
+import datetime
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/../src'))
+from preprocess_static import addArtificialDepartureDelay
+from synthetic_gtfs import createSyntheticGtfs
+
+
+# previous implementation, one datetime round trip per row
+def addArtificialDepartureDelayByRow(row):
+    timestring = row['departure_time']
+    departure_time_object = datetime.time(int(timestring[0:2]) % 24, int(timestring[3:5]), int(timestring[6:8]))
+    datetime_object = datetime.datetime(100, 1, 1, departure_time_object.hour, departure_time_object.minute, departure_time_object.second)
+    row['departure_time'] = (datetime_object + datetime.timedelta(seconds=15)).time().isoformat()
+    return row
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trips", action="store", help="Number of trips in the synthetic feed. Default: 20000", default=20000, type=int)
+    parser.add_argument("--stops-per-trip", action="store", help="Stop times per trip. Default: 25", default=25, type=int)
+    parser.add_argument("--reference-rows", action="store", help="Stop times processed with the row-wise apply. Default: 20000", default=20000, type=int)
+    args = parser.parse_args()
+
+    stop_times = createSyntheticGtfs(args.trips, args.stops_per_trip)['stop_times'][['trip_id', 'arrival_time', 'departure_time', 'stop_sequence', 'stop_id']]
+    print(f"{len(stop_times)} stop times")
+
+    start = time.perf_counter()
+    columnar_stop_times = addArtificialDepartureDelay(stop_times)
+    columnar_duration = time.perf_counter() - start
+
+    reference_stop_times = stop_times.iloc[:args.reference_rows]
+    start = time.perf_counter()
+    reference_stop_times = reference_stop_times.apply(addArtificialDepartureDelayByRow, axis=1)
+    reference_duration = (time.perf_counter() - start) * len(stop_times) / len(reference_stop_times)
+
+    print(f"row-wise apply (extrapolated): {reference_duration:.1f}s")
+    print(f"columnar: {columnar_duration:.3f}s")
+    print(f"speedup: {reference_duration / columnar_duration:.0f}x")
+
+    # the row-wise apply wraps times after midnight, the columnar path keeps them
+    sample = columnar_stop_times.iloc[:args.reference_rows]['departure_time']
+    after_midnight = sample >= '24:00:00'
+    print(f"identical before midnight: {sample[~after_midnight].equals(reference_stop_times['departure_time'][~after_midnight])}")
+    print(f"times after midnight in sample: {after_midnight.sum()}, e.g. {sample[after_midnight].head(1).tolist()} instead of {reference_stop_times['departure_time'][after_midnight].head(1).tolist()}")
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# # Benchmark: reading the gtfs zip in preprocess_static.py
+# Compares the previous ingestion (download the whole zip into memory, extract it, read every table completely and filter it afterwards)
+# with the streaming ingestion (download the zip to a file in chunks, read only the kept columns of the relevant rows chunk by chunk).
+# The synthetic network-sized zip is served from a local http server, each ingestion runs in a fresh process
+# that reports the time and the peak memory (RSS) it added, and both have to produce the same filtered tables.
+#
+# usage:
+# python benchmark_preprocess_streaming.py --trips 100000
+
+import argparse
+import filecmp
+import functools
+import http.server
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/../src'))
+
+table_names = ['calendar', 'calendar_dates', 'routes', 'trips', 'stops', 'stop_times']
+
+
+def ingestInChildProcess(ingest_mode, work_path):
+    # runs this script again in ingest mode and reads its measurements from stdout
+    output = subprocess.run([sys.executable, __file__, '--ingest', ingest_mode, '--path', work_path],
+                            check=True, capture_output=True, text=True).stdout
+    duration, max_rss_kilobytes = output.split()[-2:]
+    return float(duration), int(max_rss_kilobytes)
+
+
+# resident memory of this process in kilobytes, VmRSS: current, VmHWM: peak
+def getMemoryKilobytes(field):
+    with open('/proc/self/status') as status_file:
+        for line in status_file:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+
+
+def ingest(ingest_mode, work_path):
+    import preprocess_static
+    from http_client import createSession
+
+    # serves gtfs.zip from work_path
+    handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=work_path)
+    handler.log_message = lambda *args: None
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    gtfs_url = f'http://127.0.0.1:{server.server_address[1]}/gtfs.zip'
+    session = createSession()
+
+    output_path = os.path.join(work_path, ingest_mode)
+    baseline_rss_kilobytes = getMemoryKilobytes('VmRSS')
+
+    start = time.perf_counter()
+    if ingest_mode == 'extract':
+        preprocess_static.download_and_extract_zip(session, gtfs_url, os.path.join(output_path, 'gtfs_full'))
+        calendar, calendar_dates, routes, trips, stops, stop_times = preprocess_static.loadGtfs(os.path.join(output_path, 'gtfs_full'))
+        routes = preprocess_static.filterRoutes(routes)
+        trips = preprocess_static.filterTrips(trips)
+        stop_times = preprocess_static.filterStopTimes(stop_times)
+    else:
+        os.makedirs(output_path, exist_ok=True)
+        zip_path = os.path.join(output_path, 'gtfs.zip')
+        preprocess_static.download_zip(session, gtfs_url, zip_path)
+        calendar, calendar_dates, routes, trips, stops, stop_times = preprocess_static.loadGtfsFromZip(zip_path)
+    duration = time.perf_counter() - start
+
+    max_rss_kilobytes = getMemoryKilobytes('VmHWM') - baseline_rss_kilobytes
+    server.shutdown()
+
+    for table_name, table in zip(table_names, [calendar, calendar_dates, routes, trips, stops, stop_times]):
+        table.to_csv(os.path.join(output_path, f'{table_name}.txt'), index=False)
+    print(duration, max_rss_kilobytes)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trips", action="store", help="Number of trips in the synthetic feed. Default: 100000", default=100000, type=int)
+    parser.add_argument("--stops-per-trip", action="store", help="Stop times per trip. Default: 25", default=25, type=int)
+    parser.add_argument("--ingest", action="store", help=argparse.SUPPRESS, choices=['extract', 'stream'])
+    parser.add_argument("--path", action="store", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.ingest is not None:
+        ingest(args.ingest, args.path)
+        sys.exit()
+
+    from synthetic_gtfs import createSyntheticGtfs, writeSyntheticGtfsZip
+
+    with tempfile.TemporaryDirectory() as work_path:
+        writeSyntheticGtfsZip(createSyntheticGtfs(args.trips, args.stops_per_trip), os.path.join(work_path, 'gtfs.zip'))
+        print(f"{args.trips * args.stops_per_trip} stop times, zip {os.path.getsize(os.path.join(work_path, 'gtfs.zip')) / 1024 / 1024:.1f} MB")
+        print(f"{'ingestion':<12}{'time s':>10}{'peak rss MB':>14}")
+
+        for ingest_mode in ['extract', 'stream']:
+            duration, max_rss_kilobytes = ingestInChildProcess(ingest_mode, work_path)
+            print(f"{ingest_mode:<12}{duration:>10.2f}{max_rss_kilobytes / 1024:>14.1f}")
+
+        identical = all(filecmp.cmp(os.path.join(work_path, 'extract', f'{table_name}.txt'), os.path.join(work_path, 'stream', f'{table_name}.txt'), shallow=False)
+                        for table_name in table_names)
+        print(f"identical filtered tables: {identical}")
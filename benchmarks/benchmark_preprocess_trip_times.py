@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# # Benchmark: trip start and end times in preprocess_static.py
+# Compares the grouped pass over stop_times with the previous per-trip scan (boolean filter + sort for every trip).
+# The per-trip scan is O(trips x stop_times), so it only runs on a sample of the trips and is extrapolated to the whole feed.
+# The grouped pass also adds the start and end as service day seconds, so stop_times get the seconds columns of the preprocessing first
+# and the sample is compared on the time strings and the seconds.
+#
+# usage:
+# python benchmark_preprocess_trip_times.py --trips 20000 --reference-trips 300
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/../src'))
+from preprocess_static import addServiceDaySeconds, addStartAndEndTimesToTrips
+from synthetic_gtfs import createSyntheticGtfs
+
+
+# previous implementation, one scan of stop_times per trip
+def getTripStartTimeByScan(stop_times, trip_id, time_column='arrival_time'):
+    relevant_stop_times = stop_times.loc[stop_times['trip_id'] == trip_id]
+    relevant_stop_times = relevant_stop_times.sort_values(by=['stop_sequence'])
+    return relevant_stop_times.iloc[0].loc[time_column]
+
+def getTripEndTimeByScan(stop_times, trip_id, time_column='departure_time'):
+    relevant_stop_times = stop_times.loc[stop_times['trip_id'] == trip_id]
+    relevant_stop_times = relevant_stop_times.sort_values(by=['stop_sequence'])
+    return relevant_stop_times.iloc[-1].loc[time_column]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trips", action="store", help="Number of trips in the synthetic feed. Default: 20000", default=20000, type=int)
+    parser.add_argument("--stops-per-trip", action="store", help="Stop times per trip. Default: 25", default=25, type=int)
+    parser.add_argument("--reference-trips", action="store", help="Trips processed with the per-trip scan. Default: 300", default=300, type=int)
+    args = parser.parse_args()
+
+    gtfs = createSyntheticGtfs(args.trips, args.stops_per_trip)
+    trips = gtfs['trips'][['route_id', 'trip_id', 'service_id', 'trip_short_name']]
+    stop_times = addServiceDaySeconds(gtfs['stop_times'][['trip_id', 'arrival_time', 'departure_time', 'stop_sequence', 'stop_id']])
+    print(f"{len(trips)} trips, {len(stop_times)} stop times")
+
+    start = time.perf_counter()
+    grouped_trips = addStartAndEndTimesToTrips(trips, stop_times)
+    grouped_duration = time.perf_counter() - start
+
+    reference_trips = trips.iloc[:args.reference_trips].copy()
+    start = time.perf_counter()
+    reference_trips['start_time'] = reference_trips.apply(lambda row: getTripStartTimeByScan(stop_times, row['trip_id']), axis=1)
+    reference_trips['end_time'] = reference_trips.apply(lambda row: getTripEndTimeByScan(stop_times, row['trip_id']), axis=1)
+    reference_duration = (time.perf_counter() - start) * len(trips) / len(reference_trips)
+    # not timed, the previous implementation only read the time strings
+    reference_trips['start_seconds'] = reference_trips.apply(lambda row: getTripStartTimeByScan(stop_times, row['trip_id'], 'arrival_seconds'), axis=1)
+    reference_trips['end_seconds'] = reference_trips.apply(lambda row: getTripEndTimeByScan(stop_times, row['trip_id'], 'departure_seconds'), axis=1)
+
+    print(f"per-trip scan (extrapolated): {reference_duration:.1f}s")
+    print(f"grouped pass: {grouped_duration:.3f}s")
+    print(f"speedup: {reference_duration / grouped_duration:.0f}x")
+    print(f"identical output on sample: {grouped_trips.iloc[:args.reference_trips].equals(reference_trips.astype(grouped_trips.dtypes.to_dict()))}")
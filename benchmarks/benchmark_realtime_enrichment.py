@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# # Benchmark: realtime arrival and departure times in extract_active_vehicles.py
+# Compares the delay propagation into per-trip delay arrays (indexTripUpdates) + the vectorized lookup for all stop_times
+# with the previous gap filling (one list scan per stopSequence) + per-stop_time scan over all trip_updates,
+# for growing numbers of trips with sparse trip updates.
+# The reference scan uses the stopTimeUpdate of the matching stopSequence (the previous implementation always used the first one),
+# it only runs on the stop_times of a sample of the running trips and is extrapolated.
+# Afterwards, the same trip updates with stopId instead of stopSequence (allowed by gtfs-rt) are checked to give the same realtime times,
+# with an update of a stop the trip doesn't serve and one without stopId, which are skipped.
+#
+# usage:
+# python benchmark_realtime_enrichment.py --trips 20000 --reference-trips 40
+
+import argparse
+import copy
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/../src'))
+import preprocess_static
+from extract_active_vehicles import indexTripUpdates, enrichStopTimesWithRealtime
+from synthetic_gtfs import createSyntheticGtfs
+
+
+# previous implementation, scans the stopTimeUpdates for every stopSequence of a trip
+def fillStopTimeUpdatesByScan(trip_updates, stop_times):
+    for trip_update in trip_updates:
+        stop_times_for_trip = stop_times.loc[stop_times['trip_id'] == trip_update['trip']['tripId']]
+        if len(stop_times_for_trip) == 0:
+            continue
+        last_stop_sequence = int(stop_times_for_trip.sort_values(by=['stop_sequence']).iloc[-1]['stop_sequence'])
+
+        stop_time_updates = trip_update['stopTimeUpdate']
+        stop_time_updates_filled = []
+        current_trip_delay_seconds = 0
+        for stop_sequence in range(1, last_stop_sequence + 1):
+            existing_stop_time_updates = [stop_time_update for stop_time_update in stop_time_updates if stop_time_update['stopSequence'] == stop_sequence]
+            if len(existing_stop_time_updates) == 0:
+                stop_time_updates_filled.append({'stopSequence': stop_sequence, 'arrival': {'delay': current_trip_delay_seconds}, 'departure': {'delay': current_trip_delay_seconds}})
+                continue
+            existing_stop_time_update = existing_stop_time_updates[0]
+            arrival_delay = existing_stop_time_update['arrival']['delay'] if 'arrival' in existing_stop_time_update else current_trip_delay_seconds
+            current_trip_delay_seconds = arrival_delay
+            departure_delay = existing_stop_time_update['departure']['delay'] if 'departure' in existing_stop_time_update else current_trip_delay_seconds
+            current_trip_delay_seconds = departure_delay
+            stop_time_updates_filled.append({'stopSequence': stop_sequence, 'arrival': {'delay': arrival_delay}, 'departure': {'delay': departure_delay}})
+
+        trip_update['stopTimeUpdate'] = stop_time_updates_filled
+    return trip_updates
+
+# scans all trip_updates and stopTimeUpdates for every stop_time
+def calculateRealtimeByScan(trip_updates, stop_time, arrival_or_departure):
+    scheduled_time = stop_time[f'{arrival_or_departure}_seconds']
+
+    trip_updates_for_stop_time = [trip_update for trip_update in trip_updates if trip_update['trip']['tripId'] == stop_time['trip_id']]
+    if len(trip_updates_for_stop_time) == 0:
+        return scheduled_time
+
+    stop_time_updates_for_stop_time = [stop_time_update for stop_time_update in trip_updates_for_stop_time[0]['stopTimeUpdate']
+                                       if stop_time_update['stopSequence'] == stop_time['stop_sequence']]
+    if len(stop_time_updates_for_stop_time) == 0:
+        return scheduled_time
+
+    delay = stop_time_updates_for_stop_time[0][arrival_or_departure]['delay']
+    if arrival_or_departure == 'departure':
+        delay = max(delay - 15, 0)
+    return scheduled_time + delay
+
+
+# sparse trip_updates with random delays on some of the stops, like the realtime api sends them
+def createTripUpdates(stop_times, trip_ids):
+    random.seed(0)
+    trip_updates = []
+    for trip_id, stop_times_of_trip in stop_times.loc[stop_times['trip_id'].isin(trip_ids)].groupby('trip_id', sort=False):
+        delay = 0
+        stop_time_updates = []
+        for stop_sequence in stop_times_of_trip['stop_sequence']:
+            if random.random() < 0.7:
+                continue
+            stop_time_update = {'stopSequence': int(stop_sequence), 'scheduleRelationship': 'SCHEDULED'}
+            if random.random() < 0.8:
+                delay += random.randrange(-30, 60)
+                stop_time_update['arrival'] = {'delay': delay}
+            if random.random() < 0.8:
+                delay += random.randrange(0, 30)
+                stop_time_update['departure'] = {'delay': delay}
+            stop_time_updates.append(stop_time_update)
+        trip_updates.append({'trip': {'tripId': trip_id, 'scheduleRelationship': 'SCHEDULED'}, 'stopTimeUpdate': stop_time_updates})
+    return trip_updates
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trips", action="store", help="Number of trips in the synthetic feed. Default: 20000", default=20000, type=int)
+    parser.add_argument("--stops-per-trip", action="store", help="Stop times per trip. Default: 25", default=25, type=int)
+    parser.add_argument("--reference-trips", action="store", help="Running trips processed with the previous implementation. Default: 40", default=40, type=int)
+    args = parser.parse_args()
+
+    gtfs = createSyntheticGtfs(args.trips, args.stops_per_trip)
+    stop_times = preprocess_static.addServiceDaySeconds(preprocess_static.addArtificialDepartureDelay(gtfs['stop_times']))
+    trip_ids = stop_times['trip_id'].unique()
+
+    # the stop_times of the potentially running trips of a busy tick
+    running_stop_times = stop_times.loc[stop_times['trip_id'].isin(trip_ids[:1000])]
+    reference_stop_times = stop_times.loc[stop_times['trip_id'].isin(trip_ids[:args.reference_trips])]
+    print(f"{len(running_stop_times)} stop times of running trips")
+    print(f"{'trip updates':<14}{'scan ms (extrap.)':>20}{'indexed ms':>12}{'identical':>12}")
+
+    for number_of_trip_updates in [100, 1000, 5000, len(trip_ids)]:
+        # trips with trip updates, the running ones first
+        trip_updates = createTripUpdates(stop_times, trip_ids[:number_of_trip_updates])
+
+        start = time.perf_counter()
+        trip_delays = indexTripUpdates(trip_updates, running_stop_times)
+        enriched_stop_times = enrichStopTimesWithRealtime(trip_delays, running_stop_times)
+        indexed_duration = time.perf_counter() - start
+
+        start = time.perf_counter()
+        filled_trip_updates = fillStopTimeUpdatesByScan(copy.deepcopy(trip_updates), reference_stop_times)
+        reference_arrivals = [calculateRealtimeByScan(filled_trip_updates, stop_time, 'arrival') for _, stop_time in reference_stop_times.iterrows()]
+        reference_departures = [calculateRealtimeByScan(filled_trip_updates, stop_time, 'departure') for _, stop_time in reference_stop_times.iterrows()]
+        scan_duration = (time.perf_counter() - start) * len(running_stop_times) / len(reference_stop_times)
+
+        enriched_sample = enriched_stop_times.loc[reference_stop_times.index]
+        identical = (enriched_sample['arrival_realtime_seconds'].tolist() == reference_arrivals
+                     and enriched_sample['departure_realtime_seconds'].tolist() == reference_departures)
+
+        print(f"{len(trip_updates):<14}{scan_duration * 1000:>20.0f}{indexed_duration * 1000:>12.1f}{str(identical):>12}")
+
+    trip_updates = createTripUpdates(stop_times, trip_ids[:1000])
+    enriched_stop_times = enrichStopTimesWithRealtime(indexTripUpdates(trip_updates, running_stop_times), running_stop_times)
+    stop_ids = dict(zip(zip(stop_times['trip_id'], stop_times['stop_sequence']), stop_times['stop_id']))
+    stop_id_trip_updates = copy.deepcopy(trip_updates)
+    for trip_update in stop_id_trip_updates:
+        for stop_time_update in trip_update['stopTimeUpdate']:
+            stop_time_update['stopId'] = str(stop_ids[(trip_update['trip']['tripId'], stop_time_update.pop('stopSequence'))])
+    stop_id_trip_updates[0]['stopTimeUpdate'] += [{'stopId': 'unknown', 'arrival': {'delay': 999}}, {'arrival': {'delay': 999}}]
+    stop_id_enriched_stop_times = enrichStopTimesWithRealtime(indexTripUpdates(stop_id_trip_updates, running_stop_times), running_stop_times)
+    stop_id_identical = stop_id_enriched_stop_times[['arrival_realtime_seconds', 'departure_realtime_seconds']].equals(enriched_stop_times[['arrival_realtime_seconds', 'departure_realtime_seconds']])
+    print(f"stopId instead of stopSequence identical: {stop_id_identical}")
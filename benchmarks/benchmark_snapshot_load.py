@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# # Benchmark: loading the filtered gtfs feed from csv vs. the binary snapshot
+# Writes a synthetic network-sized feed through the preprocessing steps as csv files and as binary snapshot (see gtfs_snapshot.py),
+# then loads each of them in a fresh process and reports load time and the peak memory (RSS) the load added to that process.
+#
+# usage:
+# python benchmark_snapshot_load.py --trips 20000
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/../src'))
+
+
+def loadInChildProcess(load_mode, gtfs_filtered_path):
+    # runs this script again in load mode and reads its measurements from stdout
+    output = subprocess.run([sys.executable, __file__, '--load', load_mode, '--path', gtfs_filtered_path],
+                            check=True, capture_output=True, text=True).stdout
+    duration, max_rss_kilobytes = output.split()
+    return float(duration), int(max_rss_kilobytes)
+
+
+# resident memory of this process in kilobytes, VmRSS: current, VmHWM: peak
+def getMemoryKilobytes(field):
+    with open('/proc/self/status') as status_file:
+        for line in status_file:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+
+
+def load(load_mode, gtfs_filtered_path):
+    import pandas as pd
+    from gtfs_snapshot import readSnapshot
+
+    baseline_rss_kilobytes = getMemoryKilobytes('VmRSS')
+
+    start = time.perf_counter()
+    if load_mode == 'snapshot':
+        tables = readSnapshot(gtfs_filtered_path)
+    else:
+        tables = {table_name: pd.read_csv(os.path.join(gtfs_filtered_path, f'{table_name}.txt'))
+                  for table_name in ['calendar', 'routes', 'trips', 'stops', 'stop_times', 'service_day_trips']}
+    duration = time.perf_counter() - start
+
+    # touch the columns the extraction uses, so lazily mapped pages are counted as well
+    int(tables['stop_times']['arrival_seconds'].sum())
+    int(tables['stop_times']['departure_seconds'].sum())
+
+    max_rss_kilobytes = getMemoryKilobytes('VmHWM') - baseline_rss_kilobytes
+    print(duration, max_rss_kilobytes)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trips", action="store", help="Number of trips in the synthetic feed. Default: 20000", default=20000, type=int)
+    parser.add_argument("--stops-per-trip", action="store", help="Stop times per trip. Default: 25", default=25, type=int)
+    parser.add_argument("--load", action="store", help=argparse.SUPPRESS, default=None, choices=['csv', 'snapshot'])
+    parser.add_argument("--path", action="store", help=argparse.SUPPRESS, default=None, type=str)
+    args = parser.parse_args()
+
+    if args.load is not None:
+        load(args.load, args.path)
+        sys.exit(0)
+
+    import preprocess_static
+    from synthetic_gtfs import createSyntheticGtfs
+
+    gtfs = createSyntheticGtfs(args.trips, args.stops_per_trip)
+
+    # the whole network, not only the lines shown on the panel
+    preprocess_static.relevant_trip_prefixes = [line + '-' for line in gtfs['routes']['route_short_name']]
+
+    routes = preprocess_static.filterRoutes(gtfs['routes'])
+    trips = preprocess_static.filterTrips(gtfs['trips'])
+    stop_times = preprocess_static.filterStopTimes(gtfs['stop_times'])
+    stop_times = preprocess_static.addServiceDaySeconds(preprocess_static.addArtificialDepartureDelay(stop_times))
+    trips = preprocess_static.addStartAndEndTimesToTrips(trips, stop_times)
+    service_day_trips = preprocess_static.getServiceDayTrips(gtfs['calendar'], gtfs['calendar_dates'], trips)
+
+    with tempfile.TemporaryDirectory() as gtfs_filtered_path:
+        preprocess_static.saveFiltered(gtfs['calendar'], gtfs['calendar_dates'], routes, trips, gtfs['stops'], stop_times, service_day_trips, gtfs_filtered_path)
+
+        csv_bytes = sum(os.path.getsize(os.path.join(gtfs_filtered_path, file_name)) for file_name in os.listdir(gtfs_filtered_path) if file_name.endswith('.txt'))
+        snapshot_path = os.path.join(gtfs_filtered_path, 'snapshot')
+        snapshot_bytes = sum(os.path.getsize(os.path.join(snapshot_path, file_name)) for file_name in os.listdir(snapshot_path))
+
+        csv_duration, csv_rss = loadInChildProcess('csv', gtfs_filtered_path)
+        snapshot_duration, snapshot_rss = loadInChildProcess('snapshot', gtfs_filtered_path)
+
+    print(f"{len(stop_times)} stop times")
+    print(f"{'format':<10}{'bytes':>12}{'load ms':>12}{'rss MB':>10}")
+    print(f"{'csv':<10}{csv_bytes:>12}{csv_duration * 1000:>12.1f}{csv_rss / 1024:>10.1f}")
+    print(f"{'snapshot':<10}{snapshot_bytes:>12}{snapshot_duration * 1000:>12.1f}{snapshot_rss / 1024:>10.1f}")
+    print(f"snapshot loads {csv_duration / snapshot_duration:.1f}x faster")
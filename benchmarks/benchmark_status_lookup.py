@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# # Benchmark: current stop segment of the active trips in extract_active_vehicles.py
+# Compares the binary search over the sorted per-trip arrays (TripStopTimes) with the previous scan
+# (iterrows over all stop_times of a trip + boolean filters over all stop_times for the previous / next stops)
+# and checks that both return the same status, second previous, previous, current and next stop for every trip.
+# The realtime times get random delays that grow and shrink along the trip, so some trips are out of order and use the fallback scan.
+# The previous scan only runs on a sample of the trips and is extrapolated.
+#
+# usage:
+# python benchmark_status_lookup.py --trips 20000 --reference-trips 300
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/../src'))
+import preprocess_static
+from extract_active_vehicles import TripStopTimes
+from synthetic_gtfs import createSyntheticGtfs
+
+
+# previous implementation
+def isStoppedAtStopTime(stop_time, current_seconds):
+    return stop_time['arrival_realtime_seconds'] <= current_seconds <= stop_time['departure_realtime_seconds']
+
+def isTravelingToStoptime(stop_times, i, current_seconds):
+    current_stop_time = stop_times.loc[i]
+    try:
+        previous_stop_time = stop_times.loc[i-1]
+    except KeyError:
+        return False
+    has_arrived_at_stop_time = current_seconds <= current_stop_time['arrival_realtime_seconds']
+    has_departed_previous_stop_time = current_seconds >= previous_stop_time['departure_realtime_seconds']
+    return has_arrived_at_stop_time and has_departed_previous_stop_time
+
+def getStopIdBySequence(stop_times, current_stop_time, offset):
+    matching_stop_times = stop_times.loc[(stop_times['trip_id'] == current_stop_time['trip_id']) & (stop_times['stop_sequence'] == current_stop_time['stop_sequence'] + offset)]
+    if len(matching_stop_times) == 0:
+        return 'DEPOT'
+    return matching_stop_times.iloc[0]['stop_id']
+
+def getSegmentByScan(stop_times, trip_id, current_seconds):
+    stop_times_for_this_trip = stop_times.loc[stop_times['trip_id'] == trip_id]
+    stop_times_stopped_at = [stop_time for _, stop_time in stop_times_for_this_trip.iterrows() if isStoppedAtStopTime(stop_time, current_seconds)]
+    stop_times_traveling_to = [stop_time for i, stop_time in stop_times_for_this_trip.iterrows() if isTravelingToStoptime(stop_times_for_this_trip, i, current_seconds)]
+
+    if len(stop_times_stopped_at) > 0:
+        current_stop_time = stop_times_stopped_at[0]
+        return ('STOPPED_AT', '', getStopIdBySequence(stop_times, current_stop_time, -1),
+                current_stop_time['stop_id'], getStopIdBySequence(stop_times, current_stop_time, 1))
+    if len(stop_times_traveling_to) > 0:
+        next_stop_time = stop_times_traveling_to[0]
+        return ('IN_TRANSIT_TO', getStopIdBySequence(stop_times, next_stop_time, -2), getStopIdBySequence(stop_times, next_stop_time, -1),
+                '', next_stop_time['stop_id'])
+    return 'ERROR', '', '', '', ''
+
+
+# realtime times with a random delay per stop that is carried along the trip
+def addRandomDelays(stop_times, seed):
+    random_generator = np.random.default_rng(seed)
+    delay_changes = random_generator.integers(-45, 60, len(stop_times))
+    arrival_delays = stop_times.assign(delay_change=delay_changes).groupby('trip_id', sort=False)['delay_change'].cumsum().to_numpy()
+    departure_delays = arrival_delays + random_generator.integers(0, 20, len(stop_times))
+
+    stop_times = stop_times.copy()
+    stop_times['arrival_realtime_seconds'] = stop_times['arrival_seconds'] + arrival_delays
+    stop_times['departure_realtime_seconds'] = stop_times['departure_seconds'] + np.maximum(departure_delays - 15, 0)
+    return stop_times
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trips", action="store", help="Number of trips in the synthetic feed. Default: 20000", default=20000, type=int)
+    parser.add_argument("--stops-per-trip", action="store", help="Stop times per trip. Default: 25", default=25, type=int)
+    parser.add_argument("--reference-trips", action="store", help="Active trips processed with the previous scan per time. Default: 300", default=300, type=int)
+    args = parser.parse_args()
+
+    gtfs = createSyntheticGtfs(args.trips, args.stops_per_trip)
+    stop_times = preprocess_static.addServiceDaySeconds(preprocess_static.addArtificialDepartureDelay(gtfs['stop_times']))
+    stop_times = addRandomDelays(stop_times.sort_values(by=['trip_id', 'stop_sequence'], kind='stable').reset_index(drop=True), seed=0)
+
+    trip_starts = stop_times.groupby('trip_id')['arrival_realtime_seconds'].min()
+    trip_ends = stop_times.groupby('trip_id')['departure_realtime_seconds'].max()
+
+    print(f"{len(trip_starts)} trips, {len(stop_times)} stop times")
+    print(f"{'time':<8}{'active':>8}{'scan ms (extrap.)':>20}{'bisect ms':>12}{'identical':>12}")
+
+    for current_seconds in [6 * 3600, 8 * 3600 + 1234, 12 * 3600 + 30, 17 * 3600 + 15, 23 * 3600 + 45 * 60, 24 * 3600 + 20 * 60]:
+        active_trip_ids = trip_starts.index[(trip_starts <= current_seconds) & (current_seconds <= trip_ends)]
+        active_stop_times = stop_times.loc[stop_times['trip_id'].isin(active_trip_ids)]
+
+        start = time.perf_counter()
+        trip_stop_times = TripStopTimes(active_stop_times)
+        segments = [trip_stop_times.getSegment(trip_id, current_seconds) for trip_id in active_trip_ids]
+        bisect_duration = time.perf_counter() - start
+
+        reference_trip_ids = active_trip_ids[:args.reference_trips]
+        start = time.perf_counter()
+        reference_segments = [getSegmentByScan(active_stop_times, trip_id, current_seconds) for trip_id in reference_trip_ids]
+        scan_duration = (time.perf_counter() - start) * len(active_trip_ids) / max(len(reference_trip_ids), 1)
+
+        identical = [tuple(map(str, segment)) for segment in segments[:len(reference_trip_ids)]] == [tuple(map(str, segment)) for segment in reference_segments]
+
+        print(f"{current_seconds // 3600:02d}:{current_seconds % 3600 // 60:02d}   {len(active_trip_ids):>8}{scan_duration * 1000:>20.0f}{bisect_duration * 1000:>12.1f}{str(identical):>12}")
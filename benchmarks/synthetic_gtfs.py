@@ -0,0 +1,91 @@
+# # Synthetic gtfs feed
+# Creates a network-sized gtfs feed with the same structure as the rnv feed, for benchmarks that should not depend on a download.
+# Trip ids start with the line number ("22-3-1234"), like in the rnv feed, and some trips run past midnight (e.g. 24:15:00).
+# Service and stop ids are strings that can't be parsed as numbers (the rnv service ids look like "216-217-218"),
+# so a step that reads an id as a number fails on the synthetic feed as well.
+
+import os
+import random
+import zipfile
+
+import pandas as pd
+
+service_ids = ['216-217-218-219-220', '221-228', '222-229']
+lines = ['5', '21', '22', '23', '24', '26', '33', '34', '35', '36', '37', '38', '39', '40', '41', '42', '44', '45']
+
+
+def formatGtfsTime(seconds):
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+# e.g. "de:08222:100042", like the stop ids of the gtfs feeds of other german networks
+def getStopId(stop_number):
+    return f"de:08222:{100000 + stop_number}"
+
+
+def createSyntheticGtfs(number_of_trips=20000, stops_per_trip=25, seed=0):
+    random.seed(seed)
+
+    routes = pd.DataFrame({'route_id': [f'{line}-1' for line in lines],
+                           'agency_id': 1,
+                           'route_short_name': lines,
+                           'route_long_name': [f'Linie {line}' for line in lines],
+                           'route_desc': '',
+                           'route_type': 0,
+                           'route_color': [f'{random.randrange(0x1000000):06X}' for _ in lines],
+                           'route_text_color': 'FFFFFF'})
+
+    number_of_stops = 1000
+    stops = pd.DataFrame({'stop_id': [getStopId(i) for i in range(number_of_stops)],
+                          'stop_code': '',
+                          'stop_name': [f'Haltestelle {i}' for i in range(number_of_stops)],
+                          'stop_lat': 49.4,
+                          'stop_lon': 8.7,
+                          'location_type': 0,
+                          'parent_station': '',
+                          'platform_code': 'A'})
+
+    calendar = pd.DataFrame({'service_id': service_ids,
+                             'monday': [1, 0, 0], 'tuesday': [1, 0, 0], 'wednesday': [1, 0, 0], 'thursday': [1, 0, 0], 'friday': [1, 0, 0],
+                             'saturday': [0, 1, 0], 'sunday': [0, 0, 1],
+                             'start_date': 20241014, 'end_date': 20241027})
+
+    calendar_dates = pd.DataFrame({'service_id': [service_ids[0], service_ids[2]], 'date': [20241017, 20241017], 'exception_type': [2, 1]})
+
+    trip_rows = []
+    stop_time_columns = {'trip_id': [], 'arrival_time': [], 'departure_time': [], 'stop_id': [], 'stop_sequence': [], 'pickup_type': [], 'drop_off_type': []}
+    for i in range(number_of_trips):
+        line = lines[i % len(lines)]
+        trip_id = f'{line}-{i % 7}-{i}'
+        trip_rows.append({'route_id': f'{line}-1', 'service_id': service_ids[i % 3], 'trip_id': trip_id, 'trip_headsign': 'Bismarckplatz',
+                          'trip_short_name': str(i), 'direction_id': i % 2, 'block_id': '', 'shape_id': ''})
+
+        # trips between 04:00 and 25:00, so some of them run past midnight
+        current_seconds = 4 * 3600 + random.randrange(21 * 3600 // 60) * 60
+        first_stop_id = random.randrange(number_of_stops - stops_per_trip)
+        for stop_sequence in range(1, stops_per_trip + 1):
+            stop_time_columns['trip_id'].append(trip_id)
+            stop_time_columns['arrival_time'].append(formatGtfsTime(current_seconds))
+            stop_time_columns['departure_time'].append(formatGtfsTime(current_seconds))
+            stop_time_columns['stop_id'].append(getStopId(first_stop_id + stop_sequence))
+            stop_time_columns['stop_sequence'].append(stop_sequence)
+            stop_time_columns['pickup_type'].append(0)
+            stop_time_columns['drop_off_type'].append(0)
+            current_seconds += random.randrange(1, 4) * 60
+
+    trips = pd.DataFrame(trip_rows)
+    stop_times = pd.DataFrame(stop_time_columns)
+
+    return {'calendar': calendar, 'calendar_dates': calendar_dates, 'routes': routes, 'trips': trips, 'stops': stops, 'stop_times': stop_times}
+
+
+def writeSyntheticGtfs(gtfs, gtfs_path):
+    os.makedirs(gtfs_path, exist_ok=True)
+    for table_name, table in gtfs.items():
+        table.to_csv(os.path.join(gtfs_path, f'{table_name}.txt'), index=False)
+
+
+def writeSyntheticGtfsZip(gtfs, zip_path):
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as gtfs_zip:
+        for table_name, table in gtfs.items():
+            gtfs_zip.writestr(f'{table_name}.txt', table.to_csv(index=False))
@@ -5,6 +5,7 @@ cd /home/robin/Documents/github/rnv-train-monitor/src
 
 while true
 do
-    # Invoke your command here, the same as you would from your crontab
-    sudo python ./extract_active_vehicles.py
+    # runs as a resident service and recomputes the led matrix every 10 seconds
+    # the loop only restarts the service if it crashes
+    sudo python ./extract_active_vehicles.py --daemon --interval 10
 done
\ No newline at end of file
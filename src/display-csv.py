@@ -1,10 +1,14 @@
 #!/usr/bin/env python
 from matrixbase import MatrixBase
 import time
-from PIL import ImageColor
-import pandas as pd
 import numpy as np
 import os
+import random
+import collections
+from PIL import Image
+from led_mapping import loadLedMapping
+from led_frame import LedFrame, hexToRgb, readFrameFile
+from led_frame_channel import FrameChannelReader
 
 
 def getHexColorForLine(line):
@@ -24,59 +28,130 @@ def getHexColorForLine(line):
         return 'F39B9B'
     return 'FFFFFF'
 
+
+# Draws frames into the offscreen canvas and swaps it on vsync.
+# A frame with many changes is pushed with a single SetImage call (copied in C by the rgbmatrix bindings), otherwise only the changed pixels are set.
+# SwapOnVSync returns the canvas that was shown before, so the offscreen canvas always contains the frame of two swaps ago and is diffed against it.
+class CanvasRenderer(object):
+    def __init__(self, matrix, max_changed_pixels=128):
+        self.matrix = matrix
+        self.max_changed_pixels = max_changed_pixels
+        self.canvas = matrix.CreateFrameCanvas()
+        # pixels of the offscreen and onscreen canvas, None while unknown
+        self.canvas_pixels = collections.deque([None, None], maxlen=2)
+
+    def drawImage(self, frame):
+        image = Image.fromarray(frame.pixels, 'RGB')
+        # unsafe skips the bounds checks, only if the frame fits the canvas
+        self.canvas.SetImage(image, 0, 0, unsafe=(frame.width, frame.height) == (self.canvas.width, self.canvas.height))
+
+    def show(self, frame):
+        offscreen_pixels = self.canvas_pixels[0]
+        if offscreen_pixels is None or offscreen_pixels.shape != frame.pixels.shape:
+            self.drawImage(frame)
+        else:
+            changed_pixel_indices = np.flatnonzero((offscreen_pixels != frame.pixels).any(axis=2))
+            if len(changed_pixel_indices) > self.max_changed_pixels:
+                self.drawImage(frame)
+            else:
+                for pixel_index, (r, g, b) in zip(changed_pixel_indices.tolist(), frame.pixels.reshape(-1, 3)[changed_pixel_indices].tolist()):
+                    y, x = divmod(pixel_index, frame.width)
+                    self.canvas.SetPixel(x, y, r, g, b)
+
+        self.canvas = self.matrix.SwapOnVSync(self.canvas)
+        self.canvas_pixels.append(frame.pixels.copy())
+
+
+# seconds from writing a frame in the extractor until it is on the panel (after SwapOnVSync), over the last frames
+class FrameLatency(object):
+    def __init__(self, window=100):
+        self.latencies = collections.deque(maxlen=window)
+
+    def add(self, written_at, displayed_at):
+        self.latencies.append(displayed_at - written_at)
+
+    def getSummary(self):
+        latencies_ms = np.array(self.latencies) * 1000
+        return (f"frame latency {latencies_ms[-1]:.1f} ms (last {len(latencies_ms)} frames: mean {latencies_ms.mean():.1f} ms, "
+                f"p95 {np.percentile(latencies_ms, 95):.1f} ms, max {latencies_ms.max():.1f} ms)")
+
+
+# Leds with several vehicles switch between their colors: the extractor sends one frame per color phase (see led_frame.py),
+# which are shown one after another every interval seconds. The phases are scheduled on the monotonic clock, so drawing doesn't make them drift,
+# and as the renderer diffs against the canvas content, a phase change only sets the leds with several vehicles.
+class PhaseScheduler(object):
+    def __init__(self, interval):
+        self.interval = interval
+        self.frames = None
+        self.phase = 0
+        self.next_phase_at = None
+
+    # new phase frames, returns the frame to show now
+    def start(self, frames, now):
+        self.frames = frames
+        self.phase = 0
+        self.next_phase_at = now + self.interval if len(frames) > 1 else None
+        return frames[0]
+
+    # seconds until the next phase is due, at most max_timeout
+    def getTimeout(self, now, max_timeout):
+        if self.next_phase_at is None:
+            return max_timeout
+        return min(max_timeout, max(0, self.next_phase_at - now))
+
+    # the frame of the next phase if it is due, otherwise None
+    def advance(self, now):
+        if self.next_phase_at is None or now < self.next_phase_at:
+            return None
+
+        self.phase = (self.phase + 1) % len(self.frames)
+        self.next_phase_at += self.interval
+        # e.g. after the process was suspended, don't catch up on the missed phases
+        if self.next_phase_at < now:
+            self.next_phase_at = now + self.interval
+        return self.frames[self.phase]
+
+
 class DisplayCSV(MatrixBase):
     def __init__(self, *args, **kwargs):
         super(DisplayCSV, self).__init__(*args, **kwargs)
+        self.parser.add_argument("--frame-poll-interval", action="store", help="Seconds between two checks for a new frame if no notification arrives. Default: 1", default=1, type=float)
+        self.parser.add_argument("--color-cycle-interval", action="store", help="Seconds each vehicle color is shown on leds with several vehicles. Default: 1", default=1, type=float)
 
 
 
 
 
     def run(self):
-        offset_canvas = self.matrix.CreateFrameCanvas()
+        renderer = CanvasRenderer(self.matrix)
 
-        statuscode_led_mapping = pd.read_csv('statuscode_led_mapping.csv', sep=";")
+        # pixel indices (y * width + x) of every statuscode, compiled once (see led_mapping.py)
+        led_mapping = loadLedMapping('statuscode_led_mapping.csv', self.matrix.width, self.matrix.height)
         # randomise order
-        statuscode_led_mapping = statuscode_led_mapping.sample(frac=1).reset_index(drop=True)
+        row_pixel_indices = list(led_mapping.row_pixel_indices)
+        random.shuffle(row_pixel_indices)
 
 
         # startup animation
 
-        # create led_matrix dataframe with all led colors set to black
-        led_matrix = pd.DataFrame(np.full((32,64), "000000"))
-
-        number_of_statuscode_rows = len(statuscode_led_mapping)
+        # create led frame with all led colors set to black
+        frame = LedFrame.empty(led_mapping.width, led_mapping.height)
+        is_lighted_by_pixel = np.zeros(led_mapping.width * led_mapping.height, dtype=bool)
 
         # light every statuscode with delay to create cool animation
-        for i, statuscode_led_mapping_row in statuscode_led_mapping.iterrows():
-            # add current row to the led matrix df
-
-            is_lighted = False
-
-            led_mapping_string = statuscode_led_mapping_row['leds']
-            leds_xy = led_mapping_string.split("&")
-            for led_xy in leds_xy:
-                x, y = led_xy.split("-")
-
-                # skip if led is already lighted
-                if led_matrix.at[int(y), int(x)] == "FFFFFF":
-                    is_lighted = True
-                    continue
+        for pixel_indices in row_pixel_indices:
+            # skip if led is already lighted
+            is_lighted = is_lighted_by_pixel[pixel_indices].any()
 
-                led_matrix.at[int(y), int(x)] = "FFFFFF"
+            # add current row to the led frame
+            is_lighted_by_pixel[pixel_indices] = True
+            frame.setPixels(pixel_indices, (255, 255, 255))
 
             if is_lighted == True:
                 continue
 
-            # display new led matrix df
-            no_rows, no_columns = led_matrix.shape
-
-            for y in range(0,no_rows):
-                for x in range(0,no_columns):
-                    color_hex = led_matrix.at[y,x]                    
-                    color_rgb = ImageColor.getcolor(f"#{color_hex}", "RGB")
-                    offset_canvas.SetPixel(int(x), int(y), color_rgb[0], color_rgb[1], color_rgb[2])      
-            offset_canvas = self.matrix.SwapOnVSync(offset_canvas)
+            # display new led frame, only the leds of the new row change
+            renderer.show(frame)
 
 
 
@@ -85,62 +160,64 @@ class DisplayCSV(MatrixBase):
 
         #
         # show routes of each line
-        lines = sorted(statuscode_led_mapping['line'].unique())
+        lines = led_mapping.getLines()
 
         print(lines)
 
         for line in lines:
             linecolor_hex = getHexColorForLine(line)
 
-            led_mapping_rows_for_line = statuscode_led_mapping[statuscode_led_mapping['line'] == line]
-            # set canvas black
-
-            offset_canvas.Fill(0,0,0)
-
-            for i, statuscode_led_mapping_row in led_mapping_rows_for_line.iterrows():
-
-                # set pixels for current row
-            
-                led_mapping_string = statuscode_led_mapping_row['leds']
-                leds_xy = led_mapping_string.split("&")
-                for led_xy in leds_xy:
-                    x, y = led_xy.split("-")  
-                    color_rgb = ImageColor.getcolor(f"#{linecolor_hex}", "RGB")
-                    offset_canvas.SetPixel(int(x), int(y), color_rgb[0], color_rgb[1], color_rgb[2])
+            # black frame with the pixels of all rows of the line
+            frame = LedFrame.empty(led_mapping.width, led_mapping.height)
+            frame.setPixels(led_mapping.getPixelIndicesOfLine(line), hexToRgb(linecolor_hex))
 
             # display pixels
-            offset_canvas = self.matrix.SwapOnVSync(offset_canvas)
+            renderer.show(frame)
 
             # delay between lines
             time.sleep(2)
 
 
         # loop
+        # the extractor notifies about every new frame in the shared memory frame channel (see led_frame_channel.py), so the loop sleeps until
+        # a frame arrives and shows it right away. Without notification it checks every --frame-poll-interval seconds,
+        # and polls the frame file led-matrix.frame if there is no frame channel, e.g. while the extractor has not started yet
+        frame_channel = FrameChannelReader()
+        frame_latency = FrameLatency()
+        phase_scheduler = PhaseScheduler(self.args.color_cycle_interval)
+        loop_started_at = time.time()
         last_modified = None
         while True:
             try:
-                current_modified = os.path.getmtime('led-matrix.csv')
-                
-                # detect changes
-                if last_modified != current_modified:
-                    last_modified = current_modified
-                
-                    led_matrix = pd.read_csv('led-matrix.csv', header=None, dtype=str, index_col=None)
-
-                    # iterate over every cell
-                    no_rows, no_columns = led_matrix.shape
-
-                    for y in range(0,no_rows):
-                        for x in range(0,no_columns):
-                            color_hex = led_matrix.at[y,x]                    
-                            color_rgb = ImageColor.getcolor(f"#{color_hex}", "RGB")
-                            offset_canvas.SetPixel(x, y, color_rgb[0], color_rgb[1], color_rgb[2])      
-                    offset_canvas = self.matrix.SwapOnVSync(offset_canvas)
-
-                time.sleep(5)
-            except Exception:
-                continue
-           
+                # wakes up for a new frame or the next color phase
+                frame_channel.wait(phase_scheduler.getTimeout(time.monotonic(), self.args.frame_poll_interval))
+
+                new_frame = frame_channel.read()
+                if new_frame is None and not frame_channel.isOpen() and os.path.exists('led-matrix.frame'):
+                    current_modified = os.path.getmtime('led-matrix.frame')
+
+                    # detect changes
+                    if last_modified != current_modified:
+                        last_modified = current_modified
+                        # the file is replaced atomically, so it always contains a complete frame
+                        new_frame = readFrameFile('led-matrix.frame')
+
+                if new_frame is not None:
+                    frames, written_at, using_realtime = new_frame
+                    renderer.show(phase_scheduler.start(frames, time.monotonic()))
+
+                    # the first frame may have been written long before the display process started
+                    if written_at >= loop_started_at:
+                        frame_latency.add(written_at, time.time())
+                        print(frame_latency.getSummary())
+                else:
+                    phase_frame = phase_scheduler.advance(time.monotonic())
+                    if phase_frame is not None:
+                        renderer.show(phase_frame)
+            except (OSError, ValueError) as e:
+                print(e)
+                time.sleep(1)
+
 
 # Main function
 if __name__ == "__main__":
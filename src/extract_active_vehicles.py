@@ -10,29 +10,40 @@
 # 6. Get trips that are currently active
 # 7. Get status of the active trips
 # 8. Transform status to LED matrix
+#
+# The script either runs a single extraction (default) or stays resident with --daemon.
+# In daemon mode the static gtfs data and the led mapping are loaded once and kept in memory,
+# every tick only fetches the trip_updates and recomputes the vehicle positions.
+# When preprocess_static.py writes a new gtfs_filtered feed, it is reloaded before the next tick.
 
 # In[181]:
 
 
+import argparse
+import sys
+import time
+from contextlib import contextmanager
 import pandas as pd
+import numpy as np
 from os import path, getcwd
+from gtfs_lines import getRelevantLines, getTripPrefixes
 
+# usually a symlink to the active version in gtfs_versions (see gtfs_versions.py), which can be replaced at any time
 gtfs_filtered_path = path.join(getcwd(), 'gtfs_filtered')
-calendar_path = path.join(gtfs_filtered_path, 'calendar.txt')
-routes_path = path.join(gtfs_filtered_path, 'routes.txt')
-trips_path = path.join(gtfs_filtered_path, 'trips.txt')
-stops_path = path.join(gtfs_filtered_path, 'stops.txt')
-stop_times_path = path.join(gtfs_filtered_path, 'stop_times.txt')
+feed_table_names = ['calendar', 'calendar_dates', 'routes', 'trips', 'stops', 'stop_times', 'service_day_trips']
+statuscode_led_mapping_path = path.join(getcwd(), 'statuscode_led_mapping.csv')
+led_matrix_path = path.join(getcwd(), 'led-matrix.csv')
+led_frame_path = path.join(getcwd(), 'led-matrix.frame')
 
-calendar:pd.DataFrame = pd.read_csv(calendar_path)
-routes:pd.DataFrame = pd.read_csv(routes_path)
-trips:pd.DataFrame = pd.read_csv(trips_path)
-stops:pd.DataFrame = pd.read_csv(stops_path)
-stop_times:pd.DataFrame = pd.read_csv(stop_times_path)
 
+# relevant_lines in the .env file, e.g. 22,26,5 or all (see gtfs_lines.py)
+relevant_lines = getRelevantLines()
+relevant_trip_prefixes = getTripPrefixes(relevant_lines)
 
-relevant_lines = ['22', '26', '5', '23', '21', '24']
-relevant_trip_prefixes = [line + "-" for line in relevant_lines]
+# dimmed gray backlight to show route paths
+route_background_color = "111111"
+# vehicles of routes without route_color
+default_route_color = "FFFFFF"
 
 
 # ## 1. convenience functions for gtfs date formats
@@ -42,61 +53,171 @@ relevant_trip_prefixes = [line + "-" for line in relevant_lines]
 
 import datetime
 
-def parseGtfsTimestringAsTimeObject(timestring:str):
-    # mod 24, because gtfs defines days as service days that can be longer than 24 hours, so 24:15 is a valid gtfs time
-    hour = int(timestring[0:2]) % 24
-    minute = int(timestring[3:5])
-    second = int(timestring[6:8])
-    #print(timestring)
-    #print(hour)
-    #print(minute) 
-    #print(second)
-    return datetime.time(hour, minute, second)
-
-def parseGtfsDatestringAsDateObject(datestring:str):
-    datestring = str(datestring)
-    year = int(datestring[0:4])
-    month = int(datestring[4:6])
-    day = int(datestring[6:8])
-    return datetime.date(year, month, day)
-
-def addSecondsToTimeObject(time:datetime.time, seconds) -> datetime.time:
-    datetime_object = datetime.datetime(100,1,1,time.hour, time.minute, time.second)
-    delta = datetime.timedelta(seconds=seconds)
-    return (datetime_object + delta).time()
-
-
-def getGtfsWeekdayFromDate(date: datetime.date):
-    weekday_number = date.weekday()
-    if weekday_number == 0:
-        return "monday"
-    elif weekday_number == 1:
-        return "tuesday"
-    elif weekday_number == 2:
-        return "wednesday"
-    elif weekday_number == 3:
-        return "thursday"
-    elif weekday_number == 4:
-        return "friday"
-    elif weekday_number == 5:
-        return "saturday"
-    else:
-        return "sunday"
+# all times are handled as integer seconds since the start of the service day (see gtfs_time.py),
+# so times after midnight like 24:15:00 (= 87300) can be compared without wrapping
+from gtfs_time import parseGtfsTimestringsAsSeconds, getServiceDaySeconds
+from gtfs_snapshot import hasSnapshot, getSnapshotFilePaths, readSnapshot
+from gtfs_schema import filtered_schema, getCsvHeader, readGtfsCsv
+# the trips of every service day, expanded from calendar.txt and calendar_dates.txt (see gtfs_service_days.py)
+from gtfs_service_days import buildServiceDayTrips, ServiceDayIndex
+# statuscode -> pixel indices, compiled once and cached next to the csv file (see led_mapping.py)
+from led_mapping import loadLedMapping, getUnknownStatuscodes
+# the led matrix as (height, width, 3) rgb array (see led_frame.py)
+from led_frame import getFrameSize, hexToRgb, dimRgb, writeFrameFile, max_frame_phases
+from led_frame_channel import FrameChannelWriter
+
+
+# ## Static data
+#
+# The filtered static gtfs data and the statuscode led mapping only change when preprocess_static.py runs (once a day),
+# so we keep them in memory and only reload them when the files on disk change.
+# preprocess_static.py writes the files one after another, so we wait until the files have not been touched
+# for a few seconds before reloading, to not pick up a half written feed.
+# If the preprocessing wrote a binary snapshot (see gtfs_snapshot.py), it is loaded instead of the csv files.
+# The service_day_trips of the relevant lines are indexed once per load, so every tick finds its candidate trips with a binary search.
+
+# In[183]:
+
+
+class StaticData(object):
+    def __init__(self, settle_seconds=5, frame_size=getFrameSize()):
+        self.settle_seconds = settle_seconds
+        self.frame_width, self.frame_height = frame_size
+        self.feed_path = None
+        self.source_mtime = None
+        self.routes = None
+        self.trips = None
+        self.stops = None
+        self.stop_times = None
+        self.service_day_index = None
+        self.led_mapping = None
+        self.background_frame = None
+
+    # gtfs_filtered with the symlink resolved, so all files of a load are read from the same version
+    def getFeedPath(self):
+        return path.realpath(gtfs_filtered_path)
+
+    def getFeedFilePaths(self, feed_path):
+        return {table_name: path.join(feed_path, f'{table_name}.txt') for table_name in feed_table_names}
+
+    def getSourcePaths(self, feed_path):
+        feed_file_paths = self.getFeedFilePaths(feed_path)
+        source_paths = [feed_file_paths[table_name] for table_name in ['calendar', 'routes', 'trips', 'stops', 'stop_times']] + [statuscode_led_mapping_path]
+        # only written by newer versions of the preprocessing
+        source_paths += [feed_file_paths[table_name] for table_name in ['calendar_dates', 'service_day_trips'] if path.exists(feed_file_paths[table_name])]
+        if hasSnapshot(feed_path):
+            source_paths += list(getSnapshotFilePaths(feed_path).values())
+        return source_paths
+
+    def getSourceMtime(self, feed_path):
+        return max(path.getmtime(source_path) for source_path in self.getSourcePaths(feed_path))
+
+    # typed tables from the binary snapshot, or None if there is no snapshot or pyarrow is missing
+    def readTables(self, feed_path):
+        tables = readSnapshot(feed_path)
+        if tables is not None:
+            print("using binary snapshot")
+            return tables
+
+        feed_file_paths = self.getFeedFilePaths(feed_path)
+        calendar_path, calendar_dates_path, routes_path, trips_path, stops_path, stop_times_path, service_day_trips_path = \
+            [feed_file_paths[table_name] for table_name in feed_table_names]
+
+        # feeds written before the preprocessing emitted integer seconds only contain the HH:MM:SS strings
+        stop_times_time_columns = {} if 'arrival_seconds' in getCsvHeader(stop_times_path) else {'arrival_time': 'object', 'departure_time': 'object'}
+        trips_time_columns = {} if 'start_seconds' in getCsvHeader(trips_path) else {'start_time': 'object', 'end_time': 'object'}
+
+        # only the columns of filtered_schema, with the same dtypes as the snapshot
+        tables = {'calendar': readGtfsCsv(calendar_path, filtered_schema['calendar']),
+                  'routes': readGtfsCsv(routes_path, filtered_schema['routes']),
+                  'trips': readGtfsCsv(trips_path, filtered_schema['trips'], trips_time_columns),
+                  'stops': readGtfsCsv(stops_path, filtered_schema['stops']),
+                  'stop_times': readGtfsCsv(stop_times_path, filtered_schema['stop_times'], stop_times_time_columns)}
+
+        stop_times = tables['stop_times']
+        if 'arrival_seconds' not in stop_times.columns:
+            stop_times['arrival_seconds'] = parseGtfsTimestringsAsSeconds(stop_times['arrival_time'])
+            stop_times['departure_seconds'] = parseGtfsTimestringsAsSeconds(stop_times['departure_time'])
+            # gtfs_filtered of an older preprocess_static.py, which did not fill missing times yet
+            if stop_times['arrival_seconds'].hasnans or stop_times['departure_seconds'].hasnans:
+                raise Exception(f"{stop_times_path} has stop times without arrival or departure time, run preprocess_static.py again")
+        trips = tables['trips']
+        if 'start_seconds' not in trips.columns:
+            trips['start_seconds'] = parseGtfsTimestringsAsSeconds(trips['start_time'])
+            trips['end_seconds'] = parseGtfsTimestringsAsSeconds(trips['end_time'])
+
+        if path.exists(service_day_trips_path):
+            tables['service_day_trips'] = readGtfsCsv(service_day_trips_path, filtered_schema['service_day_trips'])
+        else:
+            # older feeds: expand the calendar here, without exceptions if calendar_dates.txt was not saved
+            calendar_dates = pd.read_csv(calendar_dates_path) if path.exists(calendar_dates_path) else None
+            tables['service_day_trips'] = buildServiceDayTrips(tables['calendar'], calendar_dates, trips)
+
+        return tables
+
+    def load(self):
+        feed_path = self.getFeedPath()
+        source_mtime = self.getSourceMtime(feed_path)
+
+        tables = self.readTables(feed_path)
+        self.stops = tables['stops']
+        routes = tables['routes']
+        trips = tables['trips']
+        stop_times = tables['stop_times']
+        self.led_mapping = loadLedMapping(statuscode_led_mapping_path, self.frame_width, self.frame_height)
+        # the route background only changes with the mapping, so it is rendered once and copied every tick
+        self.background_frame = self.led_mapping.renderBackgroundFrame(hexToRgb(route_background_color))
+
+        # select only routes, trips and stop_times of relevant lines, indicated by the route_id / trip_id
+        self.routes = routes.loc[routes['route_id'].str.startswith(tuple(relevant_trip_prefixes))]
+        self.trips = trips.loc[trips['trip_id'].str.startswith(tuple(relevant_trip_prefixes))]
+        self.stop_times = stop_times.loc[stop_times['trip_id'].str.startswith(tuple(relevant_trip_prefixes))]
+
+        # trips of other lines are dropped by the index
+        self.service_day_index = ServiceDayIndex(tables['service_day_trips'], self.trips)
+
+        unknown_statuscodes = getUnknownStatuscodes(self.led_mapping, self.stop_times)
+        if len(unknown_statuscodes) > 0:
+            print(f"{len(unknown_statuscodes)} statuscodes of the led mapping never occur in the feed, e.g. {', '.join(unknown_statuscodes[:5])}")
+
+        self.feed_path = feed_path
+        self.source_mtime = source_mtime
+        print(f"loaded static data from {feed_path}")
+
+    def reloadIfChanged(self):
+        try:
+            feed_path = self.getFeedPath()
+            source_mtime = self.getSourceMtime(feed_path)
+        except OSError as e:
+            # files are being replaced right now, keep the current data
+            print(e)
+            return False
+
+        # a rollback can switch to a version with older files
+        if feed_path == self.feed_path and source_mtime == self.source_mtime:
+            return False
+
+        # wait until the preprocessing has finished writing, a new version in gtfs_versions is complete when the symlink points to it
+        if feed_path == self.feed_path and time.time() - source_mtime < self.settle_seconds:
+            return False
+
+        self.load()
+        return True
 
 
 # ## 2. Fetch trip_updates
-# 
+#
 # Now we want to fetch the trip_updates from the realtime api to later enrich our static schedules with real time delay data.
 # To do that, we must first authenticate via oauth2 and then call the tripupdates endpoint.
+# The access token is reused until shortly before it expires (see gtfs_rt_auth.py).
+# The feed is fetched as json or protobuf, depending on gtfs_rt_format in the .env file (see gtfs_rt_feed.py).
 
-# In[183]:
+# In[184]:
 
 
 # load env
 from dotenv import load_dotenv
 from os import getenv
-import requests
-
 load_dotenv()
 
 # authenticate with oauth2
@@ -106,649 +227,851 @@ resource = getenv('gtfs_rt_resource')
 tenant_id = getenv('gtfs_rt_tenantID')
 hostname = getenv('gtfs_rt_hostname')
 
+# json (default) or protobuf, see gtfs_rt_feed.py
+trip_updates_format = getenv('gtfs_rt_format', 'json')
 
-using_realtime = True
-
-from oauthlib.oauth2 import WebApplicationClient
-client = WebApplicationClient(client_id)
 
-# prepare x-www-form-urlencoded body data
-data = f'grant_type=client_credentials&resource={resource}&client_id={client_id}&client_secret={client_secret}'
+from gtfs_rt_auth import TokenManager
+from gtfs_rt_feed import feed_formats, getTripUpdatesUrl, parseFeed
+from http_client import createSession, ConditionalGet
+from gtfs_rt_recording import TripUpdatesRecorder
 
-auth_url = f'https://login.microsoftonline.com/{tenant_id}/oauth2/token'
-headers= { 'Content-type':'application/x-www-form-urlencoded'}
-
-auth_response = requests.post(auth_url, data=data, headers=headers)
-auth = client.parse_request_body_response(auth_response.text)
-
-
-
-gtfs_access_token = auth['access_token']
+# the token is cached on disk, so it is reused across ticks and restarts of the script
+token_cache_path = path.join(getcwd(), '.gtfs_rt_token.json')
+token_manager = TokenManager(client_id, client_secret, resource, tenant_id, cache_path=token_cache_path, auth_url=getenv('gtfs_rt_auth_url'))
 
 
 # fetch tripupdates
-import json
-
-trip_updates_json_url = f'{hostname}/tripupdates/decoded'
-headers = {'Authorization':f'Bearer {gtfs_access_token}'}
-
-print(trip_updates_json_url)
-trip_updates = []
-try:
-    trip_updates_response = requests.get(trip_updates_json_url, headers=headers)
-    trip_updates = json.loads(trip_updates_response.text)['entity']
-except Exception as e:
-    print(e)
-    using_realtime = False
-    
-trip_updates = [trip_update['tripUpdate'] for trip_update in trip_updates]
-
-
-print(hostname)
-print(f"using realtime: {using_realtime}")
+# The fetcher keeps one http session (keep-alive, connection pooling, gzip) for the token endpoint and the api.
+# The feed is requested with If-None-Match / If-Modified-Since, if the server answers 304 Not Modified
+# or the FeedHeader.timestamp did not change, the trip_updates of the previous fetch are reused without parsing the feed again.
+# With a recorder (--record), every feed the api sends is saved as it was received, so it can be replayed later (see gtfs_rt_recording.py).
+class TripUpdatesFetcher(object):
+    def __init__(self, recorder=None):
+        self.recorder = recorder
+        self.session = createSession()
+        self.conditional_get = ConditionalGet(self.session)
+        self.trip_updates_url = getTripUpdatesUrl(hostname, trip_updates_format)
+        self.feed_timestamp = None
+        self.trip_updates = None
+
+    def request(self, stage_timer):
+        with stage_timer.measure('auth'):
+            access_token = token_manager.getAccessToken(self.session)
+        headers = {'Authorization':f'Bearer {access_token}'}
+        return self.conditional_get.get(self.trip_updates_url, headers=headers)
+
+    # returns the trip_updates and whether realtime data is used. An unchanged feed needs no special handling: the vehicles move with the
+    # schedule and the window of selectRelevantData moves with the time, so a tick recomputes everything anyway
+    def fetch(self, stage_timer=None):
+        if stage_timer is None:
+            stage_timer = StageTimer()
+
+        print(self.trip_updates_url)
+        using_realtime = True
+        try:
+            trip_updates_response = self.request(stage_timer)
+
+            # token was revoked or expired early, get a new one and try again
+            if trip_updates_response.status_code == 401:
+                token_manager.invalidate()
+                trip_updates_response = self.request(stage_timer)
+
+            # 304 Not Modified: the trip_updates of the previous fetch are still current
+            if trip_updates_response.status_code != 304 or self.trip_updates is None:
+                trip_updates_response.raise_for_status()
+                if self.recorder is not None:
+                    self.recorder.save(trip_updates_response.content, datetime.datetime.now())
+
+                # trips of other lines are dropped while parsing
+                feed = parseFeed(trip_updates_response.content, trip_updates_format, relevant_trip_prefixes, self.feed_timestamp if self.trip_updates is not None else None)
+
+                # None if the FeedHeader.timestamp did not change
+                if feed is not None:
+                    feed_timestamp = feed.get('header', {}).get('timestamp')
+                    # a missing timestamp can't be used to detect unchanged feeds
+                    self.feed_timestamp = feed_timestamp if feed_timestamp not in (None, '0') else None
+                    self.trip_updates = [trip_update['tripUpdate'] for trip_update in feed['entity']]
+        except Exception as e:
+            print(e)
+            using_realtime = False
+            self.trip_updates = None
+            self.feed_timestamp = None
+            self.conditional_get.reset(self.trip_updates_url)
+
+        print(hostname)
+        print(f"using realtime: {using_realtime}")
+
+        if not using_realtime:
+            return [], using_realtime
+
+        # the following steps only read the trip_updates, so the ones of the previous fetch are returned without a copy
+        return self.trip_updates, using_realtime
 
 
 
 
 # ## 3. preprocess data
-# 
+#
 # Firstly, we need to select only trip_updates, trips, stop_times, stops and routes for our relevant lines to reduce unnecessary processing.
 # Furhtermore, we only want trips and stop_times that run + - 1 hour of the current time, assuming that no train has more than 60 minutes of delay, to reduce unnecessary processing.
+# The service_day_index only contains the trips that run on a service date, sorted by their start. A trip that started more than
+# the longest trip duration + delay buffer ago can't be running anymore, so only the trips between these two start times are checked.
 
-# In[184]:
-
-
-# select only trip_updates of relevant trips, indicated by the refernced trip.tripId
-trip_updates = [trip_update for trip_update in trip_updates if trip_update['trip']['tripId'].startswith(tuple(relevant_trip_prefixes))]
-
-# select only routes, trips and stop_times of relevant lines, indicated by the route_id / trip_id
-routes = routes.loc[routes['route_id'].str.startswith(tuple(relevant_trip_prefixes))]
-trips = trips.loc[trips['trip_id'].str.startswith(tuple(relevant_trip_prefixes))]
-stop_times = stop_times.loc[stop_times['trip_id'].str.startswith(tuple(relevant_trip_prefixes))]
+# In[185]:
 
-current_datetime = datetime.datetime.now()
 
 # train is potentially running if
 # 1. the scheduled start is before the current time (otherwise trip hasn't started yet)
 # 2. the current time if before the scheduled end + 2 hours (otherwise trip has ended, unless delay is > 2h)
-def isPotentiallyRunningAtCurrentTime(start_gtfs_timestring, end_gtfs_timestring, current_datetime):
-    starttime = parseGtfsTimestringAsTimeObject(start_gtfs_timestring)
-    endtime = parseGtfsTimestringAsTimeObject(end_gtfs_timestring)
+delay_buffer_seconds = 2 * 3600
 
-    # make a datetime with the current date, because the selected trips are scheduled for today
-    # if we use time instead of datetime, no trips after 00:00 - delay_buffer can be shown
-    startdatetime = datetime.datetime.combine(datetime.date.today(), starttime)
-    enddatetime = datetime.datetime.combine(datetime.date.today(), endtime)
+def isPotentiallyRunningAtCurrentTime(start_seconds, end_seconds, current_seconds):
+    return (start_seconds <= current_seconds) & (current_seconds <= end_seconds + delay_buffer_seconds)
 
-    enddatetime_with_delay_buffer = enddatetime + datetime.timedelta(hours=2)
 
-    return startdatetime <= current_datetime <= enddatetime_with_delay_buffer
-    
+def selectRelevantData(trip_updates, trips, stop_times, service_day_index, current_datetime):
+    # select only trip_updates of relevant trips, indicated by the refernced trip.tripId
+    trip_updates = [trip_update for trip_update in trip_updates if trip_update['trip']['tripId'].startswith(tuple(relevant_trip_prefixes))]
 
-# select only trips that are potentially running right now, ignoring trains with 2h + delay
-trips = trips.loc[trips.apply(lambda row: isPotentiallyRunningAtCurrentTime(row['start_time'], row['end_time'], current_datetime), axis=1)]
-stop_times = stop_times.loc[stop_times.apply(lambda row: row['trip_id'] in trips.loc[:,'trip_id'].values, axis=1)]
+    # gtfs service days can be longer than 24 hours, so after midnight trips of yesterday's service day can still be running (e.g. at 24:15:00)
+    # every candidate trip remembers its service date and the current time in seconds since the start of that service day
+    trips_per_service_day = []
+    for service_date in [current_datetime.date() - datetime.timedelta(days=1), current_datetime.date()]:
+        current_seconds = getServiceDaySeconds(current_datetime, service_date)
 
-print(trips.head(5))
-print(stop_times.head(5))
+        # binary search for the trips of this service day that could still be running
+        earliest_start_seconds = current_seconds - service_day_index.max_trip_duration_seconds - delay_buffer_seconds
+        trip_positions = service_day_index.getTripPositions(service_date, earliest_start_seconds, current_seconds)
+        # keep the order of the trips table
+        trips_of_service_day = trips.iloc[np.sort(trip_positions)]
 
+        # select only trips that are potentially running right now, ignoring trains with 2h + delay
+        trips_of_service_day = trips_of_service_day.loc[isPotentiallyRunningAtCurrentTime(trips_of_service_day['start_seconds'], trips_of_service_day['end_seconds'], current_seconds)].copy()
+        trips_of_service_day['service_date'] = service_date
+        trips_of_service_day['current_seconds'] = current_seconds
+        trips_per_service_day.append(trips_of_service_day)
 
-# According to gtfs-rt specification, the stopTimeUpdates only include updates of the delay. If a tram is delayed for 30 seconds departing stop 1, arriving at stop 2, departing stop 2 and then gets to stop 3 on time, the stopTimeUpdates will only include one entry for delay 30 (departure) at stop 1 and delay 0 (arrival) stop 3.
-# To prepare enriching the stop_times with the delays, we simply fill the missing stopTimeUpdates.
-# We will later use stopSequence to identify a stop, because we can simply calculate the stopSequence for the artificially filled stopTimeUpdated, but can't do it as easily with the stopIds.
+    trips = pd.concat(trips_per_service_day, ignore_index=True)
+    stop_times = stop_times.loc[stop_times['trip_id'].isin(trips['trip_id'])]
 
-# In[185]:
+    print(trips.head(5))
+    print(stop_times.head(5))
 
+    return trip_updates, trips, stop_times
 
-# iterate over the trip_updates
-for trip_update in trip_updates:
-    # find the last stopSequence for the trip
-    trip_id = trip_update['trip']['tripId']
-    schedule_relationship = trip_update['trip']['scheduleRelationship']
-    
-    # delete trip and stop_times for canceled trips
-    if schedule_relationship == 'CANCELED':
-        # only keep stop times / trips that are not related to the canceled trip
-        stop_times = stop_times[stop_times['trip_id'] != trip_id]
-        trips = trips[trips['trip_id'] != trip_id]
-        print('deleting trip:', trip_id)
-        continue
 
-    stop_times_for_trip = stop_times.loc[stop_times['trip_id'] == trip_id]
+# According to gtfs-rt specification, the stopTimeUpdates only include updates of the delay. If a tram is delayed for 30 seconds departing stop 1, arriving at stop 2, departing stop 2 and then gets to stop 3 on time, the stopTimeUpdates will only include one entry for delay 30 (departure) at stop 1 and delay 0 (arrival) stop 3.
+# To prepare enriching the stop_times with the delays, we fill the missing delays by carrying the last known delay forward to the following stops.
+# We will later use stopSequence to identify a stop. gtfs-rt allows a stopTimeUpdate to name the stop only by its stopId,
+# then the stopSequence is looked up in the stop_times of the trip. Updates whose stop can't be found that way are skipped with a warning:
+# a stopId the trip doesn't serve, a stopId the trip visits several times (the specification requires a stopSequence then) or neither of both.
+# - SKIPPED: the vehicle passes the stop without stopping, the delay of the previous stops is carried over it
+# - NO_DATA: there is no realtime data from this stop on, the following stops use the schedule until the next stopTimeUpdate with data
+#
+# The stop_times are sorted by trip and stopSequence once, and the sorted stopTimeUpdates of a trip are walked once alongside its stop_times,
+# which results in dense delay arrays with one arrival and departure delay per stop_time of the trip.
 
-    # skip updates for unknown trips, e.g. emergency services not known to GTFS schedule
-    if len(stop_times_for_trip) == 0:
-        continue
-        
-    #print(stop_times_for_trip)
-    stop_times_for_trip = stop_times_for_trip.sort_values(by=['stop_sequence'])
-    last_stop_sequence = int(stop_times_for_trip.iloc[-1]['stop_sequence']) 
+# In[186]:
 
-    stop_time_updates = trip_update['stopTimeUpdate']
-    stop_time_updates_filled = []
 
-    # fill stop_time_updates for every stopSequence
-    current_trip_delay_seconds = 0
-    for stop_sequence in range(1,last_stop_sequence + 1):
-        
-        # check if stopTimeUpdate exists
-        existing_stop_time_updates = [stop_time_update for stop_time_update in stop_time_updates if stop_time_update['stopSequence'] == stop_sequence]
-        # no stopTimeUpdate exists, generate a new one with current_trip_delay
-        if len(existing_stop_time_updates) == 0:
-            stop_time_updates_filled.append({'stopSequence': stop_sequence, 
-                                             'arrival': {'delay': current_trip_delay_seconds}, 
-                                             'departure': {'delay': current_trip_delay_seconds}})
-        # otherwise use the delays that already exist, update current_trip delay and fill arrival and departure with current_trip_delay if missing
-        
-        else:
-            # determine arrival_delay
-            existing_stop_time_update = existing_stop_time_updates[0]
+def removeCanceledTrips(trip_updates, trips, stop_times):
+    canceled_trip_ids = {trip_update['trip']['tripId'] for trip_update in trip_updates if trip_update['trip']['scheduleRelationship'] == 'CANCELED'}
 
-               
-            arrival_delay = existing_stop_time_update['arrival']['delay'] if 'arrival' in existing_stop_time_update else current_trip_delay_seconds
-            
-            # update current trip delay, if no arrival delay was specified, it virtually stays the same
-            current_trip_delay_seconds = arrival_delay
+    for trip_id in canceled_trip_ids:
+        print('deleting trip:', trip_id)
 
-            # determine departure_delay
-            existing_stop_time_update = existing_stop_time_updates[0]
-            departure_delay = existing_stop_time_update['departure']['delay'] if 'departure' in existing_stop_time_update else current_trip_delay_seconds
-            
-            # update current trip delay, if no arrival delay was specified, it virtually stays the same
-            current_trip_delay_seconds = departure_delay
+    # only keep stop times / trips that are not related to the canceled trips
+    if len(canceled_trip_ids) > 0:
+        stop_times = stop_times.loc[~stop_times['trip_id'].isin(canceled_trip_ids)]
+        trips = trips.loc[~trips['trip_id'].isin(canceled_trip_ids)]
 
-            stop_time_updates_filled.append({'stopSequence': stop_sequence, 
-                                             'arrival': {'delay': arrival_delay}, 
-                                             'departure': {'delay': departure_delay}})
+    return trip_updates, trips, stop_times
 
-    # replace stopTimeUpdate with filled version
-    trip_update['stopTimeUpdate'] = stop_time_updates_filled
 
-try:
-    print(trip_updates[0])
-except IndexError:
-    print('no trip updates found')
-    
+# arrival and departure delay for every stop_sequence of a trip (sorted), carried forward from the sparse stop_time_updates
+def propagateDelays(stop_sequences, stop_time_updates):
+    arrival_delays = np.zeros(len(stop_sequences), dtype=np.int64)
+    departure_delays = np.zeros(len(stop_sequences), dtype=np.int64)
 
+    stop_time_updates = sorted(stop_time_updates, key=lambda stop_time_update: stop_time_update['stopSequence'])
 
-# ## 4. enrich stop_times with realtime delays
-# 
-# 
-# 
-# Now, we can add the real time delay to the scheduled stop_times.
-# We create two new columns, arrival_realtime and departure_realtime, and calculate the realtime arrival and departure times using the trip_updates from the previous step. If no trip_update exists, we will simply copy the scheduled times.
+    current_trip_delay_seconds = 0
+    update_index = 0
+    for position, stop_sequence in enumerate(stop_sequences):
+        # updates for stop_sequences that are not in the schedule are ignored
+        while update_index < len(stop_time_updates) and stop_time_updates[update_index]['stopSequence'] < stop_sequence:
+            update_index += 1
+
+        if update_index < len(stop_time_updates) and stop_time_updates[update_index]['stopSequence'] == stop_sequence:
+            stop_time_update = stop_time_updates[update_index]
+            # if there are several updates for a stop, the first one is used
+            while update_index < len(stop_time_updates) and stop_time_updates[update_index]['stopSequence'] == stop_sequence:
+                update_index += 1
+
+            schedule_relationship = stop_time_update.get('scheduleRelationship', 'SCHEDULED')
+            if schedule_relationship == 'NO_DATA':
+                current_trip_delay_seconds = 0
+            elif schedule_relationship != 'SKIPPED':
+                # if no arrival delay was specified, the delay virtually stays the same
+                current_trip_delay_seconds = stop_time_update.get('arrival', {}).get('delay', current_trip_delay_seconds)
+                arrival_delays[position] = current_trip_delay_seconds
+
+                current_trip_delay_seconds = stop_time_update.get('departure', {}).get('delay', current_trip_delay_seconds)
+                departure_delays[position] = current_trip_delay_seconds
+                continue
+
+        # no stopTimeUpdate for this stop, use the current trip delay
+        arrival_delays[position] = current_trip_delay_seconds
+        departure_delays[position] = current_trip_delay_seconds
+
+    return arrival_delays, departure_delays
+
+
+# stopTimeUpdates with a stopSequence, the ones that only have a stopId get the stop_sequence of the stop in the trip
+# stop_sequences and stop_ids are the stop_times of the trip, sorted by stop_sequence
+def resolveStopSequences(trip_id, stop_time_updates, stop_sequences, stop_ids):
+    resolved_stop_time_updates = []
+    for stop_time_update in stop_time_updates:
+        if 'stopSequence' in stop_time_update:
+            resolved_stop_time_updates.append(stop_time_update)
+            continue
+
+        positions = np.flatnonzero(stop_ids == str(stop_time_update.get('stopId')))
+        if len(positions) != 1:
+            print(f"skipping stopTimeUpdate of trip {trip_id} without stopSequence, stopId {stop_time_update.get('stopId')} is served {len(positions)} times by the trip")
+            continue
+        resolved_stop_time_updates.append({**stop_time_update, 'stopSequence': int(stop_sequences[positions[0]])})
+
+    return resolved_stop_time_updates
+
+
+# tripId -> (stop_sequences, arrival_delays, departure_delays) for every trip with stop_times, only the first trip_update of a trip is used
+# trip_updates of trips without stop_times are skipped, e.g. emergency services not known to GTFS schedule or trips that are not running
+def indexTripUpdates(trip_updates, stop_times):
+    stop_times = stop_times.sort_values(by=['trip_id', 'stop_sequence'], kind='stable')
+    stop_sequences = stop_times['stop_sequence'].to_numpy(dtype=np.int64)
+
+    # trip_id -> (first, last) positions of the trip in the sorted stop_times
+    trip_ids = stop_times['trip_id'].astype(str).to_numpy(dtype=object)
+    trip_starts = np.flatnonzero(np.r_[True, trip_ids[1:] != trip_ids[:-1]]) if len(trip_ids) > 0 else np.empty(0, dtype=np.int64)
+    trip_ends = np.r_[trip_starts[1:], len(trip_ids)]
+    trip_slices = dict(zip(trip_ids[trip_starts], zip(trip_starts, trip_ends)))
+
+    # only needed for stopTimeUpdates without stopSequence, converted once per tick if such an update occurs
+    stop_ids = None
+
+    trip_delays = {}
+    for trip_update in trip_updates:
+        trip_id = trip_update['trip']['tripId']
+        if trip_id in trip_delays or trip_id not in trip_slices:
+            continue
+
+        first, last = trip_slices[trip_id]
+        stop_time_updates = trip_update['stopTimeUpdate']
+        if not all('stopSequence' in stop_time_update for stop_time_update in stop_time_updates):
+            if stop_ids is None:
+                stop_ids = stop_times['stop_id'].astype(str).to_numpy(dtype=object)
+            stop_time_updates = resolveStopSequences(trip_id, stop_time_updates, stop_sequences[first:last], stop_ids[first:last])
+        trip_delays[trip_id] = (stop_sequences[first:last],) + propagateDelays(stop_sequences[first:last], stop_time_updates)
 
-# In[186]:
+    try:
+        print(next(iter(trip_delays.items())))
+    except StopIteration:
+        print('no trip updates found')
 
+    return trip_delays
 
-def calculateRealtime(stop_time, arrival_or_departure):
-    
-    trip_id = stop_time['trip_id']
-    scheduled_time = stop_time[f'{arrival_or_departure}_time']
-    stop_sequence = stop_time['stop_sequence']
-    
-    # find the corresponding trip_update, if it exists
-    trip_updates_for_stop_time = [trip_update for trip_update in trip_updates if trip_update['trip']['tripId'] == trip_id]
-    
-    # if no trip updates exist, the scheduled time is used instead
-    if len(trip_updates_for_stop_time) == 0:
-       return scheduled_time
-   
-    trip_update_for_stop_time = trip_updates_for_stop_time[0]
-    
-    # find the stopTimeUpdate for this stop
-    stop_time_updates_for_stop_time = [stop_time_update for stop_time_update in trip_update_for_stop_time['stopTimeUpdate']]
-
-    # if no stop time updates exist, the scheduled time is used instead
-    if len(stop_time_updates_for_stop_time) == 0:
-        return scheduled_time
-
-    stop_time_update_for_stop_time = stop_time_updates_for_stop_time[0]
-
-    
-    # add delay to scheduled time
-    scheduled_time_object = parseGtfsTimestringAsTimeObject(scheduled_time)
-    delay = stop_time_update_for_stop_time[arrival_or_departure]['delay']
-    # account for artificially added departure delay of 15 seconds from preprocessing 3.
-    # => departure delays up to 15 seconds are already accounted for
-    if arrival_or_departure == 'departure':
-        delay = max(delay - 15,0)
-        
-    realtime = addSecondsToTimeObject(scheduled_time_object, delay).isoformat()
 
-    return realtime
-                                       
 
+# ## 4. enrich stop_times with realtime delays
+#
+#
+#
+# Now, we can add the real time delay to the scheduled stop_times.
+# We create two new columns, arrival_realtime_seconds and departure_realtime_seconds, and calculate the realtime arrival and departure times using the trip_updates from the previous step. If no trip_update exists, we will simply copy the scheduled times.
+# The trip_updates were indexed by tripId in the previous step, every trip keeps its arrival and departure delays as arrays keyed by stopSequence.
+# The delays are looked up for all stop_times at once by (trip_id, stop_sequence), so a tick doesn't scan the trip_updates per stop_time.
 
-arrivals_realtime = [calculateRealtime(stop_time, 'arrival') for i, stop_time in stop_times.iterrows()]
-departures_realtime = [calculateRealtime(stop_time, 'departure') for i, stop_time in stop_times.iterrows()]
+# In[187]:
 
-# add columns to stop_times
 
-stop_times['arrival_realtime'] = arrivals_realtime
-stop_times['departure_realtime'] = departures_realtime
+# arrival and departure delay of every stop_time, 0 if there is no trip_update for its trip
+def getStopTimeDelays(trip_delays, stop_times):
+    arrival_delays = np.zeros(len(stop_times), dtype=np.int64)
+    departure_delays = np.zeros(len(stop_times), dtype=np.int64)
 
+    if len(trip_delays) == 0 or len(stop_times) == 0:
+        return arrival_delays, departure_delays
 
-print(stop_times[:5])
+    # one row per stop_time of all trips with trip_updates
+    delay_trip_ids = np.concatenate([np.full(len(stop_sequences), trip_id, dtype=object) for trip_id, (stop_sequences, _, _) in trip_delays.items()])
+    delay_stop_sequences, delay_arrival_delays, delay_departure_delays = [np.concatenate(column) for column in zip(*trip_delays.values())]
 
+    # the lookup needs unique keys, if a trip lists a stop_sequence twice, the delays of the first one are used
+    is_first = ~pd.MultiIndex.from_arrays([delay_trip_ids, delay_stop_sequences]).duplicated()
+    delay_keys = pd.MultiIndex.from_arrays([delay_trip_ids[is_first], delay_stop_sequences[is_first]])
+    delay_arrival_delays = delay_arrival_delays[is_first]
+    delay_departure_delays = delay_departure_delays[is_first]
 
-# ## 5. add realtime start and end times to trips
-# To make it easy to identify the active trips, we will now add start and end times to each trip. First, we will create a function to get all the stop_times for a specific `trip_id`. Then we will sort the stop_times and return the first `arrival_time` as trip start and the last `departure_time` as trip end.
+    stop_time_keys = pd.MultiIndex.from_arrays([stop_times['trip_id'].astype(str).to_numpy(dtype=object), stop_times['stop_sequence'].to_numpy(dtype=np.int64)])
+    positions = delay_keys.get_indexer(stop_time_keys)
+    has_delay = positions >= 0
 
-# In[187]:
+    arrival_delays[has_delay] = delay_arrival_delays[positions[has_delay]]
+    departure_delays[has_delay] = delay_departure_delays[positions[has_delay]]
 
+    return arrival_delays, departure_delays
 
-def getTripStartRealtime(trip_id:str) -> tuple[str, str]:
-    relevant_stop_times = stop_times.loc[stop_times['trip_id'] == trip_id]
-    #print('found ',relevant_stop_times.shape[0], 'relevant stop times for trip_id', trip_id)
-    
-    relevant_stop_times = relevant_stop_times.sort_values(by=['stop_sequence'])
-    
-    first_stop = relevant_stop_times.iloc[0]
-    trip_start_time = first_stop.loc['arrival_realtime']
 
-    return trip_start_time
+def calculateRealtime(scheduled_seconds, delays, arrival_or_departure):
+    # account for artificially added departure delay of 15 seconds from preprocessing 3.
+    # => departure delays up to 15 seconds are already accounted for
+    if arrival_or_departure == 'departure':
+        delays = np.maximum(delays - 15, 0)
 
-def getTripEndRealtime(trip_id:str) -> tuple[str, str]:
-    relevant_stop_times = stop_times.loc[stop_times['trip_id'] == trip_id]
-    #print('found ',relevant_stop_times.shape[0], 'relevant stop times for trip_id', trip_id)
-    
-    relevant_stop_times = relevant_stop_times.sort_values(by=['stop_sequence'])
-    
-    last_stop = relevant_stop_times.iloc[-1]
-    trip_end_time = last_stop.loc['departure_realtime']
-    
-    return trip_end_time
+    # add delay to scheduled time
+    return np.asarray(scheduled_seconds, dtype=np.int64) + delays
 
 
-# Now let's add the new columns by using the function we just created.
+def enrichStopTimesWithRealtime(trip_delays, stop_times):
+    arrival_delays, departure_delays = getStopTimeDelays(trip_delays, stop_times)
+    arrivals_realtime = calculateRealtime(stop_times['arrival_seconds'], arrival_delays, 'arrival')
+    departures_realtime = calculateRealtime(stop_times['departure_seconds'], departure_delays, 'departure')
 
-# In[188]:
+    # add columns to stop_times
+    stop_times = stop_times.copy()
+    stop_times['arrival_realtime_seconds'] = arrivals_realtime
+    stop_times['departure_realtime_seconds'] = departures_realtime
 
+    print(stop_times[:5])
 
-trips['start_realtime'] = trips.apply(lambda row: getTripStartRealtime(row['trip_id']), axis=1)
-trips['end_realtime'] = trips.apply(lambda row: getTripEndRealtime(row['trip_id']), axis=1)
+    return stop_times
 
-print(trips.head(5))
 
+# ## 5. add realtime start and end times to trips
+# To make it easy to identify the active trips, we will now add start and end times to each trip: the first realtime arrival and the last realtime departure of its stop_times, ordered by `stop_sequence`.
+# The stop_times of all trips are sorted by trip and stop_sequence and grouped once, instead of filtering and sorting all stop_times once per trip (which takes seconds per tick for the whole network).
 
-# ## 6. currently active trips
+# In[189]:
 
-# First, we need to get all the trip_ids for currently active trips. Trips are active, if the current time is between the start and end time of the trip and if one of the services, the trip belongs to, runs on the current day.
-# Let's start by looking at the start and end times of the trips.
 
-# In[189]:
+def addRealtimeStartAndEndToTrips(trips, stop_times):
+    stop_times_by_trip = (stop_times.sort_values(by=['trip_id', 'stop_sequence'], kind='stable')
+                          .astype({'trip_id': str}).groupby('trip_id', sort=False))
+    trip_ids = trips['trip_id'].astype(str)
 
+    trips = trips.copy()
+    trips['start_realtime_seconds'] = trip_ids.map(stop_times_by_trip['arrival_realtime_seconds'].first()).to_numpy()
+    trips['end_realtime_seconds'] = trip_ids.map(stop_times_by_trip['departure_realtime_seconds'].last()).to_numpy()
 
-print(datetime.datetime.now())
+    print(trips.head(5))
 
-def isTripRowActiveAtCurrentTime(trip_row):
-    start_time = parseGtfsTimestringAsTimeObject(trip_row['start_realtime'])
-    current_time = datetime.datetime.now().time() 
-    end_time = parseGtfsTimestringAsTimeObject(trip_row['end_realtime'])
-    #print(start_time, current_time, end_time, start_time <= current_time <= end_time)
-    return start_time <= current_time <= end_time
-    
+    return trips
 
-# select trips where current time is between start and end time
-trips = trips[trips.apply(isTripRowActiveAtCurrentTime, axis=1)]
-print("found", trips.shape[0], "trips that run at the current time")
-print(trips.head(5))
 
+# ## 6. currently active trips
 
-# Secondly, we will check whether the services run on the current day by looking up the services from the `service_id` column in the calendar dataframe.
-# As soon as we find a `service_id` that runs on the current day, we can stop the search and return true, otherwise we return false.
+# First, we need to get all the trip_ids for currently active trips. Trips are active, if the current time is between the start and end time of the trip and if one of the services, the trip belongs to, runs on the current day.
+# The service day was already checked when selecting the trips from the service_day_index (see 3.), so only the realtime start and end times are left.
 
 # In[190]:
 
 
-def isTripRowActiveOnCurrentDay(trip_row):
-    current_date = datetime.date.today()
-    current_weekday_gtfs = getGtfsWeekdayFromDate(datetime.date.today())
-    
-    calendar:pd.DataFrame = pd.read_csv(calendar_path)
-
-    # select row from calendar for this service
-    calendar = calendar[calendar['service_id'] == trip_row['service_id']]
+# current_seconds is relative to the service day of the trip, see selectRelevantData
+def areTripsActiveAtCurrentTime(trips):
+    return (trips['start_realtime_seconds'] <= trips['current_seconds']) & (trips['current_seconds'] <= trips['end_realtime_seconds'])
 
-    # check every calendar entry
-    for index, schedule in calendar.iterrows():
-        # check if current date is between start_date and end_date (inclusive)
-        start_date = parseGtfsDatestringAsDateObject(schedule['start_date'])
-        end_date = parseGtfsDatestringAsDateObject(schedule['end_date'])
 
-        duration_check = start_date <= current_date <= end_date
+def selectActiveTrips(trips, current_datetime):
+    print(current_datetime)
 
-        # check if current weekday is an active day in the schedule
-        weekday_check = schedule[current_weekday_gtfs] == 1
+    # select trips where current time is between start and end time
+    trips = trips[areTripsActiveAtCurrentTime(trips)]
+    print("found", trips.shape[0], "trips that run at the current time")
+    print(trips.head(5))
 
-        if duration_check and weekday_check:
-            return True
-                
-    return False
-    
-trips = trips[trips.apply(isTripRowActiveOnCurrentDay, axis=1)]
-print(trips.head(5))
+    return trips
 
 
 # ## 7. Status of active trips
-# Now that we have identified all the trips that are currently running, we want to know where the trams are on our network. As we later want to represent a vehicle being at a stop as well as a vehicle traveling between stops, we will represent the status of a vehicle (trip) as 
-# 
+# Now that we have identified all the trips that are currently running, we want to know where the trams are on our network. As we later want to represent a vehicle being at a stop as well as a vehicle traveling between stops, we will represent the status of a vehicle (trip) as
+#
 # trip_id: <strip_id>, status: IN_TRANSIT_TO / STOPPED_AT, current_stop_id: <stop_id/None>, previous_stop_id: <stop_id>, next_stop_id: <stop_id>
-# 
+#
 # This will be condensed into a status code string, which is then mapped to one or more LEDs, which should be lighted, when a vehicle has the respective status code.
-# 
+#
 # Status codes for vehicles in transit will have the pattern previousstopid_nextstopid (2 stop ids separated by underscore), vehicles that have stopped at a station will have the pattern  previousstopid_currentstopid_nextstopid (3 stop ids separated by underscore).
-# 
+#
 
 # First, let's define some functions:
+# Instead of scanning all stop_times of a trip for the stop it is stopped at or traveling to, the stop_times of all trips are sorted
+# by trip and stop_sequence once per tick. Every trip is a slice of the arrays, and as long as its realtime arrivals and departures
+# are in order, the current stop segment is found with a binary search.
 
-# In[191]:
+# In[192]:
 
 
-import pandas as pd
+class TripStopTimes(object):
+    def __init__(self, stop_times):
+        stop_times = stop_times.sort_values(by=['trip_id', 'stop_sequence'], kind='stable')
+
+        self.stop_sequences = stop_times['stop_sequence'].to_numpy()
+        self.stop_ids = stop_times['stop_id'].to_numpy()
+        self.arrivals = stop_times['arrival_realtime_seconds'].to_numpy()
+        self.departures = stop_times['departure_realtime_seconds'].to_numpy()
+
+        # trip_id -> (first, last) positions of the trip in the arrays
+        trip_ids = stop_times['trip_id'].to_numpy()
+        trip_starts = np.flatnonzero(np.r_[True, trip_ids[1:] != trip_ids[:-1]]) if len(trip_ids) > 0 else np.empty(0, dtype=np.int64)
+        trip_ends = np.r_[trip_starts[1:], len(trip_ids)]
+        self.trip_slices = dict(zip(trip_ids[trip_starts], zip(trip_starts, trip_ends)))
+
+        # arrival <= departure <= next arrival ..., otherwise the trip falls back to a scan (e.g. a delay that shrinks by more than the dwell time)
+        is_out_of_order = self.departures < self.arrivals
+        is_followed_by_earlier_arrival = np.r_[self.arrivals[1:] < self.departures[:-1], False]
+        # the last stop_time of a trip is followed by the first one of the next trip
+        is_followed_by_earlier_arrival[trip_ends - 1] = False
+        is_out_of_order |= is_followed_by_earlier_arrival
+        self.trips_in_order = {trip_id: not is_out_of_order[first:last].any() for trip_id, (first, last) in self.trip_slices.items()}
+
+    # stop_id of the stop_time with stop_sequence in this trip, DEPOT if the trip has no such stop
+    def getStopId(self, first, last, stop_sequence):
+        position = first + np.searchsorted(self.stop_sequences[first:last], stop_sequence)
+        if position < last and self.stop_sequences[position] == stop_sequence:
+            return self.stop_ids[position]
+        return 'DEPOT'
+
+    # status, second previous, previous, current and next stop_id of the trip at current_seconds
+    def getSegment(self, trip_id, current_seconds):
+        if trip_id not in self.trip_slices:
+            return 'ERROR', '', '', '', ''
+        first, last = self.trip_slices[trip_id]
+        arrivals = self.arrivals[first:last]
+        departures = self.departures[first:last]
+
+        if self.trips_in_order[trip_id]:
+            # first stop_time that is not departed yet, the vehicle is either stopped at it or traveling to it
+            position = np.searchsorted(departures, current_seconds, side='left')
+            is_stopped = position < len(arrivals) and arrivals[position] <= current_seconds
+            is_traveling = not is_stopped and 0 < position < len(arrivals)
+            stopped_at_position = position if is_stopped else None
+            traveling_to_position = position if is_traveling else None
+        else:
+            # vehicle is stopped, if current time is between arrival and departure of a stop
+            stopped_at = np.flatnonzero((arrivals <= current_seconds) & (current_seconds <= departures))
+            # vehicle is traveling to a stop if it has not arrived a stop but already departed the previous stop
+            traveling_to = np.flatnonzero((current_seconds <= arrivals[1:]) & (current_seconds >= departures[:-1])) + 1
+            stopped_at_position = stopped_at[0] if len(stopped_at) > 0 else None
+            traveling_to_position = traveling_to[0] if len(traveling_to) > 0 else None
+
+        if stopped_at_position is not None:
+            stop_sequence = self.stop_sequences[first + stopped_at_position]
+            return ('STOPPED_AT', '',
+                    self.getStopId(first, last, stop_sequence - 1),
+                    self.stop_ids[first + stopped_at_position],
+                    self.getStopId(first, last, stop_sequence + 1))
+
+        if traveling_to_position is not None:
+            stop_sequence = self.stop_sequences[first + traveling_to_position]
+            return ('IN_TRANSIT_TO',
+                    self.getStopId(first, last, stop_sequence - 2),
+                    self.getStopId(first, last, stop_sequence - 1),
+                    '',
+                    self.stop_ids[first + traveling_to_position])
+
+        return 'ERROR', '', '', '', ''
+
+
+# stop_id -> display name of all stops, built once per tick instead of filtering the stops for every active trip
+def getStopNames(stops):
+    stop_names = {}
+    for stop_id, stop_name, platform_code in zip(stops['stop_id'], stops['stop_name'], stops['platform_code']):
+        # the first stop of a stop_id is used
+        stop_names.setdefault(stop_id, f"{stop_name} (Steig {platform_code})")
+    return stop_names
+
+
+def getStopName(stop_names, stop_id):
+    if stop_id == 'DEPOT':
+        return 'DEPOT'
+    # stop not found
+    return stop_names.get(stop_id, 'ERROR')
+
 
 # create status Dataframe for every active trip, then merge the Dataframes
 # status, current_stop_id, previous_stop_id
 
+# In[193]:
 
-current_time = datetime.datetime.now().time()
 
+def getStatusOfActiveTrips(trips, stop_times, stops, routes):
+    status_rows = []
 
-def isStoppedAtStopTime(stop_time):
-    return parseGtfsTimestringAsTimeObject(stop_time['arrival_realtime']) <= current_time <= parseGtfsTimestringAsTimeObject(stop_time['departure_realtime'])
+    trip_stop_times = TripStopTimes(stop_times)
+    stop_names = getStopNames(stops)
+    # the first route of a route_id is used
+    route_colors = dict(zip(routes['route_id'][::-1], routes['route_color'][::-1]))
 
-# take stop times and iterator to check previous stop
-# check if the stop_time at position i of stop_times is currently being traveled to
-def isTravelingToStoptime(stop_times, i):
-    # loc because i is the pandas index of the row 
-    current_stop_time = stop_times.loc[i]
+    for trip_id, route_id, current_seconds in zip(trips['trip_id'], trips['route_id'], trips['current_seconds']):
+        # the stop the vehicle is currently stopped at or traveling to
+        status, second_previous_stop_id, previous_stop_id, current_stop_id, next_stop_id = trip_stop_times.getSegment(trip_id, current_seconds)
 
-    # if there is no previous stop_time, this is the initial station which cannot be traveled to 
-    try:
-        # i-1 is okay here, because the df is sorted 
-        previous_stop_time = stop_times.loc[i-1]
-    except KeyError:
-        return False
-    has_arrived_at_stop_time = current_time <= parseGtfsTimestringAsTimeObject(current_stop_time['arrival_realtime'])
-    has_departed_previous_stop_time = current_time >= parseGtfsTimestringAsTimeObject(previous_stop_time['departure_realtime'])
-    return has_arrived_at_stop_time and has_departed_previous_stop_time
-
-def getPreviousStopId(stop_times, current_stop_time):
-    trip_id = current_stop_time['trip_id']
-    
-    current_stop_sequence = current_stop_time['stop_sequence']
-        
-    previous_stop_sequence = current_stop_sequence - 1
-    
-    previous_stop_times = stop_times.loc[(stop_times['trip_id'] == trip_id) & (stop_times['stop_sequence'] == previous_stop_sequence)].reset_index(drop=True)
-    
-    if len(previous_stop_times) == 0:
-         # if previous stop does not exist, train is coming from depot
-        return 'DEPOT'
+        current_stop_name= ''
+        previous_stop_name=''
+        statuscode = ''
+        trail_statuscode = ''
 
-    previous_stop_time = previous_stop_times.iloc[0]
-
-    return previous_stop_time['stop_id']
-
-def getSecondPreviousStopId(stop_times, current_stop_time):
-    trip_id = current_stop_time['trip_id']
-    
-    current_stop_sequence = current_stop_time['stop_sequence']
-        
-    second_previous_stop_sequence = current_stop_sequence - 2
-    
-    previous_stop_times = stop_times.loc[(stop_times['trip_id'] == trip_id) & (stop_times['stop_sequence'] == second_previous_stop_sequence)].reset_index(drop=True)
-    
-    if len(previous_stop_times) == 0:
-         # if previous stop does not exist, train is coming from depot
-        return 'DEPOT'
 
-    second_previous_stop_time = previous_stop_times.iloc[0]
+        if status == 'STOPPED_AT':
+            previous_stop_name = getStopName(stop_names, previous_stop_id)
+            current_stop_name = getStopName(stop_names, current_stop_id)
 
-    return second_previous_stop_time['stop_id']
+            statuscode = f"{previous_stop_id}_{current_stop_id}_{next_stop_id}"
 
+            trail_statuscode = f"{previous_stop_id}_{current_stop_id}"
 
+        elif status == 'IN_TRANSIT_TO':
+            previous_stop_name = getStopName(stop_names, previous_stop_id)
 
-def getNextStopId(stop_times, current_stop_time):
-    trip_id = current_stop_time['trip_id']
-    
-    current_stop_sequence = current_stop_time['stop_sequence']
-        
-    next_stop_sequence = current_stop_sequence + 1
-    next_stop_times = stop_times.loc[(stop_times['trip_id'] == trip_id) & (stop_times['stop_sequence'] == next_stop_sequence)].reset_index(drop=True)
-    
-    if len(next_stop_times) == 0:
-        # if previous stop does not exist, train is coming from depot
-        return 'DEPOT'
-    
-    next_stop_time = next_stop_times.iloc[0]
+            statuscode = f"{previous_stop_id}_{next_stop_id}"
+            trail_statuscode = f"{second_previous_stop_id}_{previous_stop_id}_{next_stop_id}"
 
-    return next_stop_time['stop_id']
 
-def getStopName(stops, stop_id):
-    if stop_id == 'DEPOT':
-        return 'DEPOT'
-   # should be 1 or 0
-    applicable_stops = stops.loc[stops['stop_id'] == stop_id]
-    if len(applicable_stops) == 0:
-        # stop not found
-        return 'ERROR'
-    else:
-        applicable_stop = applicable_stops.iloc[0]
-        return f"{applicable_stop['stop_name']} (Steig {applicable_stop['platform_code']})"
-
-status_df = pd.DataFrame()
-
-for i, active_trip in trips.iterrows():
-    trip_id = active_trip['trip_id']
-
-    stop_times_for_this_trip = stop_times.loc[stop_times['trip_id'] == trip_id]
-
-    # find stops, at which the vehicle is currently stopped (should be 0 or 1)
-    # vehicle is stopped, if current time is between arrival and departure of a stop
-    stop_times_stopped_at = [stop_time for _,stop_time in stop_times_for_this_trip.iterrows() if isStoppedAtStopTime(stop_time)]
-
-    # find stops that the vehicle is currently traveling to (should be 0 or 1)
-    # vehicle is traveling to a stop if it has not arrived a stop but already departed the previous stop
-    stop_times_traveling_to = [stop_time for i ,stop_time in stop_times_for_this_trip.iterrows() if isTravelingToStoptime(stop_times_for_this_trip, i)]
-
-    #print(trip_id, len(stop_times_stopped_at), len(stop_times_traveling_to))
-
-    status = ''
-    previous_stop_id = ''
-    current_stop_id = ''
-    next_stop_id = ''
-    current_stop_name= ''
-    previous_stop_name=''
-    statuscode = ''
-
-
-    if len(stop_times_stopped_at) > 0:
-        status = 'STOPPED_AT'
-        current_stop_time = stop_times_stopped_at[0]
-
-        previous_stop_id = getPreviousStopId(stop_times, current_stop_time)
-        current_stop_id = current_stop_time['stop_id']
-        next_stop_id = getNextStopId(stop_times, current_stop_time)
-
-
-        previous_stop_name = getStopName(stops, previous_stop_id)
-        current_stop_name = getStopName(stops, current_stop_id)
-        next_stop_name = getStopName(stops, next_stop_id)
-
-        statuscode = f"{previous_stop_id}_{current_stop_id}_{next_stop_id}"
-        
-        trail_statuscode = f"{previous_stop_id}_{current_stop_id}"
-        
-    elif len(stop_times_traveling_to) > 0:
-        status = 'IN_TRANSIT_TO'
-        next_stop_time = stop_times_traveling_to[0]
-
-        second_previous_stop_id = getSecondPreviousStopId(stop_times, next_stop_time)
-        previous_stop_id = getPreviousStopId(stop_times, next_stop_time)
-        next_stop_id = next_stop_time['stop_id']
-        
-        previous_stop_name = getStopName(stops, previous_stop_id)
-        next_stop_name = getStopName(stops, next_stop_id)
-        
-        statuscode = f"{previous_stop_id}_{next_stop_id}" 
-        trail_statuscode = f"{second_previous_stop_id}_{previous_stop_id}_{next_stop_id}"
-        
-        
-    else: 
-        status = 'ERROR'
-
-  
-   
-        
-    route_id = active_trip['route_id']
-    route_color = routes.loc[routes['route_id'] == route_id]['route_color']
-    
-    status_df_row = pd.DataFrame({'trip_id': trip_id,'status': [status], 
-                  'current_stop_id': [current_stop_id], 
-                  'previous_stop_id': [previous_stop_id], 
-                  'next_stop_id': [next_stop_id],
-                  'current_stop_name': [current_stop_name], 
-                  'previous_stop_name': [previous_stop_name],
-                                 'route_color_hex': route_color, 'statuscode':statuscode, 'trail_statuscode': trail_statuscode})
-
-    
-    status_df = pd.concat([status_df, status_df_row], ignore_index=True)
-
-print(status_df)
+        status_rows.append({'trip_id': trip_id, 'status': status,
+                            'current_stop_id': current_stop_id,
+                            'previous_stop_id': previous_stop_id,
+                            'next_stop_id': next_stop_id,
+                            'current_stop_name': current_stop_name,
+                            'previous_stop_name': previous_stop_name,
+                            'route_color_hex': route_colors.get(route_id), 'statuscode': statuscode, 'trail_statuscode': trail_statuscode})
+
+    # one DataFrame for all trips, concatenating a DataFrame per trip copies all previous rows every time
+    status_df = pd.DataFrame(status_rows)
+
+    print(status_df)
+
+    return status_df
 
 
 # ## 8. Convert status to LED Matrix
 # To finally display the vehicles on our LED Matrix, we need to translate the statuses of the vehicles into LEDs.
 # For this, we create a mapping as csv, which we read as pandas dataframe, that maps a status to LEDs.
-# A status is encoded as \<previous_stop_id>\_\<current_stop_id>_<T (transit) / S (stopped at)>, e.g. 
-# 427404_427504_S for STOPPED_AT Gadamerplatz Steig A, coming from Eppelheimer Terrasse (Steig B)  
+# A status is encoded as \<previous_stop_id>\_\<current_stop_id>_<T (transit) / S (stopped at)>, e.g.
+# 427404_427504_S for STOPPED_AT Gadamerplatz Steig A, coming from Eppelheimer Terrasse (Steig B)
 # The LEDs are addressed by their respective X and Y coordinate on the Matrix.
 # In the mapping a status is mapped to one or more LEDs. LEDs are separated by &. LEDs can be referenced by multiple statuses.
-# Example: 
+# Example:
 # When the train is stopped at Gadamerplatz Steig A coming from Eppelheimer Terrasse Steig B the LEDs x=0, y=0 and x=0, y=1 should light up.
 # The csv would look as follows
 # ```
-# statuscode,      leds  
+# statuscode,      leds
 # 427404_427504_S, 0-0&0-1
 # ```
-# 
-# The LED matrix is represented in a pandas dataframe with the cell \[x,y] representing the LED at x,y in the matrix. The cell value is the HEX color(s) that the LED should display.  
+#
+# The mapping is compiled once into the pixel indices (y * 64 + x) of every statuscode (see led_mapping.py), so a tick only looks up
+# the statuscodes of the active vehicles in a dict and paints their pixels instead of filtering the mapping and parsing the led strings.
+# The dimmed route background is rendered once per load into a 32x64 rgb frame, every tick copies it and only draws the vehicles on top.
+#
+# The LED matrix is represented as a LedFrame (see led_frame.py), a (32, 64, 3) rgb array with the pixel \[y,x] representing the LED at x,y in the matrix,
+# or a larger frame for chained panels (--led-chain, --led-parallel). It is written to a csv file where the cell value is the HEX color(s) that the LED should display.
 # A cell value is either
 # - 000000 => no light
 # - single HEX-code (e.g. "FDC300") => static light FDC300
 # - multiple HEX-codes separated by & (e.g. "FDC300&B10346") => light switching from FDC300 to B10346, indicating multiple vehicles on the same track
-# 
-# This dataframe / csv is the final output of this notebook and will be the input for the script that directly controls the LED matrix.  
-# To continue the example above, the output matrix, assuming the route color is FDC300 would be  
-# None,0     ,1,2...  
-# 0   ,FDC300, ,  
-# 1   ,FDC300, ,  
-# 2   ,      , ,  
-# ...  
-# 
-# 
-# 
-# 
+#   (the frames of all color phases are rendered here, display-csv.py switches between them)
+#
+# This csv (or the binary frame file, see below) is the final output of this notebook and will be the input for the script that directly controls the LED matrix.
+# To continue the example above, the output matrix, assuming the route color is FDC300 would be
+# None,0     ,1,2...
+# 0   ,FDC300, ,
+# 1   ,FDC300, ,
+# 2   ,      , ,
+# ...
+#
+#
+#
+#
+
+# In[194]:
+
+
+# collects the colors of the leds of a statuscode (pixel_indices of the led mapping), pixel index -> colors in the order they are drawn
+def process_statuscode(led_colors, pixel_indices, rgb):
+    for pixel_index in pixel_indices.tolist():
+        colors = led_colors.setdefault(pixel_index, [])
+        if rgb not in colors:
+            colors.append(rgb)
+
+
+# routes without route_color (e.g. bus routes with relevant_lines=all) are white, the default of the gtfs reference
+def getRouteRgb(route_color_hex):
+    if not isinstance(route_color_hex, str) or route_color_hex.strip() == '':
+        route_color_hex = default_route_color
+    return hexToRgb(route_color_hex)
+
+
+# one frame per color phase, a led with several vehicles shows the color of the next vehicle in every phase
+def createLedMatrix(status_df, led_mapping, background_frame, using_realtime):
+    vehicle_colors = {}
+    trail_colors = {}
+
+    # unmapped statuscodes are reported once per tick, with relevant_lines=all most vehicles are on lines without leds
+    skipped_statuscodes = []
+
+    # iterate over status_df rows and display them (overwrites the route background)
+    for statuscode, trail_statuscode, route_color_hex in zip(status_df.get('statuscode', []), status_df.get('trail_statuscode', []), status_df.get('route_color_hex', [])):
+        # None if the statuscode is not in the mapping (yet)
+        pixel_indices = led_mapping.getPixelIndices(statuscode)
+        trail_pixel_indices = led_mapping.getPixelIndices(trail_statuscode)
+        if pixel_indices is None:
+            skipped_statuscodes.append(statuscode)
+        if pixel_indices is None and trail_pixel_indices is None:
+            continue
+
+        route_rgb = getRouteRgb(route_color_hex)
+
+        # if a statuscode occurs on more than one route, it is still displayed on the same leds
+        if pixel_indices is not None:
+            process_statuscode(vehicle_colors, pixel_indices, route_rgb)
+        if trail_pixel_indices is not None:
+            process_statuscode(trail_colors, trail_pixel_indices, dimRgb(route_rgb, 0.5))
+
+    if len(skipped_statuscodes) > 0:
+        print(f"skipped {len(skipped_statuscodes)} of {len(status_df)} vehicles with statuscodes that are not in the mapping, e.g. {', '.join(skipped_statuscodes[:5])}")
+
+    # trails are only shown on leds without a vehicle
+    for pixel_index, colors in trail_colors.items():
+        vehicle_colors.setdefault(pixel_index, colors)
+
+    phases = min(max([len(colors) for colors in vehicle_colors.values()], default=1), max_frame_phases)
+
+    # start from the route background (see StaticData), the vehicles are drawn on top
+    frames = []
+    for phase in range(phases):
+        frame = background_frame.copy()
+        for pixel_index, colors in vehicle_colors.items():
+            frame.setPixels(pixel_index, colors[phase % len(colors)])
+
+        # show if realtime data is used
+        if using_realtime:
+            frame.setPixel(0, 0, hexToRgb("008000"))
+        else:
+            frame.setPixel(0, 0, hexToRgb("C1121C"))
 
-# In[192]:
+        frames.append(frame)
 
+    return frames
 
-import pandas as pd
-import numpy as np
 
-# import mapping
-statuscode_led_mapping = pd.read_csv('./statuscode_led_mapping.csv', sep=';')
+# 6 KB of raw rgb pixels per phase with a small header, written atomically (see led_frame.py)
+def writeLedMatrix(frames, using_realtime, frame_path=led_frame_path):
+    writeFrameFile(frame_path, frames, using_realtime)
 
-# create led_matrix dataframe with all led colors set to black
-led_matrix = pd.DataFrame(np.full((32,64), "000000"))
 
-# add dimmed gray backlight to show route paths
-statuscode_led_mapping = pd.read_csv('statuscode_led_mapping.csv', sep=";")
+# only written with --csv, e.g. for debugging
+def writeLedMatrixCsv(frames):
+    # rows are y, columns are x
+    hex_colors = np.stack([frame.toHex() for frame in frames])
+    led_matrix = pd.DataFrame(hex_colors[0])
 
-for i, statuscode_led_mapping_row in statuscode_led_mapping.iterrows():
-    # light stations brighter than transit segments
-    color = "000000"
-    statuscode_segments = statuscode_led_mapping_row['statuscode'].split("_")
-    if len(statuscode_segments) == 3:
-        color = "111111"
-    else:
-        color = "111111"
-        
-    led_mapping_string = statuscode_led_mapping_row['leds']
-    leds_xy = led_mapping_string.split("&")
-    
-    for led_xy in leds_xy:
-        x, y = led_xy.split("-")
-        led_matrix.at[int(y), int(x)] = color
-
-
-# iterate over status_df rows and display them (overwrites the route background)
-
-def dim_hex_color(hex_color, factor):
-    # HEX -> RGB
-    r = int(hex_color[0:2], 16)
-    g = int(hex_color[2:4], 16)
-    b = int(hex_color[4:6], 16)
-
-    # Dimmen und sicherstellen, dass der Wert im Bereich [0, 255] bleibt
-    r = int(max(0, min(255, r * factor)))
-    g = int(max(0, min(255, g * factor)))
-    b = int(max(0, min(255, b * factor)))
-
-    # RGB -> HEX
-    return "{:02X}{:02X}{:02X}".format(r, g, b)
-
-
-def process_statuscode(statuscode, color):
-    applicable_mapping_rows = statuscode_led_mapping[statuscode_led_mapping['statuscode'] == statuscode]
-    if len(applicable_mapping_rows) == 0:
-        # statuscode not in mapping yet
-        print(f"skipping statuscode {statuscode}") 
-        return
-    
-    statuscode_led_mapping_row = applicable_mapping_rows.loc[applicable_mapping_rows.index[0]]
-
-    led_mapping_string = statuscode_led_mapping_row['leds']
-    leds_xy = led_mapping_string.split("&")
-    for led_xy in leds_xy:
-        x, y = led_xy.split("-")
-        print(f"lighting led at x={x} and y={y}")
-        # .at works with [row (y), col(x)]
-        led_matrix.at[int(y),int(x)] = color
-    
-
-for _, status_row in status_df.iterrows():
-    statuscode = status_row['statuscode']
-    trail_statuscode = status_row['trail_statuscode']
-    
-    route_color_hex = status_row['route_color_hex']
-    trail_route_color_hex = dim_hex_color(route_color_hex, 0.5)
-    
-    print(route_color_hex)
-    print(trail_route_color_hex)
-
-    # get corresponding led coordinates from mapping
-    # if a statuscode occurs on more than one route, more than 1 mapping row will be found, but as a statuscode is always displayed on the same leds
-    # all rows will contain the same led coordinates
-    
-    process_statuscode(statuscode, route_color_hex)
-    process_statuscode(trail_statuscode, trail_route_color_hex)
-
-# show if realtime data is used
-if using_realtime:
-    led_matrix.at[0,0] = "008000"
-else:
-    led_matrix.at[0,0] = "C1121C"
-    
-
-
-# header None so that column index and row index type are int on import and we can use [int][int] to locate datapoints
-led_matrix.to_csv('./led-matrix.csv', header=None, index=False)
-
-led_matrix_read = pd.read_csv('./led-matrix.csv',header=None, dtype=str, index_col=None)
-print(led_matrix_read[0][0] == "000000")
-led_matrix_read.at[0,0] = "BCD300"
+    # leds that change between the phases list all their colors, e.g. FDC300&B10346
+    for y, x in zip(*np.nonzero((hex_colors != hex_colors[0]).any(axis=0))):
+        led_matrix.at[y, x] = '&'.join(dict.fromkeys(hex_colors[:, y, x]))
+
+    # header None so that column index and row index type are int on import and we can use [int][int] to locate datapoints
+    led_matrix.to_csv(led_matrix_path, header=None, index=False)
 
 
+# shared memory channel to display-csv.py (see led_frame_channel.py), None if it can't be created
+def openFrameChannel(width, height):
+    try:
+        return FrameChannelWriter(width, height)
+    except OSError as e:
+        print(f"no frame channel, only writing {led_frame_path}: {e}")
+        return None
+
+
+# The led matrix only changes if a vehicle moved to another segment, so the matrix is only rendered and written
+# if the statuscodes differ from the last tick. During quiet periods and at night, most ticks end here.
+# A new frame is handed to the display process through shared memory and written to the frame file led-matrix.frame,
+# which the display process reads if there is no frame channel. The csv file is only written with --csv.
+# Without frame_path no frame file is written, e.g. when replaying recorded feeds.
+
+# In[195]:
+
+
+class LedMatrixOutput(object):
+    def __init__(self, frame_channel=None, write_csv=False, frame_path=led_frame_path):
+        self.frame_channel = frame_channel
+        self.write_csv = write_csv
+        self.frame_path = frame_path
+        self.last_key = None
+
+    def getKey(self, static_data, status_df, using_realtime):
+        if len(status_df) == 0:
+            return (static_data.feed_path, static_data.source_mtime, using_realtime)
+        return (static_data.feed_path, static_data.source_mtime, using_realtime, tuple(status_df[['statuscode', 'trail_statuscode', 'route_color_hex']].itertuples(index=False, name=None)))
+
+    def update(self, static_data, status_df, using_realtime, stage_timer=None):
+        if stage_timer is None:
+            stage_timer = StageTimer()
+
+        key = self.getKey(static_data, status_df, using_realtime)
+        if key == self.last_key:
+            print("led matrix unchanged")
+            return None
+
+        with stage_timer.measure('render'):
+            frames = createLedMatrix(status_df, static_data.led_mapping, static_data.background_frame, using_realtime)
+        with stage_timer.measure('write'):
+            if self.frame_channel is not None:
+                self.frame_channel.write(frames, using_realtime)
+            if self.frame_path is not None:
+                writeLedMatrix(frames, using_realtime, self.frame_path)
+            if self.write_csv:
+                writeLedMatrixCsv(frames)
+        self.last_key = key
+
+        return frames
+
+
+# ## Tick
+# One extraction run: fetch the trip_updates and recompute the vehicle positions from the static data in memory.
+#
+# The stage timer measures the stages of a tick: load (reloading the static data), auth, fetch, filter, enrich, status, render and write.
+# A stage that runs inside another one (auth inside fetch) is only counted for itself, so the stages add up to the tick.
+
+# In[196]:
+
+
+class StageTimer(object):
+    stages = ['load', 'auth', 'fetch', 'filter', 'enrich', 'status', 'render', 'write']
+
+    def __init__(self):
+        self.durations = {stage: 0.0 for stage in self.stages}
+        # durations of the stages running inside the open stages
+        self.nested_durations = []
+
+    @contextmanager
+    def measure(self, stage):
+        start = time.perf_counter()
+        self.nested_durations.append(0.0)
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self.durations[stage] += duration - self.nested_durations.pop()
+            if len(self.nested_durations) > 0:
+                self.nested_durations[-1] += duration
+
+    def getTotal(self):
+        return sum(self.durations.values())
+
+    # e.g. "fetch 0.31s, filter 0.05s, ..." for the stages that took time
+    def getSummary(self):
+        return ', '.join(f"{stage} {duration:.2f}s" for stage, duration in self.durations.items() if duration > 0)
+
+
+def tick(static_data, trip_updates_fetcher, led_matrix_output, current_datetime, stage_timer=None):
+    if stage_timer is None:
+        stage_timer = StageTimer()
+
+    with stage_timer.measure('fetch'):
+        trip_updates, using_realtime = trip_updates_fetcher.fetch(stage_timer)
+
+    with stage_timer.measure('filter'):
+        trip_updates, trips, stop_times = selectRelevantData(trip_updates, static_data.trips, static_data.stop_times, static_data.service_day_index, current_datetime)
+        trip_updates, trips, stop_times = removeCanceledTrips(trip_updates, trips, stop_times)
+    with stage_timer.measure('enrich'):
+        trip_delays = indexTripUpdates(trip_updates, stop_times)
+        stop_times = enrichStopTimesWithRealtime(trip_delays, stop_times)
+        trips = addRealtimeStartAndEndToTrips(trips, stop_times)
+    with stage_timer.measure('status'):
+        trips = selectActiveTrips(trips, current_datetime)
+        status_df = getStatusOfActiveTrips(trips, stop_times, static_data.stops, static_data.routes)
+
+    return led_matrix_output.update(static_data, status_df, using_realtime, stage_timer)
+
+
+# Every tick has to finish within its budget, by default the interval between two ticks. With more lines (up to relevant_lines=all)
+# the ticks get longer, so the daemon measures every tick, reports every tick that exceeds the budget (overrun)
+# and prints the median, 95th percentile and maximum of the last window ticks every window ticks.
+class TickBudget(object):
+    def __init__(self, budget_seconds, window=60):
+        self.budget_seconds = budget_seconds
+        self.window = window
+        self.durations = []
+        self.overruns = 0
+
+    # True if the tick exceeded the budget, the stages of an overrun are printed if stage_timer is given
+    def record(self, tick_duration, stage_timer=None):
+        self.durations.append(tick_duration)
+        overrun = tick_duration > self.budget_seconds
+        if overrun:
+            self.overruns += 1
+            print(f"tick overrun: {tick_duration:.2f}s exceeds the budget of {self.budget_seconds:.2f}s by {tick_duration - self.budget_seconds:.2f}s")
+            if stage_timer is not None:
+                print(f"stages: {stage_timer.getSummary()}")
+
+        if len(self.durations) >= self.window:
+            print(self.getSummary())
+            self.durations = []
+            self.overruns = 0
+        return overrun
+
+    def getSummary(self):
+        durations = np.array(self.durations)
+        return (f"last {len(durations)} ticks: median {np.median(durations):.2f}s, p95 {np.percentile(durations, 95):.2f}s, max {durations.max():.2f}s, "
+                f"{self.overruns} over the budget of {self.budget_seconds:.2f}s")
+
+
+# run ticks forever, starting a new tick every interval seconds
+def runDaemon(static_data, interval, led_matrix_output, tick_budget, trip_updates_fetcher):
+    while True:
+        tick_start = time.monotonic()
+        stage_timer = StageTimer()
+
+        try:
+            with stage_timer.measure('load'):
+                static_data.reloadIfChanged()
+            tick(static_data, trip_updates_fetcher, led_matrix_output, datetime.datetime.now(), stage_timer)
+        except Exception as e:
+            # keep the service alive, the next tick will try again
+            print(e)
+
+        tick_duration = time.monotonic() - tick_start
+        print(f"tick took {tick_duration:.2f}s")
+        tick_budget.record(tick_duration, stage_timer)
+
+        # after an overrun the next tick starts right away
+        time.sleep(max(0, interval - tick_duration))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--daemon", action="store_true", help="Keep running and recompute the led matrix every --interval seconds")
+    parser.add_argument("--interval", action="store", help="Seconds between two ticks in daemon mode. Default: 10", default=10, type=float)
+    parser.add_argument("--tick-budget", action="store", help="Seconds a tick may take before it is reported as overrun. Default: --interval", default=None, type=float)
+    parser.add_argument("--csv", action="store_true", help="Also write the led matrix as hex colors to led-matrix.csv, e.g. for debugging")
+    parser.add_argument("--record", action="store", help="Save every received trip updates feed to this directory, to replay it with replay_trip_updates.py", default=None, type=str)
+    # same panel options as matrixbase.py, the frame is led-cols * led-chain wide and led-rows * led-parallel high
+    parser.add_argument("-r", "--led-rows", action="store", help="Display rows. Default: 32", default=32, type=int)
+    parser.add_argument("--led-cols", action="store", help="Panel columns. Default: 64", default=64, type=int)
+    parser.add_argument("-c", "--led-chain", action="store", help="Daisy-chained boards. Default: 1.", default=1, type=int)
+    parser.add_argument("-P", "--led-parallel", action="store", help="Parallel chains. Default: 1", default=1, type=int)
+    args = parser.parse_args()
+
+    # a typo would fall back to parsing json and fail on every fetch
+    if trip_updates_format not in feed_formats:
+        sys.exit(f"gtfs_rt_format={trip_updates_format} in the .env file is not a trip updates format, use one of: {', '.join(feed_formats)}")
+
+    static_data = StaticData(frame_size=getFrameSize(args.led_cols, args.led_rows, args.led_chain, args.led_parallel))
+    static_data.load()
+    led_matrix_output = LedMatrixOutput(openFrameChannel(static_data.frame_width, static_data.frame_height), write_csv=args.csv)
+    trip_updates_fetcher = TripUpdatesFetcher(TripUpdatesRecorder(args.record, trip_updates_format) if args.record is not None else None)
+
+    if args.daemon:
+        runDaemon(static_data, args.interval, led_matrix_output, TickBudget(args.tick_budget if args.tick_budget is not None else args.interval), trip_updates_fetcher)
+    else:
+        tick(static_data, trip_updates_fetcher, led_matrix_output, datetime.datetime.now())
@@ -0,0 +1,34 @@
+# # Relevant lines
+# The lines that preprocess_static.py keeps and extract_active_vehicles.py shows, configured with relevant_lines in the .env file:
+# comma separated line numbers (e.g. relevant_lines=22,26,5) or "all" for the whole network. Default: the lines of the led mapping.
+# Routes, trips and trip updates are selected by the prefix of their route / trip id ("22-..."),
+# for "all" the prefix is the empty string, which matches every id.
+
+from os import getenv
+
+from dotenv import load_dotenv
+
+default_relevant_lines = ['22', '26', '5', '23', '21', '24']
+all_lines = 'all'
+
+
+# "22, 26,5" -> ['22', '26', '5'], "all" -> ['all']
+def parseRelevantLines(relevant_lines_setting):
+    if relevant_lines_setting is None or relevant_lines_setting.strip() == '':
+        return default_relevant_lines
+
+    relevant_lines = [line.strip() for line in relevant_lines_setting.split(',') if line.strip() != '']
+    if all_lines in (line.lower() for line in relevant_lines):
+        return [all_lines]
+    return relevant_lines
+
+
+def getRelevantLines():
+    load_dotenv()
+    return parseRelevantLines(getenv('relevant_lines'))
+
+
+def getTripPrefixes(relevant_lines):
+    if relevant_lines == [all_lines]:
+        return ['']
+    return [line + '-' for line in relevant_lines]
@@ -0,0 +1,98 @@
+# # GTFS-RT authentication
+# The realtime api is protected with the oauth2 client credentials flow.
+# An access token is valid for about an hour, so instead of requesting a new one before every fetch,
+# the TokenManager keeps the token in memory and in a small cache file (readable only by the owner),
+# so that it survives restarts of the extraction script.
+# A new token is only requested shortly before the old one expires or after the api answered with 401.
+# The token request has the same timeout as the feed requests, so a stalled token endpoint can't block the daemon.
+
+import json
+import os
+import time
+
+import requests
+from oauthlib.oauth2 import WebApplicationClient
+
+from http_client import default_timeout_seconds
+
+
+class TokenManager(object):
+    def __init__(self, client_id, client_secret, resource, tenant_id, cache_path=None, auth_url=None, refresh_margin_seconds=60,
+                 timeout_seconds=default_timeout_seconds):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.resource = resource
+        self.auth_url = auth_url or f'https://login.microsoftonline.com/{tenant_id}/oauth2/token'
+        self.cache_path = cache_path
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.timeout_seconds = timeout_seconds
+
+        self.access_token = None
+        self.expires_at = 0
+
+        self.readCache()
+
+    def isValid(self):
+        return self.access_token is not None and time.time() < self.expires_at - self.refresh_margin_seconds
+
+    def getAccessToken(self, session=None):
+        if not self.isValid():
+            self.refresh(session)
+        return self.access_token
+
+    # forget the current token, e.g. after the api answered with 401 Unauthorized
+    def invalidate(self):
+        self.access_token = None
+        self.expires_at = 0
+        if self.cache_path is not None and os.path.exists(self.cache_path):
+            os.remove(self.cache_path)
+
+    def refresh(self, session=None):
+        client = WebApplicationClient(self.client_id)
+
+        # prepare x-www-form-urlencoded body data
+        data = f'grant_type=client_credentials&resource={self.resource}&client_id={self.client_id}&client_secret={self.client_secret}'
+        headers = {'Content-type': 'application/x-www-form-urlencoded'}
+
+        post = session.post if session is not None else requests.post
+        auth_response = post(self.auth_url, data=data, headers=headers, timeout=self.timeout_seconds)
+        auth = client.parse_request_body_response(auth_response.text)
+
+        self.access_token = auth['access_token']
+        # oauthlib computes expires_at from expires_in, fall back to 1 hour if the server does not send it
+        self.expires_at = float(auth.get('expires_at', time.time() + 3600))
+        print(f"fetched new access token, valid for {int(self.expires_at - time.time())}s")
+
+        self.writeCache()
+
+    def readCache(self):
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, 'r') as cache_file:
+                cache = json.load(cache_file)
+        except (OSError, ValueError) as e:
+            print(e)
+            return
+
+        # ignore tokens issued for other credentials
+        if cache.get('client_id') != self.client_id or cache.get('auth_url') != self.auth_url:
+            return
+
+        self.access_token = cache['access_token']
+        self.expires_at = float(cache['expires_at'])
+
+    def writeCache(self):
+        if self.cache_path is None:
+            return
+
+        cache = {'client_id': self.client_id, 'auth_url': self.auth_url,
+                 'access_token': self.access_token, 'expires_at': self.expires_at}
+
+        # create the file with owner-only permissions before writing the token, then swap it in
+        temp_path = f'{self.cache_path}.tmp'
+        file_descriptor = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.fchmod(file_descriptor, 0o600)
+        with os.fdopen(file_descriptor, 'w') as cache_file:
+            json.dump(cache, cache_file)
+        os.replace(temp_path, self.cache_path)
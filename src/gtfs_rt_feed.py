@@ -0,0 +1,118 @@
+# # GTFS-RT trip update feeds
+# The realtime api offers the trip updates in two formats:
+# - {hostname}/tripupdates/decoded: the FeedMessage as json (large, slow to parse)
+# - {hostname}/tripupdates: the FeedMessage as binary protobuf (several times smaller, fast to parse)
+#
+# Both parsers return the feed in the same structure as the json endpoint, e.g.
+# {'header': {'timestamp': '1728000000', ...}, 'entity': [{'id': '...', 'tripUpdate': {'trip': {'tripId': ..., 'scheduleRelationship': ...}, 'stopTimeUpdate': [...]}}]}
+# so the rest of the extraction does not care about the format.
+# The protobuf parser can additionally skip all trips outside of the relevant lines while parsing,
+# instead of building dicts for the whole network first.
+# If the FeedHeader.timestamp equals previous_timestamp, the feed has not changed since the last fetch
+# and the parsers return None instead of the feed.
+
+import json
+
+feed_formats = ['json', 'protobuf']
+
+
+def getTripUpdatesUrl(hostname, feed_format):
+    if feed_format == 'protobuf':
+        return f'{hostname}/tripupdates'
+    return f'{hostname}/tripupdates/decoded'
+
+
+def parseJsonFeed(payload, trip_prefixes=None, previous_timestamp=None):
+    feed = json.loads(payload)
+
+    if previous_timestamp is not None and feed.get('header', {}).get('timestamp') == previous_timestamp:
+        return None
+
+    if trip_prefixes is not None:
+        feed['entity'] = [entity for entity in feed.get('entity', [])
+                          if 'tripUpdate' in entity and entity['tripUpdate']['trip']['tripId'].startswith(tuple(trip_prefixes))]
+
+    return feed
+
+
+def stopTimeEventToDict(stop_time_event):
+    stop_time_event_dict = {}
+    if stop_time_event.HasField('delay'):
+        stop_time_event_dict['delay'] = stop_time_event.delay
+    if stop_time_event.HasField('time'):
+        # int64 values are encoded as strings in the json feed
+        stop_time_event_dict['time'] = str(stop_time_event.time)
+    if stop_time_event.HasField('uncertainty'):
+        stop_time_event_dict['uncertainty'] = stop_time_event.uncertainty
+    return stop_time_event_dict
+
+
+def parseProtobufFeed(payload, trip_prefixes=None, previous_timestamp=None):
+    # only needed for the protobuf format, so it is imported lazily
+    from google.transit import gtfs_realtime_pb2
+
+    feed_message = gtfs_realtime_pb2.FeedMessage()
+    feed_message.ParseFromString(payload)
+
+    # enum number -> name, as used by the json feed
+    trip_schedule_relationship_names = {number: name for name, number in gtfs_realtime_pb2.TripDescriptor.ScheduleRelationship.items()}
+    stop_schedule_relationship_names = {number: name for name, number in gtfs_realtime_pb2.TripUpdate.StopTimeUpdate.ScheduleRelationship.items()}
+
+    header = feed_message.header
+    if previous_timestamp is not None and str(header.timestamp) == previous_timestamp:
+        return None
+
+    feed = {'header': {'gtfsRealtimeVersion': header.gtfs_realtime_version,
+                       'incrementality': gtfs_realtime_pb2.FeedHeader.Incrementality.Name(header.incrementality),
+                       'timestamp': str(header.timestamp)},
+            'entity': []}
+
+    for entity in feed_message.entity:
+        if not entity.HasField('trip_update'):
+            continue
+
+        trip_update = entity.trip_update
+        trip = trip_update.trip
+
+        # skip trips of other lines before building any dicts
+        if trip_prefixes is not None and not trip.trip_id.startswith(tuple(trip_prefixes)):
+            continue
+
+        stop_time_updates = []
+        for stop_time_update in trip_update.stop_time_update:
+            stop_time_update_dict = {'scheduleRelationship': stop_schedule_relationship_names[stop_time_update.schedule_relationship]}
+            # optional like in the json feed, an update may only have a stop_id (see resolveStopSequences in extract_active_vehicles.py)
+            if stop_time_update.HasField('stop_sequence'):
+                stop_time_update_dict['stopSequence'] = stop_time_update.stop_sequence
+            if stop_time_update.HasField('stop_id'):
+                stop_time_update_dict['stopId'] = stop_time_update.stop_id
+            if stop_time_update.HasField('arrival'):
+                stop_time_update_dict['arrival'] = stopTimeEventToDict(stop_time_update.arrival)
+            if stop_time_update.HasField('departure'):
+                stop_time_update_dict['departure'] = stopTimeEventToDict(stop_time_update.departure)
+            stop_time_updates.append(stop_time_update_dict)
+
+        trip_dict = {'tripId': trip.trip_id,
+                     'scheduleRelationship': trip_schedule_relationship_names[trip.schedule_relationship]}
+        if trip.HasField('route_id'):
+            trip_dict['routeId'] = trip.route_id
+        if trip.HasField('start_time'):
+            trip_dict['startTime'] = trip.start_time
+        if trip.HasField('start_date'):
+            trip_dict['startDate'] = trip.start_date
+
+        trip_update_dict = {'trip': trip_dict, 'stopTimeUpdate': stop_time_updates}
+        if trip_update.HasField('timestamp'):
+            trip_update_dict['timestamp'] = str(trip_update.timestamp)
+        if trip_update.HasField('delay'):
+            trip_update_dict['delay'] = trip_update.delay
+
+        feed['entity'].append({'id': entity.id, 'tripUpdate': trip_update_dict})
+
+    return feed
+
+
+def parseFeed(payload, feed_format, trip_prefixes=None, previous_timestamp=None):
+    if feed_format == 'protobuf':
+        return parseProtobufFeed(payload, trip_prefixes, previous_timestamp)
+    return parseJsonFeed(payload, trip_prefixes, previous_timestamp)
@@ -0,0 +1,107 @@
+# # Recording and replaying GTFS-RT trip update feeds
+# extract_active_vehicles.py --record <directory> saves every trip updates feed it receives from the realtime api unchanged,
+# as tripupdates-<fetch time>.json or .pb (depending on gtfs_rt_format), with the local time of the fetch in the file name,
+# e.g. tripupdates-20241015T082000.pb. Feeds the server answered with 304 Not Modified are not saved again.
+#
+# ReplayTripUpdatesFetcher replaces TripUpdatesFetcher and returns the recorded feed that was current at a replayed time,
+# so the extraction runs without credentials and network on the same input every time (see replay_trip_updates.py).
+# If the last recorded feed is older than max_age_seconds at the replayed time (e.g. the api was down while recording),
+# the fetcher behaves like a failed fetch and the extraction shows the schedule without realtime data.
+
+import datetime
+import os
+import re
+from bisect import bisect_right
+
+from gtfs_rt_feed import parseFeed
+
+recording_file_extensions = {'json': 'json', 'protobuf': 'pb'}
+recording_file_pattern = re.compile(r'^tripupdates-(\d{8}T\d{6})\.(json|pb)$')
+recording_time_format = '%Y%m%dT%H%M%S'
+
+
+class RecordedFeed(object):
+    def __init__(self, recorded_at, feed_format, feed_path):
+        self.recorded_at = recorded_at
+        self.feed_format = feed_format
+        self.feed_path = feed_path
+
+    def readPayload(self):
+        with open(self.feed_path, 'rb') as feed_file:
+            return feed_file.read()
+
+
+class TripUpdatesRecorder(object):
+    def __init__(self, recording_path, feed_format):
+        self.recording_path = recording_path
+        self.feed_format = feed_format
+        os.makedirs(recording_path, exist_ok=True)
+
+    def save(self, payload, recorded_at):
+        feed_path = os.path.join(self.recording_path, f"tripupdates-{recorded_at.strftime(recording_time_format)}.{recording_file_extensions[self.feed_format]}")
+
+        # a replay that runs at the same time never reads a half written feed
+        temp_path = feed_path + '.tmp'
+        with open(temp_path, 'wb') as feed_file:
+            feed_file.write(payload)
+        os.replace(temp_path, feed_path)
+        return feed_path
+
+
+# recorded feeds of a directory, oldest first
+def readRecording(recording_path):
+    feed_formats = {extension: feed_format for feed_format, extension in recording_file_extensions.items()}
+
+    recording = []
+    for file_name in os.listdir(recording_path):
+        match = recording_file_pattern.match(file_name)
+        if match is None:
+            continue
+        recorded_at = datetime.datetime.strptime(match.group(1), recording_time_format)
+        recording.append(RecordedFeed(recorded_at, feed_formats[match.group(2)], os.path.join(recording_path, file_name)))
+
+    if len(recording) == 0:
+        raise Exception(f"no recorded trip updates in {recording_path}")
+    return sorted(recording, key=lambda recorded_feed: recorded_feed.recorded_at)
+
+
+# same interface as TripUpdatesFetcher: fetch returns the trip_updates and whether realtime data is used
+class ReplayTripUpdatesFetcher(object):
+    def __init__(self, recording, trip_prefixes, max_age_seconds=120):
+        self.recording = recording
+        self.recorded_times = [recorded_feed.recorded_at for recorded_feed in recording]
+        self.trip_prefixes = trip_prefixes
+        self.max_age_seconds = max_age_seconds
+        self.current_datetime = None
+        self.current_feed = None
+        self.trip_updates = None
+
+    # the replayed time of the next fetch
+    def setCurrentDatetime(self, current_datetime):
+        self.current_datetime = current_datetime
+
+    # the recorded feed that was current at current_datetime, or None
+    def getRecordedFeed(self):
+        index = bisect_right(self.recorded_times, self.current_datetime) - 1
+        if index < 0:
+            return None
+        recorded_feed = self.recording[index]
+        if (self.current_datetime - recorded_feed.recorded_at).total_seconds() > self.max_age_seconds:
+            return None
+        return recorded_feed
+
+    def fetch(self, stage_timer=None):
+        recorded_feed = self.getRecordedFeed()
+        if recorded_feed is None:
+            self.current_feed = None
+            self.trip_updates = None
+            return [], False
+
+        # like 304 Not Modified
+        if recorded_feed is self.current_feed:
+            return self.trip_updates, True
+
+        feed = parseFeed(recorded_feed.readPayload(), recorded_feed.feed_format, self.trip_prefixes)
+        self.current_feed = recorded_feed
+        self.trip_updates = [trip_update['tripUpdate'] for trip_update in feed['entity']]
+        return self.trip_updates, True
@@ -0,0 +1,92 @@
+# # GTFS schema
+# Columns and dtypes of the gtfs tables, so preprocess_static.py and extract_active_vehicles.py only read the columns they use,
+# with fixed types instead of types pandas infers from the values (e.g. stop_id as int64 in one feed and as object in the next one).
+#
+# feed_schema describes the tables of the gtfs zip that the preprocessing reads, ids are read as strings, so they are written back unchanged.
+# filtered_schema describes the tables the preprocessing writes to gtfs_filtered and the extraction reads (csv files or binary snapshot,
+# see gtfs_snapshot.py): ids are categorical (also service_id, which is a string like "216-217-218" in the rnv feed) and all times are integer seconds.
+#
+# Large tables are parsed with pyarrow if it is installed (about twice as fast as the c parser of pandas on a single core, multithreaded), otherwise with pandas.
+# pyarrow.csv is used directly instead of read_csv(engine='pyarrow'), because the latter infers the types first
+# and converts them afterwards, so "000123" would become "123" and empty values "None".
+
+import numpy as np
+import pandas as pd
+
+
+class TableSchema(object):
+    # columns: column -> dtype, engine: 'pyarrow' or 'c', all_columns: read the other columns as well, with inferred types
+    def __init__(self, columns, engine='c', all_columns=False):
+        self.columns = columns
+        self.engine = engine
+        self.all_columns = all_columns
+
+    # column -> dtype of the columns of the schema that are in the file, in the order of the file (optional columns like platform_code may be missing)
+    def getColumns(self, header_columns):
+        return {column: self.columns[column] for column in header_columns if column in self.columns}
+
+
+feed_schema = {
+    'calendar': TableSchema({'service_id': 'object', 'monday': 'int8', 'tuesday': 'int8', 'wednesday': 'int8', 'thursday': 'int8',
+                             'friday': 'int8', 'saturday': 'int8', 'sunday': 'int8', 'start_date': 'int32', 'end_date': 'int32'}),
+    'calendar_dates': TableSchema({'service_id': 'object', 'date': 'int32', 'exception_type': 'int8'}),
+    'routes': TableSchema({'route_id': 'object', 'route_short_name': 'object', 'route_desc': 'object', 'route_color': 'object'}),
+    'trips': TableSchema({'route_id': 'object', 'trip_id': 'object', 'service_id': 'object', 'trip_short_name': 'object'}, engine='pyarrow'),
+    # copied to gtfs_filtered completely
+    'stops': TableSchema({'stop_id': 'object', 'stop_name': 'object', 'platform_code': 'object'}, all_columns=True),
+    'stop_times': TableSchema({'trip_id': 'object', 'arrival_time': 'object', 'departure_time': 'object', 'stop_sequence': 'int32', 'stop_id': 'object'},
+                              engine='pyarrow'),
+}
+
+# the columns of the binary snapshot
+filtered_schema = {
+    'calendar': TableSchema({'service_id': 'category', 'monday': 'int8', 'tuesday': 'int8', 'wednesday': 'int8', 'thursday': 'int8',
+                             'friday': 'int8', 'saturday': 'int8', 'sunday': 'int8', 'start_date': 'int32', 'end_date': 'int32'}),
+    'routes': TableSchema({'route_id': 'category', 'route_short_name': 'category', 'route_desc': 'object', 'route_color': 'category'}),
+    'trips': TableSchema({'route_id': 'category', 'trip_id': 'category', 'service_id': 'category', 'trip_short_name': 'object',
+                          'start_seconds': 'int32', 'end_seconds': 'int32'}, engine='pyarrow'),
+    'stops': TableSchema({'stop_id': 'category', 'stop_name': 'object', 'platform_code': 'object'}),
+    'stop_times': TableSchema({'trip_id': 'category', 'stop_sequence': 'int32', 'stop_id': 'category',
+                               'arrival_seconds': 'int32', 'departure_seconds': 'int32'}, engine='pyarrow'),
+    'service_day_trips': TableSchema({'service_date': 'int32', 'trip_id': 'category', 'start_seconds': 'int32', 'end_seconds': 'int32'},
+                                     engine='pyarrow'),
+}
+
+
+def getCsvHeader(csv_path):
+    with open(csv_path, encoding='utf-8-sig') as csv_file:
+        return pd.read_csv(csv_file, nrows=0).columns.tolist()
+
+
+def toArrowType(dtype):
+    import pyarrow as pa
+
+    if dtype == 'object':
+        return pa.string()
+    if dtype == 'category':
+        return pa.dictionary(pa.int32(), pa.string())
+    return pa.from_numpy_dtype(np.dtype(dtype))
+
+
+def readCsvWithArrow(csv_path, columns, all_columns):
+    import pyarrow.csv as pa_csv
+
+    convert_options = pa_csv.ConvertOptions(column_types={column: toArrowType(dtype) for column, dtype in columns.items()},
+                                            include_columns=None if all_columns else list(columns),
+                                            # empty values are NaN, like with pandas
+                                            strings_can_be_null=True)
+    return pa_csv.read_csv(csv_path, convert_options=convert_options).to_pandas(split_blocks=True)
+
+
+# extra_columns: column -> dtype of columns that are not in the schema, e.g. for older feeds
+def readGtfsCsv(csv_path, table_schema, extra_columns=None):
+    columns = table_schema.getColumns(getCsvHeader(csv_path))
+    columns.update(extra_columns or {})
+
+    if table_schema.engine == 'pyarrow':
+        try:
+            return readCsvWithArrow(csv_path, columns, table_schema.all_columns)
+        except ImportError:
+            pass
+
+    return pd.read_csv(csv_path, usecols=None if table_schema.all_columns else list(columns), dtype=columns)
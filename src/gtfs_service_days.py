@@ -0,0 +1,126 @@
+# # Service days
+# A trip only runs on the service dates of its service_id:
+# - calendar.txt: every weekday marked with 1 between start_date and end_date (inclusive)
+# - calendar_dates.txt: exceptions for single dates, exception_type 1 adds the date to the service, 2 removes it
+#
+# Instead of checking the calendar for every trip on every tick, the preprocessing expands the calendar once into
+# the service_day_trips table: one row per service date of the feed and trip that runs on it, sorted by service date and scheduled start.
+# service_date,trip_id,start_seconds,end_seconds
+# 20241017,22-1-123,17400,20460
+#
+# ServiceDayIndex keeps the start times of every service date as a sorted numpy array,
+# so the trips that started in a time window are found with a binary search instead of scanning all trips.
+
+import datetime
+
+import numpy as np
+import pandas as pd
+
+gtfs_weekdays = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+exception_type_added = 1
+exception_type_removed = 2
+
+
+# yyyymmdd integers -> numpy dates
+def parseGtfsDates(dates) -> np.ndarray:
+    dates = np.asarray(dates, dtype=np.int64)
+    months = ((dates // 10000 - 1970) * 12 + dates // 100 % 100 - 1).astype('datetime64[M]')
+    return months.astype('datetime64[D]') + (dates % 100 - 1)
+
+
+# numpy dates -> yyyymmdd integers
+def formatGtfsDates(dates: np.ndarray) -> np.ndarray:
+    years = dates.astype('datetime64[Y]')
+    months = dates.astype('datetime64[M]')
+    return ((years.astype(np.int64) + 1970) * 10000 + ((months - years).astype(np.int64) + 1) * 100
+            + (dates - months).astype(np.int64) + 1)
+
+
+# all (service_id, service_date) pairs of the feed
+def getServiceDates(calendar, calendar_dates=None) -> pd.DataFrame:
+    service_dates = []
+
+    if calendar is not None and len(calendar) > 0:
+        start_dates = parseGtfsDates(calendar['start_date'])
+        end_dates = parseGtfsDates(calendar['end_date'])
+        dates = np.arange(start_dates.min(), end_dates.max() + 1)
+
+        # 1970-01-01 was a thursday, so monday is 0 like datetime.date.weekday()
+        weekdays = (dates.astype(np.int64) + 3) % 7
+        runs_on_weekday = calendar[gtfs_weekdays].to_numpy(dtype=np.int8) == 1
+
+        # calendar rows x dates
+        is_active = ((start_dates[:, None] <= dates[None, :]) & (dates[None, :] <= end_dates[:, None])
+                     & runs_on_weekday[:, weekdays])
+
+        calendar_rows, date_columns = np.nonzero(is_active)
+        service_dates.append(pd.DataFrame({'service_id': calendar['service_id'].to_numpy()[calendar_rows],
+                                           'service_date': formatGtfsDates(dates[date_columns])}))
+
+    if calendar_dates is not None and len(calendar_dates) > 0:
+        added = calendar_dates.loc[calendar_dates['exception_type'] == exception_type_added]
+        service_dates.append(pd.DataFrame({'service_id': added['service_id'].to_numpy(),
+                                           'service_date': added['date'].astype(int).to_numpy()}))
+
+    if len(service_dates) == 0:
+        return pd.DataFrame({'service_id': [], 'service_date': []})
+
+    service_dates = pd.concat(service_dates, ignore_index=True).drop_duplicates()
+
+    if calendar_dates is not None and len(calendar_dates) > 0:
+        removed = calendar_dates.loc[calendar_dates['exception_type'] == exception_type_removed]
+        removed = pd.MultiIndex.from_arrays([removed['service_id'].to_numpy(), removed['date'].astype(int).to_numpy()])
+        is_removed = pd.MultiIndex.from_frame(service_dates[['service_id', 'service_date']]).isin(removed)
+        service_dates = service_dates.loc[~is_removed]
+
+    return service_dates.reset_index(drop=True)
+
+
+# trips need the start_seconds and end_seconds columns, see preprocess_static.py
+def buildServiceDayTrips(calendar, calendar_dates, trips) -> pd.DataFrame:
+    service_dates = getServiceDates(calendar, calendar_dates)
+
+    service_day_trips = service_dates.merge(trips[['service_id', 'trip_id', 'start_seconds', 'end_seconds']], on='service_id')
+    service_day_trips = service_day_trips.sort_values(by=['service_date', 'start_seconds'], kind='stable')
+
+    return service_day_trips[['service_date', 'trip_id', 'start_seconds', 'end_seconds']].reset_index(drop=True)
+
+
+class ServiceDayIndex(object):
+    # positions refer to the rows of trips, so the index has to be rebuilt whenever trips is filtered
+    def __init__(self, service_day_trips, trips):
+        self.start_seconds_by_date = {}
+        self.positions_by_date = {}
+
+        positions = pd.Index(trips['trip_id'].astype(str)).get_indexer(service_day_trips['trip_id'].astype(str))
+        # trips that are not in trips, e.g. of other lines
+        service_day_trips = service_day_trips.loc[positions >= 0]
+        positions = positions[positions >= 0]
+
+        durations = service_day_trips['end_seconds'] - service_day_trips['start_seconds']
+        # no trip started longer ago than this can still be running
+        self.max_trip_duration_seconds = int(durations.max()) if len(durations) > 0 else 0
+
+        # service_day_trips is sorted by service date and start, so every service date is one contiguous block
+        service_dates = service_day_trips['service_date'].to_numpy()
+        start_seconds = service_day_trips['start_seconds'].to_numpy(dtype=np.int64)
+        block_starts = np.flatnonzero(np.r_[True, service_dates[1:] != service_dates[:-1]])
+        block_ends = np.r_[block_starts[1:], len(service_dates)]
+
+        for block_start, block_end in zip(block_starts, block_ends):
+            yyyymmdd = int(service_dates[block_start])
+            service_date = datetime.date(yyyymmdd // 10000, yyyymmdd // 100 % 100, yyyymmdd % 100)
+            self.start_seconds_by_date[service_date] = start_seconds[block_start:block_end]
+            self.positions_by_date[service_date] = positions[block_start:block_end]
+
+    # positions (in trips) of the trips running on service_date that start between earliest_start_seconds and latest_start_seconds (inclusive)
+    def getTripPositions(self, service_date: datetime.date, earliest_start_seconds, latest_start_seconds) -> np.ndarray:
+        if service_date not in self.start_seconds_by_date:
+            return np.empty(0, dtype=np.int64)
+
+        start_seconds = self.start_seconds_by_date[service_date]
+        first = np.searchsorted(start_seconds, earliest_start_seconds, side='left')
+        last = np.searchsorted(start_seconds, latest_start_seconds, side='right')
+
+        return self.positions_by_date[service_date][first:last]
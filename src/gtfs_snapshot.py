@@ -0,0 +1,64 @@
+# # Binary snapshot of the filtered gtfs feed
+# Besides the csv files, the preprocessing writes the filtered tables as uncompressed Arrow/Feather files to gtfs_filtered/snapshot.
+# The snapshot is typed (see filtered_schema in gtfs_schema.py): trip, route and stop ids are categorical (dictionary encoded) and all times are integer seconds
+# since the start of the service day, so the extraction neither has to parse csv text nor infer types.
+# Uncompressed feather files can be memory mapped and are converted with split_blocks, so numeric columns are not copied into one consolidated block.
+#
+# pyarrow is only needed for the snapshot. Without it, writeSnapshot and readSnapshot return False / None and the csv files are used.
+
+from os import path
+import os
+
+from gtfs_schema import filtered_schema
+
+snapshot_directory_name = 'snapshot'
+
+
+def getSnapshotPath(gtfs_filtered_path):
+    return path.join(gtfs_filtered_path, snapshot_directory_name)
+
+
+def getSnapshotFilePaths(gtfs_filtered_path):
+    snapshot_path = getSnapshotPath(gtfs_filtered_path)
+    return {table_name: path.join(snapshot_path, f'{table_name}.feather') for table_name in filtered_schema}
+
+
+def hasSnapshot(gtfs_filtered_path):
+    return all(path.exists(snapshot_file_path) for snapshot_file_path in getSnapshotFilePaths(gtfs_filtered_path).values())
+
+
+def writeSnapshot(tables, gtfs_filtered_path):
+    try:
+        import pyarrow.feather as feather
+    except ImportError:
+        print('pyarrow is not installed, skipping binary snapshot')
+        return False
+
+    os.makedirs(getSnapshotPath(gtfs_filtered_path), exist_ok=True)
+
+    for table_name, snapshot_file_path in getSnapshotFilePaths(gtfs_filtered_path).items():
+        table = tables[table_name]
+        columns = filtered_schema[table_name].columns
+
+        # optional columns like platform_code may be missing in a feed
+        columns = {column: dtype for column, dtype in columns.items() if column in table.columns}
+        table = table[list(columns)].astype(columns).reset_index(drop=True)
+
+        # uncompressed, so the file can be memory mapped when reading
+        feather.write_feather(table, snapshot_file_path, compression='uncompressed')
+
+    print(f"wrote binary snapshot to {getSnapshotPath(gtfs_filtered_path)}")
+    return True
+
+
+def readSnapshot(gtfs_filtered_path):
+    try:
+        import pyarrow.feather as feather
+    except ImportError:
+        return None
+
+    if not hasSnapshot(gtfs_filtered_path):
+        return None
+
+    return {table_name: feather.read_table(snapshot_file_path, memory_map=True).to_pandas(split_blocks=True)
+            for table_name, snapshot_file_path in getSnapshotFilePaths(gtfs_filtered_path).items()}
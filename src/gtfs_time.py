@@ -0,0 +1,90 @@
+# # GTFS times as integer seconds
+# gtfs times are given as HH:MM:SS relative to the start of the service day, so they can be longer than 24 hours (e.g. 24:15:00).
+# Instead of converting every single time string into a datetime.time (which wraps times after midnight),
+# whole columns are converted into integer seconds since the start of the service day and back.
+# Both directions work on the raw ascii bytes of the column with numpy, so no python object is created per time.
+#
+# gtfs allows stops without arrival_time / departure_time (non-timepoints), missing times (NaN, None, '') are parsed as <NA>,
+# the preprocessing fills them with interpolateMissingSeconds. Anything else that is not H:MM:SS or HH:MM:SS raises a ValueError.
+
+import datetime
+
+import numpy as np
+import pandas as pd
+
+ascii_zero = ord('0')
+ascii_colon = ord(':')
+
+
+# int64 seconds, or Int64 with <NA> for the missing times if there are any
+def parseGtfsTimestringsAsSeconds(timestrings: pd.Series) -> pd.Series:
+    lengths = timestrings.str.len()
+    is_missing = (lengths.isna() | (lengths == 0)).to_numpy()
+    present_timestrings = timestrings[~is_missing] if is_missing.any() else timestrings
+
+    # H:MM:SS is also valid gtfs, pad it to HH:MM:SS so every time has the same byte positions
+    present_lengths = lengths[~is_missing] if is_missing.any() else lengths
+    is_short = present_lengths == 7
+    if is_short.any():
+        present_timestrings = present_timestrings.where(~is_short, present_timestrings.str.zfill(8))
+
+    characters = np.frombuffer(present_timestrings.to_numpy().astype('S8').tobytes(), dtype=np.uint8).reshape(-1, 8)
+    digits = characters[:, [0, 1, 3, 4, 6, 7]].astype(np.int64) - ascii_zero
+    is_invalid = (~present_lengths.isin([7, 8]).to_numpy() | (digits < 0).any(axis=1) | (digits > 9).any(axis=1)
+                  | (characters[:, 2] != ascii_colon) | (characters[:, 5] != ascii_colon))
+    if is_invalid.any():
+        raise ValueError(f"{is_invalid.sum()} invalid gtfs times in {timestrings.name}, e.g. {present_timestrings[is_invalid].iloc[0]!r}")
+
+    seconds = (digits[:, 0] * 10 + digits[:, 1]) * 3600 + (digits[:, 2] * 10 + digits[:, 3]) * 60 + digits[:, 4] * 10 + digits[:, 5]
+    if not is_missing.any():
+        return pd.Series(seconds, index=timestrings.index)
+
+    seconds_with_missing = pd.Series(pd.NA, index=timestrings.index, dtype='Int64')
+    seconds_with_missing[~is_missing] = seconds
+    return seconds_with_missing
+
+
+# <NA> seconds of stops without times are interpolated linearly by stop between the previous and the next stop of the trip with a time,
+# seconds must be ordered by trip and stop_sequence. Stops before the first or after the last time of a trip get that time,
+# trips without any time stay <NA>.
+def interpolateMissingSeconds(trip_ids, seconds: pd.Series) -> pd.Series:
+    positions = pd.Series(np.arange(len(seconds), dtype=np.float64), index=seconds.index)
+    known_positions = positions.where(seconds.notna())
+    values = seconds.astype('float64')
+
+    previous_positions = known_positions.groupby(trip_ids, sort=False).ffill()
+    next_positions = known_positions.groupby(trip_ids, sort=False).bfill()
+    previous_values = values.groupby(trip_ids, sort=False).ffill()
+    next_values = values.groupby(trip_ids, sort=False).bfill()
+
+    distance = (next_positions - previous_positions).replace(0, 1)
+    interpolated = previous_values + (next_values - previous_values) * (positions - previous_positions) / distance
+    interpolated = interpolated.fillna(previous_values).fillna(next_values)
+
+    return interpolated.round().astype('Int64')
+
+
+def formatSecondsAsGtfsTimestrings(seconds: pd.Series) -> pd.Series:
+    seconds_array = np.asarray(seconds, dtype=np.int64)
+    hours = seconds_array // 3600
+    minutes = seconds_array % 3600 // 60
+    remaining_seconds = seconds_array % 60
+
+    characters = np.empty((len(seconds_array), 8), dtype=np.uint8)
+    characters[:, 0] = hours // 10 + ascii_zero
+    characters[:, 1] = hours % 10 + ascii_zero
+    characters[:, 2] = ascii_colon
+    characters[:, 3] = minutes // 10 + ascii_zero
+    characters[:, 4] = minutes % 10 + ascii_zero
+    characters[:, 5] = ascii_colon
+    characters[:, 6] = remaining_seconds // 10 + ascii_zero
+    characters[:, 7] = remaining_seconds % 10 + ascii_zero
+
+    return pd.Series(characters.view('S8').ravel(), index=getattr(seconds, 'index', None)).str.decode('ascii')
+
+
+# seconds between the start (midnight) of the service day and current_datetime
+# for yesterday's service date, this is larger than 86400
+def getServiceDaySeconds(current_datetime: datetime.datetime, service_date: datetime.date) -> int:
+    service_day_start = datetime.datetime.combine(service_date, datetime.time())
+    return int((current_datetime.replace(tzinfo=None) - service_day_start).total_seconds())
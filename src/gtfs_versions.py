@@ -0,0 +1,160 @@
+# # Versions of the filtered gtfs feed
+# Every run of preprocess_static.py builds the filtered feed of one gtfs version into its own directory gtfs_versions/<version key>-<build id>,
+# gtfs_filtered is a symlink to the active version. The version key combines the directory and the modified time of the gtfs version in the api
+# and the relevant lines, so the preprocessing can skip the download and the filtering if the active version was built from the same input,
+# but a feed uploaded again to the same directory is downloaded again.
+# A manifest.json in every version directory records what produced it: gtfs version, url, sha256 of the zip, relevant lines and format version.
+# If a new gtfs version has the same zip content as a stored version (e.g. the same feed uploaded again), the stored version is used.
+#
+# A version is built in a temp directory and renamed to a directory name that was never used before when it is complete,
+# then the symlink is replaced with os.replace, so the extraction always reads a complete feed, either the old or the new one.
+# A version that is built again (e.g. for a new format version) gets a new directory, the old one is deleted after the switch.
+# The last kept_versions versions are kept, older ones are deleted, so switching back to a previous version (rollback) needs no download.
+#
+# A gtfs_filtered directory of an older preprocessing is moved into gtfs_versions the first time, as version legacy-<mtime>.
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+from os import path
+
+versions_directory_name = 'gtfs_versions'
+manifest_file_name = 'manifest.json'
+default_kept_versions = 3
+
+# bump when the preprocessing writes different files or columns, so existing versions are built again
+preprocessing_format_version = 1
+
+
+def getVersionKey(gtfs_dir, gtfs_modified, relevant_lines):
+    lines_hash = hashlib.sha256(','.join(sorted(relevant_lines)).encode()).hexdigest()[:8]
+    # the directory name of the api is used in a file name
+    return f"{re.sub(r'[^A-Za-z0-9_.-]', '_', str(gtfs_dir))}-{gtfs_modified}-lines-{lines_hash}"
+
+
+class GtfsVersionStore(object):
+    def __init__(self, gtfs_filtered_path, kept_versions=default_kept_versions):
+        self.gtfs_filtered_path = path.abspath(gtfs_filtered_path)
+        self.versions_path = path.join(path.dirname(self.gtfs_filtered_path), versions_directory_name)
+        self.kept_versions = kept_versions
+
+    def getVersionPath(self, version_dir):
+        return path.join(self.versions_path, version_dir)
+
+    # the manifest with the directory name of the version as 'dir', or None
+    def readManifest(self, version_dir):
+        try:
+            with open(path.join(self.getVersionPath(version_dir), manifest_file_name)) as manifest_file:
+                manifest = json.load(manifest_file)
+        except (OSError, ValueError):
+            return None
+        manifest['dir'] = version_dir
+        return manifest
+
+    # manifests of all stored versions, oldest first
+    def getVersions(self):
+        if not path.isdir(self.versions_path):
+            return []
+
+        manifests = [self.readManifest(version_dir) for version_dir in os.listdir(self.versions_path) if not version_dir.startswith('.')]
+        return sorted([manifest for manifest in manifests if manifest is not None], key=lambda manifest: manifest['created_at'])
+
+    # directory name of the version gtfs_filtered points to
+    def getActiveVersionDir(self):
+        if not path.islink(self.gtfs_filtered_path):
+            return None
+        return path.basename(os.readlink(self.gtfs_filtered_path))
+
+    # a stored version that was built from the same input with the current preprocessing, or None
+    def findVersion(self, relevant_lines, version_key=None, zip_sha256=None):
+        for manifest in reversed(self.getVersions()):
+            if manifest['format_version'] != preprocessing_format_version or sorted(manifest['relevant_lines']) != sorted(relevant_lines):
+                continue
+            if version_key is not None and manifest['key'] == version_key:
+                return manifest
+            if zip_sha256 is not None and manifest['zip_sha256'] == zip_sha256:
+                return manifest
+        return None
+
+    # empty temp directory to build a version in, see publishVersion
+    def createBuildPath(self, version_key):
+        build_path = self.getVersionPath(f'.{version_key}.tmp')
+        # left over from an interrupted run
+        shutil.rmtree(build_path, ignore_errors=True)
+        os.makedirs(build_path)
+        return build_path
+
+    def publishVersion(self, build_path, version_key, gtfs_dir, gtfs_modified, gtfs_url, zip_sha256, relevant_lines):
+        created_at = time.time()
+        manifest = {'key': version_key, 'gtfs_dir': gtfs_dir, 'gtfs_modified': gtfs_modified, 'gtfs_url': gtfs_url, 'zip_sha256': zip_sha256,
+                    'relevant_lines': list(relevant_lines), 'format_version': preprocessing_format_version, 'created_at': created_at}
+        with open(path.join(build_path, manifest_file_name), 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+
+        # never the directory of an existing version, so the active version is not touched until the symlink points to the new one
+        version_dir = f"{version_key}-{time.strftime('%Y%m%dT%H%M%S', time.localtime(created_at))}"
+        while path.exists(self.getVersionPath(version_dir)):
+            version_dir += '_'
+        os.rename(build_path, self.getVersionPath(version_dir))
+        self.activateVersion(version_dir)
+
+        # built again, e.g. for a new format version: the directories of the old builds are not needed anymore
+        for old_manifest in self.getVersions():
+            if old_manifest['key'] == version_key and old_manifest['dir'] != version_dir:
+                shutil.rmtree(self.getVersionPath(old_manifest['dir']))
+                print(f"deleted the replaced build {old_manifest['dir']}")
+
+        print(f"published gtfs version {version_key} as {version_dir}")
+        return {**manifest, 'dir': version_dir}
+
+    def activateVersion(self, version_dir):
+        self.migrateLegacyDirectory()
+
+        # relative, so the directory can be moved together with gtfs_versions
+        temp_link_path = self.gtfs_filtered_path + '.tmp'
+        if path.lexists(temp_link_path):
+            os.unlink(temp_link_path)
+        os.symlink(path.join(versions_directory_name, version_dir), temp_link_path)
+        os.replace(temp_link_path, self.gtfs_filtered_path)
+        print(f"gtfs_filtered now points to {version_dir}")
+
+    # the previous version, e.g. if the new feed is broken
+    def rollback(self):
+        version_dirs = [manifest['dir'] for manifest in self.getVersions()]
+        active_version_dir = self.getActiveVersionDir()
+        if active_version_dir not in version_dirs or version_dirs.index(active_version_dir) == 0:
+            raise Exception(f"no version before {active_version_dir} in {self.versions_path}")
+
+        previous_version_dir = version_dirs[version_dirs.index(active_version_dir) - 1]
+        self.activateVersion(previous_version_dir)
+        return previous_version_dir
+
+    # deletes the oldest versions, the active version is always kept
+    def pruneVersions(self):
+        active_version_dir = self.getActiveVersionDir()
+        versions = self.getVersions()
+        for manifest in versions[:max(len(versions) - self.kept_versions, 0)]:
+            if manifest['dir'] == active_version_dir:
+                continue
+            shutil.rmtree(self.getVersionPath(manifest['dir']))
+            print(f"deleted gtfs version {manifest['dir']}")
+
+    # moves a gtfs_filtered directory of an older preprocessing into the store, so it can be replaced by a symlink
+    def migrateLegacyDirectory(self):
+        if not path.isdir(self.gtfs_filtered_path) or path.islink(self.gtfs_filtered_path):
+            return
+
+        created_at = path.getmtime(self.gtfs_filtered_path)
+        version_key = f'legacy-{int(created_at)}'
+        os.makedirs(self.versions_path, exist_ok=True)
+        os.rename(self.gtfs_filtered_path, self.getVersionPath(version_key))
+
+        # never matches a new input, but can be rolled back to
+        manifest = {'key': version_key, 'gtfs_dir': None, 'gtfs_modified': None, 'gtfs_url': None, 'zip_sha256': None,
+                    'relevant_lines': [], 'format_version': None, 'created_at': created_at}
+        with open(path.join(self.getVersionPath(version_key), manifest_file_name), 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+        print(f"moved {self.gtfs_filtered_path} to {self.getVersionPath(version_key)}")
@@ -0,0 +1,59 @@
+# # HTTP client
+# Shared http layer for the static gtfs downloads and the realtime api.
+# A single requests.Session keeps the TLS connections to the api alive between requests (connection pooling),
+# negotiates gzip compressed responses and retries on temporary server errors.
+# ConditionalGet remembers the ETag / Last-Modified validators of every url and sends them with the next request,
+# so the server can answer with 304 Not Modified instead of sending the same feed again.
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+default_timeout_seconds = 30
+
+
+def createSession(pool_maxsize=4, retries=2):
+    session = requests.Session()
+
+    retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=[502, 503, 504], allowed_methods=['GET'])
+    adapter = HTTPAdapter(pool_connections=pool_maxsize, pool_maxsize=pool_maxsize, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+
+    return session
+
+
+class ConditionalGet(object):
+    def __init__(self, session):
+        self.session = session
+        # url -> {'etag': ..., 'last_modified': ...}
+        self.validators = {}
+
+    def get(self, url, headers=None, **kwargs):
+        request_headers = dict(headers or {})
+
+        validators = self.validators.get(url, {})
+        if 'etag' in validators:
+            request_headers['If-None-Match'] = validators['etag']
+        if 'last_modified' in validators:
+            request_headers['If-Modified-Since'] = validators['last_modified']
+
+        kwargs.setdefault('timeout', default_timeout_seconds)
+        response = self.session.get(url, headers=request_headers, **kwargs)
+
+        # only remember validators of complete responses, a 304 keeps the old ones
+        if response.status_code == 200:
+            validators = {}
+            if 'ETag' in response.headers:
+                validators['etag'] = response.headers['ETag']
+            if 'Last-Modified' in response.headers:
+                validators['last_modified'] = response.headers['Last-Modified']
+            self.validators[url] = validators
+
+        return response
+
+    # forget the validators, e.g. when the cached content was lost
+    def reset(self, url):
+        self.validators.pop(url, None)
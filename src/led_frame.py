@@ -0,0 +1,111 @@
+# # LED frame
+# A frame holds the colors of all leds of the matrix as a (height, width, 3) uint8 rgb array, row y and column x like the panel.
+# Pixels can also be addressed by their flat index y * width + x, which is how the compiled led mapping stores them (see led_mapping.py).
+# All operations work on whole arrays, so drawing a frame doesn't create a hex string per led.
+#
+# The size of the frame follows the panel configuration of matrixbase.py: --led-cols x --led-rows per panel,
+# --led-chain panels next to each other and --led-parallel chains below each other, e.g. 2 chained 64x32 panels are a 128x32 frame.
+#
+# Leds with several vehicles switch between their colors. The extractor renders one frame per color phase,
+# the display process shows the phase frames one after another (see display-csv.py), at most max_frame_phases.
+#
+# On disk the phase frames are stored as a frame file: a 20 byte header (magic "RNVM", format version, width, height (uint16), using realtime,
+# number of phases (uint8), written at (float64, unix time)) followed by the raw rgb pixels of every phase, e.g. 6 KB per phase for a 64x32 frame.
+# It is written to a temp file and renamed, so a reader always gets complete frames.
+
+import os
+import struct
+import time
+
+import numpy as np
+
+panel_width = 64
+panel_height = 32
+
+max_frame_phases = 4
+
+
+def getFrameSize(led_cols=panel_width, led_rows=panel_height, led_chain=1, led_parallel=1):
+    return led_cols * led_chain, led_rows * led_parallel
+
+
+# "FDC300" -> (253, 195, 0)
+def hexToRgb(hex_color):
+    hex_color = hex_color.lstrip('#')
+    return int(hex_color[0:2], 16), int(hex_color[2:4], 16), int(hex_color[4:6], 16)
+
+
+# every value multiplied by factor, e.g. 0.5 for half brightness
+def dimRgb(rgb, factor):
+    return tuple(int(max(0, min(255, value * factor))) for value in rgb)
+
+
+hex_bytes = np.array([f"{value:02X}" for value in range(256)], dtype=object)
+
+
+class LedFrame(object):
+    def __init__(self, pixels):
+        self.pixels = pixels
+
+    @classmethod
+    def empty(cls, width=panel_width, height=panel_height):
+        return cls(np.zeros((height, width, 3), dtype=np.uint8))
+
+    @property
+    def width(self):
+        return self.pixels.shape[1]
+
+    @property
+    def height(self):
+        return self.pixels.shape[0]
+
+    def copy(self):
+        return LedFrame(self.pixels.copy())
+
+    def fill(self, rgb):
+        self.pixels[:] = rgb
+
+    def setPixel(self, x, y, rgb):
+        self.pixels[y, x] = rgb
+
+    # pixel_indices are flat indices y * width + x
+    def setPixels(self, pixel_indices, rgb):
+        self.pixels.reshape(-1, 3)[pixel_indices] = rgb
+
+    # (height, width) hex strings, e.g. for led-matrix.csv
+    def toHex(self):
+        return hex_bytes[self.pixels[..., 0]] + hex_bytes[self.pixels[..., 1]] + hex_bytes[self.pixels[..., 2]]
+
+
+frame_file_magic = b'RNVM'
+frame_file_version = 2
+frame_file_header_format = '<4sHHHBBd'
+frame_file_header_size = struct.calcsize(frame_file_header_format)
+
+
+def writeFrameFile(frame_path, frames, using_realtime):
+    width, height = frames[0].width, frames[0].height
+    header = struct.pack(frame_file_header_format, frame_file_magic, frame_file_version, width, height, using_realtime, len(frames), time.time())
+
+    temp_path = frame_path + '.tmp'
+    with open(temp_path, 'wb') as frame_file:
+        frame_file.write(header)
+        for frame in frames:
+            frame_file.write(np.ascontiguousarray(frame.pixels).tobytes())
+    os.replace(temp_path, frame_path)
+
+
+# (phase frames, written_at, using_realtime)
+def readFrameFile(frame_path):
+    data = np.fromfile(frame_path, dtype=np.uint8)
+    if len(data) < frame_file_header_size:
+        raise ValueError(f"{frame_path} is not a frame file")
+
+    magic, version, width, height, using_realtime, phases, written_at = struct.unpack_from(frame_file_header_format, data, 0)
+    if magic != frame_file_magic or version != frame_file_version:
+        raise ValueError(f"{frame_path} is not a frame file of version {frame_file_version}")
+    if phases == 0 or len(data) != frame_file_header_size + phases * height * width * 3:
+        raise ValueError(f"{frame_path} has {len(data)} bytes, expected {phases} {width}x{height} frames")
+
+    pixels = data[frame_file_header_size:].reshape(phases, height, width, 3)
+    return [LedFrame(phase_pixels) for phase_pixels in pixels], written_at, bool(using_realtime)
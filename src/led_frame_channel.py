@@ -0,0 +1,247 @@
+# # LED frame channel
+# The extractor hands every new frame to display-csv.py through a memory-mapped file in /dev/shm (shared memory, nothing is written to the sd card).
+# The display process only reads one counter to check for a new frame and copies the pixels directly, there is no csv to write and parse.
+#
+# The file holds two frame slots. The writer always fills the slot of the older frame and then publishes the sequence number of the new frame,
+# so the reader can copy the latest frame while the next one is written. Every slot has a write counter that is odd while the slot is written,
+# the reader retries if the counter was odd or changed during the copy (seqlock), so it never shows a torn frame.
+#
+# header (32 bytes): magic "RNVF", layout version, width, height (uint32), sequence of the latest frame (uint64), reserved
+# slot (32 bytes + max_frame_phases * height * width * 3): write counter, frame sequence (uint64), written at (float64, unix time),
+# using realtime, number of phases (uint8), reserved, rgb pixels of every phase (see led_frame.py)
+#
+# The file is created with mode 644, because the display process drops its root privileges after initializing the matrix.
+#
+# After a frame is published, the writer also writes a byte into the named pipe <channel path>.notify, so the display process can block in
+# FrameChannelReader.wait until a new frame arrives instead of polling. The pipe is opened non-blocking on both sides:
+# the writer skips the notification if no display process is listening, the reader also opens it for writing, so it never sees end of file
+# when the extractor restarts. Without the pipe (or if a notification is lost) wait returns after the timeout, so the reader falls back to polling.
+
+import errno
+import mmap
+import os
+import select
+import struct
+import time
+
+import numpy as np
+
+from led_frame import LedFrame, max_frame_phases
+
+channel_magic = b'RNVF'
+channel_version = 2
+
+header_format = '<4sIIIQ'
+header_size = 32
+sequence_offset = 16
+slot_header_format = '<QQdBB'
+# slot header without the write counter
+slot_fields_format = '<QdBB'
+slot_header_size = 32
+
+
+def getDefaultChannelPath():
+    if os.path.isdir('/dev/shm'):
+        return '/dev/shm/rnv-train-monitor-led-frame'
+    return os.path.join(os.getcwd(), '.led-frame.shm')
+
+
+def getSlotSize(width, height):
+    return slot_header_size + max_frame_phases * height * width * 3
+
+
+def getChannelSize(width, height):
+    return header_size + 2 * getSlotSize(width, height)
+
+
+def getNotifyPath(channel_path):
+    return channel_path + '.notify'
+
+
+def openNotifyPipe(notify_path, flags):
+    try:
+        os.mkfifo(notify_path)
+        # the extractor runs as root, the display process without privileges
+        os.chmod(notify_path, 0o666)
+    except FileExistsError:
+        pass
+    return os.open(notify_path, flags | os.O_NONBLOCK)
+
+
+class FrameChannelWriter(object):
+    def __init__(self, width, height, channel_path=None):
+        self.channel_path = channel_path or getDefaultChannelPath()
+        self.width = width
+        self.height = height
+        self.slot_size = getSlotSize(width, height)
+        self.notify_fd = None
+
+        self.buffer = self.open()
+        magic, version, channel_width, channel_height, sequence = struct.unpack_from(header_format, self.buffer, 0)
+        # continue the sequence of a previous run, so a running display process picks up the first frame
+        self.sequence = sequence if (magic, version, channel_width, channel_height) == (channel_magic, channel_version, width, height) else 0
+        struct.pack_into(header_format, self.buffer, 0, channel_magic, channel_version, width, height, self.sequence)
+
+    def open(self):
+        channel_size = getChannelSize(self.width, self.height)
+
+        if os.path.exists(self.channel_path) and os.path.getsize(self.channel_path) != channel_size:
+            # written for another panel size: invalidate it for readers that still map it and start a new file,
+            # resizing it in place would crash readers that access the truncated part
+            with open(self.channel_path, 'r+b') as channel_file:
+                channel_file.write(b'\0' * len(channel_magic))
+            os.unlink(self.channel_path)
+
+        fd = os.open(self.channel_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != channel_size:
+                os.ftruncate(fd, channel_size)
+            return mmap.mmap(fd, channel_size)
+        finally:
+            os.close(fd)
+
+    def getPixels(self, slot, phases):
+        offset = header_size + slot * self.slot_size + slot_header_size
+        return np.frombuffer(self.buffer, dtype=np.uint8, count=phases * self.height * self.width * 3, offset=offset).reshape(phases, self.height, self.width, 3)
+
+    # frames: the phase frames, see led_frame.py
+    def write(self, frames, using_realtime):
+        if any((frame.width, frame.height) != (self.width, self.height) for frame in frames):
+            raise ValueError(f"frames are {frames[0].width}x{frames[0].height}, frame channel is {self.width}x{self.height}")
+        if not 0 < len(frames) <= max_frame_phases:
+            raise ValueError(f"{len(frames)} phase frames, frame channel has room for 1 to {max_frame_phases}")
+
+        sequence = self.sequence + 1
+        slot = sequence % 2
+        slot_offset = header_size + slot * self.slot_size
+
+        # odd while the slot is written, also if a previous writer crashed in the middle of a write
+        write_counter = struct.unpack_from('<Q', self.buffer, slot_offset)[0] | 1
+        struct.pack_into('<Q', self.buffer, slot_offset, write_counter)
+        struct.pack_into(slot_fields_format, self.buffer, slot_offset + 8, sequence, time.time(), using_realtime, len(frames))
+        pixels = self.getPixels(slot, len(frames))
+        for phase, frame in enumerate(frames):
+            pixels[phase] = frame.pixels
+        struct.pack_into('<Q', self.buffer, slot_offset, write_counter + 1)
+
+        # publish
+        struct.pack_into('<Q', self.buffer, sequence_offset, sequence)
+        self.sequence = sequence
+        self.notify()
+
+    def notify(self):
+        try:
+            if self.notify_fd is None:
+                self.notify_fd = openNotifyPipe(getNotifyPath(self.channel_path), os.O_WRONLY)
+            os.write(self.notify_fd, b'\0')
+        except BlockingIOError:
+            # the pipe is full, the reader has not yet read the previous notifications
+            pass
+        except OSError as e:
+            # ENXIO: no display process is listening, EPIPE: it stopped listening
+            if e.errno not in (errno.ENXIO, errno.EPIPE):
+                print(e)
+            if self.notify_fd is not None:
+                os.close(self.notify_fd)
+            self.notify_fd = None
+
+
+class FrameChannelReader(object):
+    def __init__(self, channel_path=None, retries=10):
+        self.channel_path = channel_path or getDefaultChannelPath()
+        self.retries = retries
+        self.buffer = None
+        self.width = None
+        self.height = None
+        self.last_sequence = None
+        self.notify_fd = None
+
+    def isOpen(self):
+        return self.buffer is not None
+
+    # False if there is no frame channel (yet), e.g. the extractor is not running
+    def open(self):
+        try:
+            fd = os.open(self.channel_path, os.O_RDONLY)
+        except FileNotFoundError:
+            return False
+
+        try:
+            channel_size = os.fstat(fd).st_size
+            if channel_size < header_size:
+                return False
+            buffer = mmap.mmap(fd, channel_size, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+
+        magic, version, width, height, _ = struct.unpack_from(header_format, buffer, 0)
+        if magic != channel_magic or version != channel_version or channel_size != getChannelSize(width, height):
+            buffer.close()
+            return False
+
+        self.buffer = buffer
+        self.width = width
+        self.height = height
+        self.last_sequence = None
+        return True
+
+    def close(self):
+        if self.buffer is not None:
+            self.buffer.close()
+        self.buffer = None
+
+    # blocks until the writer notifies about a new frame or timeout seconds passed, True if notified
+    def wait(self, timeout):
+        if self.notify_fd is None:
+            try:
+                # read and write, so the pipe doesn't signal end of file while no extractor has it open
+                self.notify_fd = openNotifyPipe(getNotifyPath(self.channel_path), os.O_RDWR)
+            except OSError as e:
+                print(e)
+                time.sleep(timeout)
+                return False
+
+        readable, _, _ = select.select([self.notify_fd], [], [], timeout)
+        if len(readable) == 0:
+            return False
+
+        # several frames may have been written since the last wait, only the latest one is read
+        try:
+            os.read(self.notify_fd, 4096)
+        except BlockingIOError:
+            pass
+        return True
+
+    # (phase frames, written_at, using_realtime) of a frame that is newer than the last one read, otherwise None
+    def read(self):
+        if self.buffer is None and not self.open():
+            return None
+
+        if self.buffer[0:len(channel_magic)] != channel_magic:
+            # the writer replaced the file, e.g. for another panel size
+            self.close()
+            return None
+
+        for _ in range(self.retries):
+            sequence = struct.unpack_from('<Q', self.buffer, sequence_offset)[0]
+            if sequence == 0 or sequence == self.last_sequence:
+                return None
+
+            slot_offset = header_size + (sequence % 2) * getSlotSize(self.width, self.height)
+            write_counter, frame_sequence, written_at, using_realtime, phases = struct.unpack_from(slot_header_format, self.buffer, slot_offset)
+            if write_counter % 2 == 1:
+                # the writer is already writing the next frame into this slot
+                time.sleep(0.001)
+                continue
+
+            phases = min(max(phases, 1), max_frame_phases)
+            pixels = np.frombuffer(self.buffer, dtype=np.uint8, count=phases * self.height * self.width * 3,
+                                   offset=slot_offset + slot_header_size).reshape(phases, self.height, self.width, 3).copy()
+
+            if struct.unpack_from('<Q', self.buffer, slot_offset)[0] != write_counter:
+                continue
+
+            self.last_sequence = frame_sequence
+            return [LedFrame(phase_pixels) for phase_pixels in pixels], written_at, bool(using_realtime)
+
+        return None
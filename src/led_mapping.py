@@ -0,0 +1,221 @@
+# # Compiled statuscode led mapping
+# statuscode_led_mapping.csv maps every statuscode to the leds it lights, as "x-y&x-y" strings (see extract_active_vehicles.py, 8.).
+# Instead of filtering the mapping and parsing these strings for every vehicle on every tick, the mapping is compiled once into
+# statuscode -> flat pixel indices (y * width + x) as numpy arrays, which both extract_active_vehicles.py and display-csv.py use.
+#
+# The compiled mapping is cached next to the csv file and reused as long as the csv file has the same mtime or content hash.
+# Problems of the mapping are printed when it is compiled:
+# - a statuscode that is listed twice for the same line, or with different leds for different lines (the first row is used)
+# - leds that are not in the form x-y or outside of the matrix (they are skipped)
+# The extraction additionally reports statuscodes that never occur in the gtfs feed, see getUnknownStatuscodes.
+
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from led_frame import LedFrame, panel_width, panel_height
+
+# bump when the layout of the cache file changes
+compiled_mapping_version = 1
+
+
+def getCompiledMappingPath(mapping_path):
+    mapping_directory, mapping_file_name = os.path.split(mapping_path)
+    return os.path.join(mapping_directory, f'.{os.path.splitext(mapping_file_name)[0]}.npz')
+
+
+def getFileHash(file_path):
+    with open(file_path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+# lines are numbers, except for special services
+def parseLine(line):
+    line = str(line).strip()
+    return int(line) if line.isdigit() else line
+
+
+# "x-y&x-y" -> flat pixel indices, problems are appended to errors
+def parseLedString(led_string, statuscode, width, height, errors):
+    pixel_indices = []
+    for led_xy in str(led_string).split('&'):
+        try:
+            x, y = (int(coordinate) for coordinate in led_xy.strip().split('-'))
+        except ValueError:
+            errors.append(f"statuscode {statuscode}: invalid led '{led_xy}'")
+            continue
+
+        if not (0 <= x < width and 0 <= y < height):
+            errors.append(f"statuscode {statuscode}: led {x}-{y} is outside of the {width}x{height} matrix")
+            continue
+
+        pixel_indices.append(y * width + x)
+    return pixel_indices
+
+
+class LedMapping(object):
+    def __init__(self, width, height, row_statuscodes, row_lines, row_pixel_indices, errors):
+        self.width = width
+        self.height = height
+        # one entry per row of the csv file, e.g. for the startup animation of display-csv.py
+        self.row_statuscodes = row_statuscodes
+        self.row_lines = row_lines
+        self.row_pixel_indices = row_pixel_indices
+        self.errors = errors
+
+        # the first row of a statuscode is used, like the previous lookup in the mapping dataframe
+        self.pixel_indices_by_statuscode = {}
+        for statuscode, pixel_indices in zip(row_statuscodes, row_pixel_indices):
+            self.pixel_indices_by_statuscode.setdefault(statuscode, pixel_indices)
+
+    def getPixelIndices(self, statuscode):
+        return self.pixel_indices_by_statuscode.get(statuscode)
+
+    # pixels of all statuscodes, e.g. for the route background
+    def getAllPixelIndices(self):
+        if len(self.row_pixel_indices) == 0:
+            return np.empty(0, dtype=np.int32)
+        return np.unique(np.concatenate(self.row_pixel_indices))
+
+    # numbered lines in numeric order, then special services (str) by name, see parseLine
+    def getLines(self):
+        return sorted(set(self.row_lines), key=lambda line: (isinstance(line, str), line))
+
+    def getPixelIndicesOfLine(self, line):
+        pixel_indices = [row_pixel_indices for row_line, row_pixel_indices in zip(self.row_lines, self.row_pixel_indices) if row_line == line]
+        if len(pixel_indices) == 0:
+            return np.empty(0, dtype=np.int32)
+        return np.unique(np.concatenate(pixel_indices))
+
+    def getStatuscodes(self):
+        return set(self.pixel_indices_by_statuscode)
+
+    # frame with the pixels of all statuscodes set to rgb, e.g. the route background
+    def renderBackgroundFrame(self, rgb):
+        frame = LedFrame.empty(self.width, self.height)
+        frame.setPixels(self.getAllPixelIndices(), rgb)
+        return frame
+
+
+def compileLedMapping(mapping_path, width=panel_width, height=panel_height):
+    mapping = pd.read_csv(mapping_path, sep=';', dtype={'statuscode': str, 'leds': str, 'line': str})
+    mapping = mapping.dropna(subset=['statuscode'])
+
+    errors = []
+    row_statuscodes = []
+    row_lines = []
+    row_pixel_indices = []
+    leds_by_statuscode = {}
+    lines_by_statuscode = {}
+
+    for statuscode, led_string, line in zip(mapping['statuscode'].str.strip(), mapping['leds'], mapping['line'].map(parseLine)):
+        if pd.isna(led_string):
+            errors.append(f"statuscode {statuscode}: no leds")
+            continue
+
+        # a statuscode can be part of several lines, but always lights the same leds
+        if statuscode in leds_by_statuscode:
+            if line in lines_by_statuscode[statuscode]:
+                errors.append(f"statuscode {statuscode}: listed twice for line {line}")
+            if led_string != leds_by_statuscode[statuscode]:
+                errors.append(f"statuscode {statuscode}: leds {led_string} differ from {leds_by_statuscode[statuscode]} of an earlier row, using the earlier row")
+        leds_by_statuscode.setdefault(statuscode, led_string)
+        lines_by_statuscode.setdefault(statuscode, set()).add(line)
+
+        row_statuscodes.append(statuscode)
+        row_lines.append(line)
+        row_pixel_indices.append(np.array(parseLedString(led_string, statuscode, width, height, errors), dtype=np.int32))
+
+    for error in errors:
+        print(f"led mapping: {error}")
+    print(f"compiled {len(row_statuscodes)} rows of {mapping_path} with {len(errors)} errors")
+
+    return LedMapping(width, height, row_statuscodes, row_lines, row_pixel_indices, errors)
+
+
+def writeCompiledLedMapping(led_mapping, compiled_mapping_path, source_mtime, source_hash):
+    row_lengths = np.array([len(pixel_indices) for pixel_indices in led_mapping.row_pixel_indices], dtype=np.int64)
+    pixel_indices = np.concatenate(led_mapping.row_pixel_indices) if len(row_lengths) > 0 else np.empty(0, dtype=np.int32)
+
+    # written to a temp file and renamed, both scripts may compile the mapping at the same time
+    temp_path = compiled_mapping_path + '.tmp'
+    with open(temp_path, 'wb') as compiled_mapping_file:
+        np.savez(compiled_mapping_file,
+                 version=compiled_mapping_version, width=led_mapping.width, height=led_mapping.height,
+                 source_mtime=source_mtime, source_hash=source_hash,
+                 row_statuscodes=np.array(led_mapping.row_statuscodes, dtype=str),
+                 row_lines=np.array(led_mapping.row_lines, dtype=str),
+                 row_lengths=row_lengths, pixel_indices=pixel_indices,
+                 errors=np.array(led_mapping.errors, dtype=str))
+    os.replace(temp_path, compiled_mapping_path)
+
+
+# the cached mapping, or None if it is missing, outdated or for another matrix size
+def readCompiledLedMapping(compiled_mapping_path, mapping_path, width, height):
+    if not os.path.exists(compiled_mapping_path):
+        return None
+
+    try:
+        with np.load(compiled_mapping_path) as compiled_mapping:
+            if (int(compiled_mapping['version']) != compiled_mapping_version
+                    or int(compiled_mapping['width']) != width or int(compiled_mapping['height']) != height):
+                return None
+
+            # the hash is only computed if the mtime changed, e.g. after a git checkout of the same file
+            if float(compiled_mapping['source_mtime']) != os.path.getmtime(mapping_path) \
+                    and str(compiled_mapping['source_hash']) != getFileHash(mapping_path):
+                return None
+
+            row_pixel_indices = np.split(compiled_mapping['pixel_indices'], np.cumsum(compiled_mapping['row_lengths'])[:-1])
+            return LedMapping(width, height, [str(statuscode) for statuscode in compiled_mapping['row_statuscodes']],
+                              [parseLine(line) for line in compiled_mapping['row_lines']], row_pixel_indices, [str(error) for error in compiled_mapping['errors']])
+    except (OSError, KeyError, ValueError) as e:
+        print(e)
+        return None
+
+
+def loadLedMapping(mapping_path, width=panel_width, height=panel_height):
+    compiled_mapping_path = getCompiledMappingPath(mapping_path)
+
+    led_mapping = readCompiledLedMapping(compiled_mapping_path, mapping_path, width, height)
+    if led_mapping is not None:
+        print(f"using compiled led mapping {compiled_mapping_path}")
+        return led_mapping
+
+    source_mtime = os.path.getmtime(mapping_path)
+    led_mapping = compileLedMapping(mapping_path, width, height)
+    try:
+        writeCompiledLedMapping(led_mapping, compiled_mapping_path, source_mtime, getFileHash(mapping_path))
+    except OSError as e:
+        # e.g. read only directory, the mapping is compiled again next time
+        print(e)
+
+    return led_mapping
+
+
+# all statuscodes and trail statuscodes the extraction can produce for the stop_times of a feed (see extract_active_vehicles.py, 7.)
+def getFeedStatuscodes(stop_times):
+    stop_times = stop_times.sort_values(by=['trip_id', 'stop_sequence'], kind='stable')
+    trip_ids = stop_times['trip_id'].astype(str)
+    stop_ids = stop_times['stop_id'].astype(str)
+
+    def shiftWithinTrip(periods):
+        shifted_stop_ids = stop_ids.shift(periods)
+        return shifted_stop_ids.where(trip_ids.shift(periods) == trip_ids, 'DEPOT')
+
+    previous_stop_ids = shiftWithinTrip(1)
+    second_previous_stop_ids = shiftWithinTrip(2)
+    next_stop_ids = shiftWithinTrip(-1)
+
+    # stopped at: previous_current_next, trail previous_current
+    # in transit to: previous_next, trail secondprevious_previous_next
+    return (set(previous_stop_ids + '_' + stop_ids + '_' + next_stop_ids)
+            | set(previous_stop_ids + '_' + stop_ids)
+            | set(second_previous_stop_ids + '_' + previous_stop_ids + '_' + stop_ids))
+
+
+# statuscodes of the mapping that never occur in the feed, e.g. typos in stop ids or stops that are no longer served
+def getUnknownStatuscodes(led_mapping, stop_times):
+    return sorted(led_mapping.getStatuscodes() - getFeedStatuscodes(stop_times))
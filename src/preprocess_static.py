@@ -6,7 +6,8 @@
 # 2. fetch second latest static gtfs zips
 # 4. select relevant routes, trips and stop_times
 # 5. add start and end times for trips
-# 6. save filtered data to filesystem
+# 6. expand the calendar into the trips of every service day
+# 7. save filtered data to filesystem
 
 # Download latest rnv-gtfs data, unzip and read the data from the files:
 
@@ -17,43 +18,45 @@
 
 import datetime
 
-def parseGtfsTimestringAsTimeObject(timestring:str):
-    # mod 24, because gtfs defines days as service days that can be longer than 24 hours, so 24:15 is a valid gtfs time
-    hour = int(timestring[0:2]) % 24
-    minute = int(timestring[3:5])
-    second = int(timestring[6:8])
-    #print(timestring)
-    #print(hour)
-    #print(minute) 
-    #print(second)
-    return datetime.time(hour, minute, second)
-
 def parseGtfsDatestringAsDateObject(datestring:str):
     year = int(datestring[0:4])
     month = int(datestring[4:6])
     day = int(datestring[6:8])
     return datetime.date(year, month, day)
 
-def addSecondsToTimeObject(time:datetime.time, seconds) -> datetime.time:
-    datetime_object = datetime.datetime(100,1,1,time.hour, time.minute, time.second)
-    delta = datetime.timedelta(seconds=seconds)
-    return (datetime_object + delta).time()
+# gtfs times are converted column-wise into integer seconds since the start of the service day, see gtfs_time.py
+from gtfs_time import parseGtfsTimestringsAsSeconds, formatSecondsAsGtfsTimestrings, interpolateMissingSeconds
 
 
 # # 2. fetch second latest gtfs zip
-# 
-# rnv publishes static gtfs on thursdays, with data valid from the following monday for 1-2 weeks. Therefore, we will always use the gtfs published in the previous week, to prevent switching to the latest one too early. 
-# 
+#
+# rnv publishes static gtfs on thursdays, with data valid from the following monday for 1-2 weeks. Therefore, we will always use the gtfs published in the previous week, to prevent switching to the latest one too early.
+#
 # convenience function for downloading and extracting zip:
 
 # In[26]:
 
 
-# convenience function for downloading and extracting zip
-def download_and_extract_zip(url, extract_to='.'):
+from pandas import read_csv, DataFrame, concat
+from os import path, getcwd, getenv
+from dotenv import load_dotenv
+import argparse
+import zipfile, io
+import hashlib
+import json
+from http_client import createSession, default_timeout_seconds
+from gtfs_snapshot import writeSnapshot
+from gtfs_service_days import buildServiceDayTrips
+from gtfs_schema import feed_schema, readGtfsCsv
+from gtfs_versions import GtfsVersionStore, getVersionKey, default_kept_versions
+from gtfs_lines import getRelevantLines, getTripPrefixes
+
+
+# convenience function for downloading and extracting zip, returns the sha256 of the zip
+def download_and_extract_zip(session, url, extract_to='.'):
     # download file
-    response = requests.get(url)
-    response.raise_for_status()  
+    response = session.get(url, timeout=default_timeout_seconds)
+    response.raise_for_status()
 
     # extract in memory
     with zipfile.ZipFile(io.BytesIO(response.content)) as zip_ref:
@@ -61,92 +64,123 @@ def download_and_extract_zip(url, extract_to='.'):
         zip_ref.extractall(extract_to)
         print(f"extracted to '{extract_to}'")
 
+    return hashlib.sha256(response.content).hexdigest()
+
+
+# The full network zip doesn't have to be held in memory: it is streamed to a file in chunks of download_chunk_bytes,
+# written to a temp file and renamed, so an interrupted download never leaves a broken zip behind.
+# The sha256 of the zip is computed from the same chunks, see gtfs_versions.py.
+
+download_chunk_bytes = 1024 * 1024
+
+def download_zip(session, url, zip_path):
+    temp_path = zip_path + '.tmp'
+    zip_hash = hashlib.sha256()
+    with session.get(url, timeout=default_timeout_seconds, stream=True) as response:
+        response.raise_for_status()
+        with open(temp_path, 'wb') as zip_file:
+            for chunk in response.iter_content(chunk_size=download_chunk_bytes):
+                zip_file.write(chunk)
+                zip_hash.update(chunk)
+    os.replace(temp_path, zip_path)
+    print(f"downloaded to '{zip_path}'")
+
+    return zip_hash.hexdigest()
+
 
 # fetch and extract the gtfs zip:
 
 # In[27]:
 
 
-from pandas import read_csv, DataFrame
-from os import path, getcwd, getenv
-from dotenv import load_dotenv
-import requests, zipfile, io
-import json
-
-load_dotenv()
-# get array of definitions for the gtfs versions
+def getGtfsVersion(session, gtfs_base_url):
+    # get array of definitions for the gtfs versions
+    gtfs_version_overview_url = gtfs_base_url
 
-gtfs_base_url = getenv('gtfs_base_url')
-gtfs_version_overview_url = gtfs_base_url
+    response = session.get(gtfs_version_overview_url, timeout=default_timeout_seconds)
 
-response = requests.get(gtfs_version_overview_url)
+    gtfs_versions_dict = json.loads(response.text)
 
-gtfs_versions_dict = json.loads(response.text)
+    # TODO pick correct gtfs by taking the one from last week
 
-# TODO pick correct gtfs by taking the one from last week
+    selected_gtfs_version = None
 
-gtfs_url = ''
+    # search for gtfs of last week, once found, build gtfs_url
+    today = datetime.date.today()
+    days_since_last_sunday = today.weekday() + 1
 
-# search for gtfs of last week, once found, build gtfs_url
-today = datetime.date.today()
-days_since_last_sunday = today.weekday() + 1
+    lastWeekEnd = today - datetime.timedelta(days = days_since_last_sunday)
+    lastWeekStart = lastWeekEnd - datetime.timedelta(days = 6)
 
-lastWeekEnd = today - datetime.timedelta(days = days_since_last_sunday)
-lastWeekStart = lastWeekEnd - datetime.timedelta(days = 6)
+    # newest versions are at the end
+    for i, gtfs_version in enumerate(gtfs_versions_dict[-4:]):
+        modifiedAt = datetime.datetime.fromtimestamp(gtfs_version['modified'] / 1000, datetime.UTC).date()
+        print(modifiedAt)
+        # error in the api
+        # an old gtfs package was reuploaded
+        if gtfs_version['modified'] == 1751033303000:
+            continue
+        if lastWeekStart <= modifiedAt <= lastWeekEnd:
+            selected_gtfs_version = gtfs_version
 
-# newest versions are at the end
-for i, gtfs_version in enumerate(gtfs_versions_dict[-4:]):
-    modifiedAt = datetime.datetime.fromtimestamp(gtfs_version['modified'] / 1000, datetime.UTC).date()  
-    print(modifiedAt)
-    # error in the api
-    # an old gtfs package was reuploaded  
-    if gtfs_version['modified'] == 1751033303000:
-        continue
-    if lastWeekStart <= modifiedAt <= lastWeekEnd:
-        gtfs_url = f"{gtfs_base_url}/{gtfs_version['dir']}/gtfs.zip"
 
+    if selected_gtfs_version is None:
+        raise Exception()
 
-if gtfs_url == '':
-    raise Exception()
+    return selected_gtfs_version
 
-print(gtfs_url)
 
-# fetch data
-download_and_extract_zip(gtfs_url, './gtfs_full')
+def getGtfsUrl(gtfs_base_url, gtfs_version):
+    gtfs_url = f"{gtfs_base_url}/{gtfs_version['dir']}/gtfs.zip"
+    print(gtfs_url)
+    return gtfs_url
 
 
 
 # ## 3. filter relevant routes, trips and stop_times
-# 
+#
 # Before we start, lets load the data from the filesystem.
+# loadGtfs reads the extracted tables, loadGtfsFromZip (see below) reads them straight from the zip in chunks.
+# Only the columns of feed_schema are read, with fixed dtypes (see gtfs_schema.py).
 
 # In[28]:
 
 
-gtfs_path = path.join(getcwd(), 'gtfs_full')
-calendar_path = path.join(gtfs_path, 'calendar.txt')
-routes_path = path.join(gtfs_path, 'routes.txt')
-trips_path = path.join(gtfs_path, 'trips.txt')
-stops_path = path.join(gtfs_path, 'stops.txt')
-stop_times_path = path.join(gtfs_path, 'stop_times.txt')
+def loadGtfs(gtfs_path):
+    calendar_path = path.join(gtfs_path, 'calendar.txt')
+    calendar_dates_path = path.join(gtfs_path, 'calendar_dates.txt')
+    routes_path = path.join(gtfs_path, 'routes.txt')
+    trips_path = path.join(gtfs_path, 'trips.txt')
+    stops_path = path.join(gtfs_path, 'stops.txt')
+    stop_times_path = path.join(gtfs_path, 'stop_times.txt')
 
-calendar:DataFrame = read_csv(calendar_path)
-routes:DataFrame = read_csv(routes_path)
-trips:DataFrame = read_csv(trips_path)
-stops:DataFrame = read_csv(stops_path)
-stop_times:DataFrame = read_csv(stop_times_path)
+    calendar:DataFrame = readGtfsCsv(calendar_path, feed_schema['calendar'])
+    # calendar_dates.txt is optional in gtfs
+    calendar_dates:DataFrame = readGtfsCsv(calendar_dates_path, feed_schema['calendar_dates']) if path.exists(calendar_dates_path) else DataFrame({'service_id': [], 'date': [], 'exception_type': []})
+    routes:DataFrame = readGtfsCsv(routes_path, feed_schema['routes'])
+    trips:DataFrame = readGtfsCsv(trips_path, feed_schema['trips'])
+    stops:DataFrame = readGtfsCsv(stops_path, feed_schema['stops'])
+    stop_times:DataFrame = readGtfsCsv(stop_times_path, feed_schema['stop_times'])
 
-print('read gtfs static data from files')
+    print('read gtfs static data from files')
+
+    return calendar, calendar_dates, routes, trips, stops, stop_times
 
 
 # First, we want to remove all unneccessary data entries.
-# As we will focus on the line 22 for the start, we only want routes, trips and stop_times for the line 22. 
+# As we will focus on the line 22 for the start, we only want routes, trips and stop_times for the line 22.
 
 # In[29]:
 
 
-relevant_lines = ['22', '26', '5', '23', '21', '24']
-relevant_trip_prefixes = [line + "-" for line in relevant_lines]
+# relevant_lines in the .env file, e.g. 22,26,5 or all (see gtfs_lines.py)
+relevant_lines = getRelevantLines()
+relevant_trip_prefixes = getTripPrefixes(relevant_lines)
+
+# the columns that are kept of each table
+routes_columns = list(feed_schema['routes'].columns)
+trips_columns = list(feed_schema['trips'].columns)
+stop_times_columns = list(feed_schema['stop_times'].columns)
 
 
 # To achieve this, we firstly  select all rows from the routes that have a ´route_id´ starting with 22, indicating the route to be on line 22. By doing this instead of looking at the ´route_short_name´, special services like line E for shortened services to and from the depot are included.
@@ -154,14 +188,17 @@ relevant_trip_prefixes = [line + "-" for line in relevant_lines]
 # In[30]:
 
 
-# select relevant columns
-routes = routes[['route_id', 'route_short_name', 'route_desc', 'route_color']]
+def filterRoutes(routes):
+    # select relevant columns
+    routes = routes[routes_columns]
 
-# select only routes of relevant lines, indicated by the route_id 
-routes = routes.loc[routes['route_id'].str.startswith(tuple(relevant_trip_prefixes))]
+    # select only routes of relevant lines, indicated by the route_id
+    routes = routes.loc[routes['route_id'].str.startswith(tuple(relevant_trip_prefixes))]
 
-print('found ',routes.shape[0], 'routes on lines', relevant_lines)
-print(routes.head(5))
+    print('found ',routes.shape[0], 'routes on lines', relevant_lines)
+    print(routes.head(5))
+
+    return routes
 
 
 # Let's do the same with trips.
@@ -169,14 +206,17 @@ print(routes.head(5))
 # In[31]:
 
 
-# select relevant columns
-trips = trips[["route_id","trip_id", "service_id", "trip_short_name"]]
+def filterTrips(trips):
+    # select relevant columns
+    trips = trips[trips_columns]
+
+    # select only trips of relevant lines, indicated by the trip_id
+    trips = trips.loc[trips['trip_id'].str.startswith(tuple(relevant_trip_prefixes))]
 
-# select only trips of relevant lines, indicated by the trip_id 
-trips = trips.loc[trips['trip_id'].str.startswith(tuple(relevant_trip_prefixes))]
+    print('found ',trips.shape[0], 'trips on lines', relevant_lines)
+    print(trips.head(5))
 
-print('found ',trips.shape[0], 'trips on lines', relevant_lines)
-print(trips.head(5))
+    return trips
 
 
 # And finally, we also filter the stop_times by looking at the prefix of the trip_id.
@@ -184,14 +224,91 @@ print(trips.head(5))
 # In[32]:
 
 
-# select relevant columns
-stop_times = stop_times[["trip_id", "arrival_time", "departure_time", "stop_sequence", "stop_id"]]
+def filterStopTimes(stop_times):
+    # select relevant columns
+    stop_times = stop_times[stop_times_columns]
+
+    # select only stop_times of relevant lines, indicated by the trip_id
+    stop_times = stop_times.loc[stop_times['trip_id'].str.startswith(tuple(relevant_trip_prefixes))]
+
+    print('found ',stop_times.shape[0], 'stop times on lines', relevant_lines)
+    print(stop_times.head(5))
+
+    return stop_times
+
+
+# For the whole network, stop_times.txt alone has millions of rows. Instead of extracting the zip and reading every table completely,
+# loadGtfsFromZip reads the members straight from the zip in chunks of gtfs_chunk_rows rows, only with the columns that are kept,
+# and drops the rows of other lines from every chunk. So the peak memory depends on the chunk size and the relevant lines, not on the size of the feed.
+# The result is the same as loadGtfs + filterRoutes / filterTrips / filterStopTimes.
+
+# In[ ]:
+
+
+gtfs_chunk_rows = 100000
+
+# rows of a zip member, the columns of the schema and the trip / route id prefix filter are applied chunk by chunk
+def readZipMember(zip_file, member_name, table_schema, prefix_column=None):
+    with zip_file.open(member_name) as member:
+        columns = table_schema.getColumns(read_csv(member, nrows=0, encoding='utf-8-sig').columns)
+
+    with zip_file.open(member_name) as member:
+        chunks = []
+        for chunk in read_csv(member, usecols=None if table_schema.all_columns else list(columns), dtype=columns, encoding='utf-8-sig', chunksize=gtfs_chunk_rows):
+            if prefix_column is not None:
+                chunk = chunk.loc[chunk[prefix_column].str.startswith(tuple(relevant_trip_prefixes))]
+            chunks.append(chunk)
 
-# select only stop_times of relevant lines, indicated by the trip_id 
-stop_times = stop_times.loc[stop_times['trip_id'].str.startswith(tuple(relevant_trip_prefixes))]
+    return concat(chunks, ignore_index=True)
 
-print('found ',stop_times.shape[0], 'stop times on lines', relevant_lines)
-print(stop_times.head(5))
+
+def loadGtfsFromZip(zip_path):
+    with zipfile.ZipFile(zip_path) as zip_file:
+        member_names = zip_file.namelist()
+
+        calendar:DataFrame = readZipMember(zip_file, 'calendar.txt', feed_schema['calendar'])
+        # calendar_dates.txt is optional in gtfs
+        calendar_dates:DataFrame = readZipMember(zip_file, 'calendar_dates.txt', feed_schema['calendar_dates']) if 'calendar_dates.txt' in member_names else DataFrame({'service_id': [], 'date': [], 'exception_type': []})
+        # same column order as selecting the columns of the complete table
+        routes:DataFrame = readZipMember(zip_file, 'routes.txt', feed_schema['routes'], 'route_id')[routes_columns]
+        trips:DataFrame = readZipMember(zip_file, 'trips.txt', feed_schema['trips'], 'trip_id')[trips_columns]
+        stops:DataFrame = readZipMember(zip_file, 'stops.txt', feed_schema['stops'])
+        stop_times:DataFrame = readZipMember(zip_file, 'stop_times.txt', feed_schema['stop_times'], 'trip_id')[stop_times_columns]
+
+    print('read', routes.shape[0], 'routes,', trips.shape[0], 'trips and', stop_times.shape[0], 'stop times on lines', relevant_lines, 'from', zip_path)
+
+    return calendar, calendar_dates, routes, trips, stops, stop_times
+
+
+# ### fill missing arrivals and departures
+# gtfs allows stops without arrival_time and departure_time (non-timepoints, e.g. on bus lines with relevant_lines=all).
+# A missing arrival or departure is taken from the other time of the same stop, stops without both are interpolated linearly
+# between the previous and the next stop of the trip with times (see gtfs_time.py). Stop times of trips without any times are dropped.
+# All following steps can rely on complete HH:MM:SS times.
+
+# In[ ]:
+
+
+def fillMissingTimes(stop_times):
+    # empty values are read as NaN
+    if not stop_times[['arrival_time', 'departure_time']].isna().to_numpy().any():
+        return stop_times
+
+    stop_times = stop_times.sort_values(by=['trip_id', 'stop_sequence'], kind='stable')
+    arrival_seconds = parseGtfsTimestringsAsSeconds(stop_times['arrival_time']).astype('Int64')
+    departure_seconds = parseGtfsTimestringsAsSeconds(stop_times['departure_time']).astype('Int64')
+    missing_stops = (arrival_seconds.isna() & departure_seconds.isna()).sum()
+
+    arrival_seconds = interpolateMissingSeconds(stop_times['trip_id'], arrival_seconds.fillna(departure_seconds))
+    departure_seconds = interpolateMissingSeconds(stop_times['trip_id'], departure_seconds.fillna(arrival_seconds))
+
+    has_times = arrival_seconds.notna().to_numpy()
+    print(f"interpolated the times of {missing_stops} stop times, dropped {(~has_times).sum()} stop times of trips without times")
+
+    stop_times = stop_times.loc[has_times].copy()
+    stop_times['arrival_time'] = formatSecondsAsGtfsTimestrings(arrival_seconds[has_times].astype('int64'))
+    stop_times['departure_time'] = formatSecondsAsGtfsTimestrings(departure_seconds[has_times].astype('int64'))
+    return stop_times
 
 
 # ## 4. (optional) adjust arrivals and departures for visualization
@@ -200,91 +317,191 @@ print(stop_times.head(5))
 # In[33]:
 
 
-def addArtificialDepartureDelay(row):
-    departure_time_object = parseGtfsTimestringAsTimeObject(row['departure_time'])
-    adjusted_departure_time_object = addSecondsToTimeObject(departure_time_object, 15)
-    row['departure_time'] = adjusted_departure_time_object.isoformat()
-    return row
+artificial_departure_delay_seconds = 15
+
+# the whole departure_time column is shifted at once, times after midnight (e.g. 24:10:00) stay valid gtfs times instead of wrapping to 00:10:15
+def addArtificialDepartureDelay(stop_times):
+    departure_seconds = parseGtfsTimestringsAsSeconds(stop_times['departure_time']) + artificial_departure_delay_seconds
 
-stop_times = stop_times.apply(addArtificialDepartureDelay, axis=1)
-print(stop_times[:5])
+    stop_times = stop_times.copy()
+    stop_times['departure_time'] = formatSecondsAsGtfsTimestrings(departure_seconds)
+    return stop_times
+
+
+# Besides the HH:MM:SS strings, every arrival and departure is also stored as integer seconds since the start of the service day,
+# so the extraction can compare times without parsing strings, including times after midnight (e.g. 24:15:00 = 87300).
+
+# In[34]:
+
+
+def addServiceDaySeconds(stop_times):
+    stop_times = stop_times.copy()
+    stop_times['arrival_seconds'] = parseGtfsTimestringsAsSeconds(stop_times['arrival_time'])
+    stop_times['departure_seconds'] = parseGtfsTimestringsAsSeconds(stop_times['departure_time'])
+    return stop_times
 
 
 # ## 5. add start and end times to trips
 
 # To make it easy to identify the active trips, we will now add start and end times to each trip.
-# First, we will create a function to get all the stop_times for a specific ´trip_id´. Then we will sort the stop_times and return the first ´arrival_time´ as trip start and the last ´departure_time´ as trip end.
+# Instead of searching the stop_times of every single trip, we sort all stop_times once by ´trip_id´ and ´stop_sequence´ and group them by ´trip_id´.
+# The first ´arrival_time´ of each group is the trip start and the last ´departure_time´ is the trip end.
 
-# In[34]:
+# In[35]:
 
 
-def getTripStartTime(trip_id:str) -> tuple[str, str]:
-    relevant_stop_times = stop_times.loc[stop_times['trip_id'] == trip_id]
-    #print('found ',relevant_stop_times.shape[0], 'relevant stop times for trip_id', trip_id)
+def getTripStartAndEndTimes(stop_times) -> DataFrame:
+    sorted_stop_times = stop_times.sort_values(by=['trip_id', 'stop_sequence'], kind='stable')
+    stop_times_by_trip = sorted_stop_times.groupby('trip_id', sort=False)
 
-    relevant_stop_times = relevant_stop_times.sort_values(by=['stop_sequence'])
+    return DataFrame({'start_time': stop_times_by_trip['arrival_time'].first(),
+                      'end_time': stop_times_by_trip['departure_time'].last(),
+                      'start_seconds': stop_times_by_trip['arrival_seconds'].first(),
+                      'end_seconds': stop_times_by_trip['departure_seconds'].last()})
 
-    first_stop = relevant_stop_times.iloc[0]
-    trip_start_time = first_stop.loc['arrival_time']
 
-    return trip_start_time
+# Now let's add the new columns by mapping every trip to its start and end time.
 
-def getTripEndTime(trip_id:str) -> tuple[str, str]:
-    relevant_stop_times = stop_times.loc[stop_times['trip_id'] == trip_id]
-    #print('found ',relevant_stop_times.shape[0], 'relevant stop times for trip_id', trip_id)
+# In[36]:
 
-    relevant_stop_times = relevant_stop_times.sort_values(by=['stop_sequence'])
 
-    last_stop = relevant_stop_times.iloc[-1]
-    trip_end_time = last_stop.loc['departure_time']
+def addStartAndEndTimesToTrips(trips, stop_times):
+    trip_start_and_end_times = getTripStartAndEndTimes(stop_times)
 
-    return trip_end_time
+    trips = trips.copy()
+    for column in ['start_time', 'end_time', 'start_seconds', 'end_seconds']:
+        trips[column] = trips['trip_id'].map(trip_start_and_end_times[column])
 
-example_trip_id = trips.iloc[0].loc['trip_id']
-example_start = getTripStartTime(example_trip_id)
-example_end = getTripEndTime(example_trip_id)
-print('trip_id:', example_trip_id, '\nTrip Start Time: ', example_start, '\nTrip End Time: ', example_end)
+    print(trips.head(5))
 
+    return trips
 
-# Now let's add the new columns by using the function we just created.
 
-# In[35]:
+# ## 6. expand the calendar into the trips of every service day
+# For every service date of the feed, the trips that run on it (calendar.txt weekdays and date ranges, calendar_dates.txt exceptions),
+# sorted by their start, so the extraction can find the running trips with a binary search, see gtfs_service_days.py
 
+# In[37]:
 
-trips['start_time'] = trips.apply(lambda row: getTripStartTime(row['trip_id']), axis=1)
-trips['end_time'] = trips.apply(lambda row: getTripEndTime(row['trip_id']), axis=1)
 
-print(trips.head(5))
+def getServiceDayTrips(calendar, calendar_dates, trips):
+    service_day_trips = buildServiceDayTrips(calendar, calendar_dates, trips)
 
+    print('found', service_day_trips.shape[0], 'trips on', service_day_trips['service_date'].nunique(), 'service days')
+    print(service_day_trips.head(5))
 
-# ## 6. save filtered data to filesystem
+    return service_day_trips
 
-# In[36]:
 
+# ## 7. save filtered data to filesystem
 
-import os
+# In[38]:
 
-gtfs_filtered_path = path.join(getcwd(), 'gtfs_filtered')
 
-if not os.path.exists(gtfs_filtered_path):
-   os.makedirs(gtfs_filtered_path)
+import os
 
-calendar_filtered_path = path.join(gtfs_filtered_path, 'calendar.txt')
-routes_filtered_path = path.join(gtfs_filtered_path, 'routes.txt')
-trips_filtered_path = path.join(gtfs_filtered_path, 'trips.txt')
-stops_filtered_path = path.join(gtfs_filtered_path, 'stops.txt')
-stop_times_filtered_path = path.join(gtfs_filtered_path, 'stop_times.txt')
+def saveFiltered(calendar, calendar_dates, routes, trips, stops, stop_times, service_day_trips, gtfs_filtered_path):
+    if not os.path.exists(gtfs_filtered_path):
+       os.makedirs(gtfs_filtered_path)
 
+    calendar_filtered_path = path.join(gtfs_filtered_path, 'calendar.txt')
+    calendar_dates_filtered_path = path.join(gtfs_filtered_path, 'calendar_dates.txt')
+    routes_filtered_path = path.join(gtfs_filtered_path, 'routes.txt')
+    trips_filtered_path = path.join(gtfs_filtered_path, 'trips.txt')
+    stops_filtered_path = path.join(gtfs_filtered_path, 'stops.txt')
+    stop_times_filtered_path = path.join(gtfs_filtered_path, 'stop_times.txt')
+    service_day_trips_filtered_path = path.join(gtfs_filtered_path, 'service_day_trips.txt')
 
-calendar.to_csv(calendar_filtered_path, index=False)
-routes.to_csv(routes_filtered_path, index=False)
-trips.to_csv(trips_filtered_path, index=False)
-stops.to_csv(stops_filtered_path, index=False)
-stop_times.to_csv(stop_times_filtered_path, index=False)
 
+    calendar.to_csv(calendar_filtered_path, index=False)
+    calendar_dates.to_csv(calendar_dates_filtered_path, index=False)
+    routes.to_csv(routes_filtered_path, index=False)
+    trips.to_csv(trips_filtered_path, index=False)
+    stops.to_csv(stops_filtered_path, index=False)
+    stop_times.to_csv(stop_times_filtered_path, index=False)
+    service_day_trips.to_csv(service_day_trips_filtered_path, index=False)
 
-# In[ ]:
+    # typed binary snapshot for the extraction, see gtfs_snapshot.py
+    writeSnapshot({'calendar': calendar, 'routes': routes, 'trips': trips, 'stops': stops, 'stop_times': stop_times,
+                   'service_day_trips': service_day_trips}, gtfs_filtered_path)
 
 
+# In[ ]:
 
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--extract", action="store_true", help="Extract the complete gtfs zip to gtfs_full and read all tables into memory, instead of streaming the relevant rows from the zip")
+    parser.add_argument("--force", action="store_true", help="Build the filtered feed again, even if the active version was built from the same gtfs version and lines")
+    parser.add_argument("--keep-versions", action="store", help=f"Number of filtered feed versions kept in gtfs_versions for a rollback. Default: {default_kept_versions}", default=default_kept_versions, type=int)
+    parser.add_argument("--rollback", action="store_true", help="Point gtfs_filtered to the previous version and exit")
+    args = parser.parse_args()
+
+    version_store = GtfsVersionStore(path.join(getcwd(), 'gtfs_filtered'), kept_versions=args.keep_versions)
+    if args.rollback:
+        version_store.rollback()
+        raise SystemExit()
+
+    load_dotenv()
+
+    # one keep-alive session for the version overview and the zip download
+    session = createSession()
+
+    gtfs_base_url = getenv('gtfs_base_url')
+    gtfs_version = getGtfsVersion(session, gtfs_base_url)
+    gtfs_url = getGtfsUrl(gtfs_base_url, gtfs_version)
+
+    # nothing to do if this gtfs version was already filtered for the same lines
+    version_key = getVersionKey(gtfs_version['dir'], gtfs_version['modified'], relevant_lines)
+    stored_version = None if args.force else version_store.findVersion(relevant_lines, version_key=version_key)
+    if stored_version is not None:
+        print(f"gtfs version {version_key} is already preprocessed")
+        if version_store.getActiveVersionDir() != stored_version['dir']:
+            version_store.activateVersion(stored_version['dir'])
+        version_store.pruneVersions()
+        raise SystemExit()
+
+    # fetch data
+    # the zip is only needed to build the version, it is deleted when the version is published or a stored version is used
+    gtfs_zip_path = path.join(getcwd(), 'gtfs.zip')
+    try:
+        if args.extract:
+            zip_sha256 = download_and_extract_zip(session, gtfs_url, './gtfs_full')
+        else:
+            zip_sha256 = download_zip(session, gtfs_url, gtfs_zip_path)
+
+        # the same feed under another version, e.g. uploaded again
+        stored_version = None if args.force else version_store.findVersion(relevant_lines, zip_sha256=zip_sha256)
+        if stored_version is not None:
+            print(f"gtfs zip of {version_key} is identical to the stored version {stored_version['key']}")
+            if version_store.getActiveVersionDir() != stored_version['dir']:
+                version_store.activateVersion(stored_version['dir'])
+            version_store.pruneVersions()
+            raise SystemExit()
+
+        if args.extract:
+            calendar, calendar_dates, routes, trips, stops, stop_times = loadGtfs(path.join(getcwd(), 'gtfs_full'))
+
+            routes = filterRoutes(routes)
+            trips = filterTrips(trips)
+            stop_times = filterStopTimes(stop_times)
+        else:
+            calendar, calendar_dates, routes, trips, stops, stop_times = loadGtfsFromZip(gtfs_zip_path)
+
+        stop_times = fillMissingTimes(stop_times)
+        stop_times = addArtificialDepartureDelay(stop_times)
+        stop_times = addServiceDaySeconds(stop_times)
+        print(stop_times[:5])
+
+        trips = addStartAndEndTimesToTrips(trips, stop_times)
+
+        service_day_trips = getServiceDayTrips(calendar, calendar_dates, trips)
+
+        # written next to the active version and swapped in when complete, see gtfs_versions.py
+        build_path = version_store.createBuildPath(version_key)
+        saveFiltered(calendar, calendar_dates, routes, trips, stops, stop_times, service_day_trips, build_path)
+        version_store.publishVersion(build_path, version_key, gtfs_version['dir'], gtfs_version['modified'], gtfs_url, zip_sha256, relevant_lines)
+        version_store.pruneVersions()
+    finally:
+        if not args.extract and path.exists(gtfs_zip_path):
+            os.remove(gtfs_zip_path)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# # Replay recorded trip updates
+# Runs the extraction of extract_active_vehicles.py on trip updates recorded with --record (see gtfs_rt_recording.py) instead of the realtime api,
+# so it needs no credentials and gives the same result on every run. The static data is gtfs_filtered and the led mapping of the working directory,
+# loaded once, so the recording should be replayed against the feed it was recorded with (e.g. a copy of a version directory in gtfs_versions).
+# The replayed time starts at --start and advances by --interval seconds per tick, as fast as possible (default)
+# or --speed times faster than real time (1 = real time, e.g. to watch the replay on the panel with --frame-file led-matrix.frame).
+#
+# Every tick writes its frames to the --frames directory as <replayed time>.frame (the format of led-matrix.frame),
+# also if the frame did not change, so two replays can be compared frame by frame:
+# --golden compares every frame with the frame of an earlier replay (golden frames) and exits with status 1 if a frame differs.
+# At the end, the median, 95th percentile and maximum of every stage of a tick are printed (see StageTimer in extract_active_vehicles.py),
+# --timings writes the stages of every tick to a csv file.
+#
+# usage:
+# python replay_trip_updates.py --recording recordings/2024-10-15 --frames golden-frames
+# python replay_trip_updates.py --recording recordings/2024-10-15 --start 2024-10-15T07:00:00 --end 2024-10-15T09:00:00 --golden golden-frames --timings timings.csv
+# python replay_trip_updates.py --recording recordings/2024-10-15 --speed 10 --frame-file led-matrix.frame
+
+import argparse
+import datetime
+import io
+import os
+import sys
+import time
+from contextlib import redirect_stdout
+
+import numpy as np
+import pandas as pd
+
+import extract_active_vehicles
+from extract_active_vehicles import LedMatrixOutput, StageTimer, StaticData, relevant_trip_prefixes, tick
+from gtfs_rt_recording import ReplayTripUpdatesFetcher, readRecording, recording_time_format
+from led_frame import getFrameSize, readFrameFile, writeFrameFile
+
+
+# True if the golden frame file has the same phases and realtime flag, the time it was written is ignored
+def isSameAsGoldenFrame(golden_frame_path, frames, using_realtime):
+    if not os.path.exists(golden_frame_path):
+        return False
+
+    golden_frames, _, golden_using_realtime = readFrameFile(golden_frame_path)
+    return (golden_using_realtime == using_realtime and len(golden_frames) == len(frames)
+            and all(np.array_equal(golden_frame.pixels, frame.pixels) for golden_frame, frame in zip(golden_frames, frames)))
+
+
+def printStageTimings(stage_timers):
+    print(f"{'stage':<8}{'median ms':>11}{'p95 ms':>9}{'max ms':>9}")
+    for stage in StageTimer.stages:
+        # the static data is only loaded once, before the first tick
+        if stage == 'load':
+            continue
+        durations = np.array([stage_timer.durations[stage] for stage_timer in stage_timers]) * 1000
+        print(f"{stage:<8}{np.median(durations):>11.1f}{np.percentile(durations, 95):>9.1f}{durations.max():>9.1f}")
+
+    durations = np.array([stage_timer.getTotal() for stage_timer in stage_timers]) * 1000
+    print(f"{'tick':<8}{np.median(durations):>11.1f}{np.percentile(durations, 95):>9.1f}{durations.max():>9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--recording", action="store", help="Directory of the recorded trip updates (extract_active_vehicles.py --record)", required=True, type=str)
+    parser.add_argument("--start", action="store", help="First replayed time (ISO format). Default: time of the first recorded feed", default=None, type=str)
+    parser.add_argument("--end", action="store", help="Last replayed time (ISO format). Default: time of the last recorded feed", default=None, type=str)
+    parser.add_argument("--interval", action="store", help="Replayed seconds between two ticks. Default: 10", default=10, type=float)
+    parser.add_argument("--speed", action="store", help="Replay speed, 1 is real time, 0 as fast as possible. Default: 0", default=0, type=float)
+    parser.add_argument("--max-age", action="store", help="Seconds a recorded feed is used before the tick falls back to the schedule. Default: 120", default=120, type=float)
+    parser.add_argument("--frames", action="store", help="Directory to write the frame of every tick to. Default: no frames", default=None, type=str)
+    parser.add_argument("--golden", action="store", help="Directory with the frames of an earlier replay to compare the frames with. Default: no comparison", default=None, type=str)
+    parser.add_argument("--frame-file", action="store", help="Also write every changed frame to this frame file, e.g. led-matrix.frame for the display process", default=None, type=str)
+    parser.add_argument("--timings", action="store", help="Csv file for the stages of every tick. Default: no file", default=None, type=str)
+    parser.add_argument("--verbose", action="store_true", help="Print the output of the ticks")
+    # same panel options as extract_active_vehicles.py
+    parser.add_argument("-r", "--led-rows", action="store", help="Display rows. Default: 32", default=32, type=int)
+    parser.add_argument("--led-cols", action="store", help="Panel columns. Default: 64", default=64, type=int)
+    parser.add_argument("-c", "--led-chain", action="store", help="Daisy-chained boards. Default: 1.", default=1, type=int)
+    parser.add_argument("-P", "--led-parallel", action="store", help="Parallel chains. Default: 1", default=1, type=int)
+    args = parser.parse_args()
+
+    recording = readRecording(args.recording)
+    start_datetime = datetime.datetime.fromisoformat(args.start) if args.start is not None else recording[0].recorded_at
+    end_datetime = datetime.datetime.fromisoformat(args.end) if args.end is not None else recording[-1].recorded_at
+    if args.frames is not None:
+        os.makedirs(args.frames, exist_ok=True)
+
+    load_timer = StageTimer()
+    static_data = StaticData(frame_size=getFrameSize(args.led_cols, args.led_rows, args.led_chain, args.led_parallel))
+    with load_timer.measure('load'):
+        static_data.load()
+
+    trip_updates_fetcher = ReplayTripUpdatesFetcher(recording, relevant_trip_prefixes, args.max_age)
+    # no frame channel, the frames only go to the files given by the options
+    led_matrix_output = LedMatrixOutput(frame_path=args.frame_file)
+
+    stage_timers = []
+    timing_rows = []
+    differing_frame_names = []
+    realtime_ticks = 0
+    frames = None
+    current_datetime = start_datetime
+    while current_datetime <= end_datetime:
+        tick_start = time.monotonic()
+        stage_timer = StageTimer()
+        trip_updates_fetcher.setCurrentDatetime(current_datetime)
+
+        with redirect_stdout(sys.stdout if args.verbose else io.StringIO()):
+            changed_frames = tick(static_data, trip_updates_fetcher, led_matrix_output, current_datetime, stage_timer)
+        # None if the led matrix did not change
+        frames = changed_frames if changed_frames is not None else frames
+        using_realtime = trip_updates_fetcher.current_feed is not None
+        realtime_ticks += using_realtime
+
+        frame_name = f"{current_datetime.strftime(recording_time_format)}.frame"
+        if args.frames is not None:
+            writeFrameFile(os.path.join(args.frames, frame_name), frames, using_realtime)
+        if args.golden is not None and not isSameAsGoldenFrame(os.path.join(args.golden, frame_name), frames, using_realtime):
+            differing_frame_names.append(frame_name)
+
+        stage_timers.append(stage_timer)
+        timing_rows.append({'replayed_time': current_datetime.isoformat(), 'using_realtime': using_realtime,
+                            'recorded_feed': os.path.basename(trip_updates_fetcher.current_feed.feed_path) if using_realtime else None,
+                            'frame_changed': changed_frames is not None,
+                            **{f'{stage}_ms': round(duration * 1000, 3) for stage, duration in stage_timer.durations.items()}})
+
+        if args.speed > 0:
+            time.sleep(max(0, args.interval / args.speed - (time.monotonic() - tick_start)))
+        current_datetime += datetime.timedelta(seconds=args.interval)
+
+    if len(stage_timers) == 0:
+        raise Exception(f"no ticks between {start_datetime} and {end_datetime}")
+
+    print(f"\nreplayed {len(stage_timers)} ticks from {start_datetime} to {end_datetime} with {len(recording)} recorded feeds, "
+          f"{realtime_ticks} ticks with realtime data, {len(static_data.trips)} trips of the lines {', '.join(extract_active_vehicles.relevant_lines)}")
+    print(f"static data load {load_timer.durations['load']:.2f}s")
+    printStageTimings(stage_timers)
+
+    if args.timings is not None:
+        pd.DataFrame(timing_rows).to_csv(args.timings, index=False)
+        print(f"wrote the stages of every tick to {args.timings}")
+    if args.frames is not None:
+        print(f"wrote {len(stage_timers)} frames to {args.frames}")
+
+    if args.golden is not None:
+        if len(differing_frame_names) > 0:
+            print(f"{len(differing_frame_names)} of {len(stage_timers)} frames differ from {args.golden}, e.g. {', '.join(differing_frame_names[:5])}")
+            sys.exit(1)
+        print(f"all {len(stage_timers)} frames match {args.golden}")